@@ -1,2 +1,6 @@
 __version__ = '0.7'
 DEFAULT_DATETIME_FORMAT = '%d/%m/%Y'
+
+
+class QifParserException(Exception):
+    pass
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""Parse QIF data read from asyncio streams.
+
+This module needs Python 3.6 or later, for asynchronous generators.
+"""
+from qifparse.files import DEFAULT_ENCODING
+from qifparse.parser import DEFAULT_BLOCK_SIZE
+from qifparse.push import PushParser
+
+
+async def iterparse(source, date_format=None, fixed_point=None,
+                    encoding=DEFAULT_ENCODING, block_size=DEFAULT_BLOCK_SIZE,
+                    parser=None):
+    """Yield the records of a QIF file as they are read from source.
+
+    source is an asyncio.StreamReader, read block_size bytes at a time, or
+    an asynchronous iterable of bytes (or text) pieces, such as the body
+    of an HTTP upload.  The records are yielded as the (item, header,
+    account) tuples of QifParser.iterparse; see qifparse.push.PushParser
+    for the other arguments.
+    """
+    push_parser = PushParser(date_format, fixed_point, encoding, parser)
+    if hasattr(source, 'read'):
+        while True:
+            data = await source.read(block_size)
+            if not data:
+                break
+            for entry in push_parser.feed(data):
+                yield entry
+    else:
+        async for data in source:
+            for entry in push_parser.feed(data):
+                yield entry
+    for entry in push_parser.close():
+        yield entry
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+
+# Number of decimal digits kept for each kind of quantity, when amounts are
+# parsed as fixed point integers
+DEFAULT_SCALES = {
+    'amount': 2,
+    'price': 6,
+    'quantity': 6,
+}
+
+# Number of the quantities kept by a DecimalCache
+DECIMAL_CACHE_SIZE = 4096
+
+
+class DecimalCache(dict):
+    """The Decimals of the QIF quantities already converted, keyed by their
+    text: the amounts of a file repeat a lot, and Decimals are immutable.
+
+    cache[text] converts a quantity like "-1,234.50" the way
+    QifParser.parseFloat does.  The cache is emptied once it holds
+    maxsize quantities.
+    """
+
+    def __init__(self, maxsize=DECIMAL_CACHE_SIZE):
+        dict.__init__(self)
+        self.maxsize = maxsize
+
+    def __missing__(self, text):
+        if len(self) >= self.maxsize:
+            self.clear()
+        value = self[text] = Decimal(text.replace(',', ''))
+        return value
+
+
+class FixedPoint(int):
+    """A quantity stored as an integer number of 10 ** -scale units.
+
+    FixedPoint(1234) of scale 2 means 12.34.  Subclasses fixing the scale
+    are created by fixed_point_type; as with any int, the result of the
+    arithmetic is a plain int in the same units, so only quantities of
+    the same scale should be mixed.
+    """
+    __slots__ = ()
+    scale = 0
+
+    @classmethod
+    def parse(cls, text):
+        """convert a QIF quantity like "-1,234.5" without using Decimal
+
+        Digits beyond the scale are rounded half to even.
+        """
+        text = text.replace(',', '').strip()
+        negative = text.startswith('-')
+        if negative or text.startswith('+'):
+            text = text[1:]
+        (whole, _, fraction) = text.partition('.')
+        if not (whole + fraction).isdigit():
+            raise ValueError("invalid quantity: %r" % text)
+        scale = cls.scale
+        value = int((whole or '0') + fraction[:scale].ljust(scale, '0'))
+        rest = fraction[scale:]
+        if rest.strip('0'):
+            half = '5'.ljust(len(rest), '0')
+            if rest > half or (rest == half and value % 2):
+                value += 1
+        return cls(-value if negative else value)
+
+    def format(self, places=None):
+        """format with the given number of decimals, rounding half to even"""
+        if places is None:
+            places = self.scale
+        value = int(self)
+        if places < self.scale:
+            divisor = 10 ** (self.scale - places)
+            (value, rest) = divmod(value, divisor)
+            if 2 * rest > divisor or (2 * rest == divisor and value % 2):
+                value += 1
+        else:
+            value *= 10 ** (places - self.scale)
+        sign = value < 0 and '-' or ''
+        digits = str(abs(value)).rjust(places + 1, '0')
+        if not places:
+            return sign + digits
+        return sign + digits[:-places] + '.' + digits[-places:]
+
+    def to_decimal(self):
+        return Decimal(int(self)).scaleb(-self.scale)
+
+    def __str__(self):
+        return self.format()
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.format())
+
+    def __reduce__(self):
+        # the classes made by fixed_point_type can't be pickled by name
+        return (_restore_fixed_point, (self.scale, int(self)))
+
+
+_types = {}
+
+
+def fixed_point_type(scale):
+    """Return the FixedPoint subclass for the given scale."""
+    if scale not in _types:
+        name = scale == 2 and 'Cents' or 'FixedPoint%d' % scale
+        _types[scale] = type(
+            name, (FixedPoint,), {'__slots__': (), 'scale': scale})
+    return _types[scale]
+
+
+Cents = fixed_point_type(2)
+
+
+def _restore_fixed_point(scale, value):
+    return fixed_point_type(scale)(value)
+
+
+def fixed_point_types(fixed_point):
+    """Map each kind of quantity to the FixedPoint type to parse it with.
+
+    fixed_point is either a false value, meaning amounts are not parsed
+    as fixed point integers (None is returned), True to use
+    DEFAULT_SCALES, or a dictionary overriding some of them, e.g.
+    {'price': 4}.
+    """
+    if not fixed_point:
+        return None
+    scales = dict(DEFAULT_SCALES)
+    if isinstance(fixed_point, dict):
+        scales.update(fixed_point)
+    return dict((kind, fixed_point_type(scale))
+                for kind, scale in scales.items())
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Balances of an account at any date, from running sums of its amounts.
+
+A BalanceIndex keeps the dates of the transactions of an account in
+sorted order, with the running sum of their amounts, so that the balance
+on a date, or its change between two dates, is found with a binary search.
+Account.add_transaction extends the sums when the transaction it adds is
+not dated before the last one indexed; anything else (a transaction added
+out of order, or straight into the lists of the account) makes the index
+be built again by the next query.
+
+The balances are the sums of the amounts of the transactions, as
+Decimals; undated transactions and missing amounts are left out.
+"""
+import six
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+from qifparse.query import date_bounds, to_decimal
+
+
+class BalanceIndex(object):
+    """Running balances of the transactions of an account, by date.
+
+    dates are the dates of the transactions, sorted, and sums[i] the sum
+    of the amounts of the transactions up to dates[i] included; count is
+    the number of transactions indexed, dated or not.
+    """
+
+    def __init__(self, account):
+        self.account = account
+        self.build()
+
+    def build(self):
+        transactions = self.current_lists()
+        entries = []
+        count = 0
+        for items in transactions:
+            count += len(items)
+            for item in items:
+                date = getattr(item, 'date', None)
+                if date is not None:
+                    entries.append((date, getattr(item, 'amount', None)))
+        # sort is stable: the transactions of a day keep their order
+        entries.sort(key=lambda entry: entry[0])
+        self.dates = []
+        self.sums = []
+        total = Decimal(0)
+        for (date, amount) in entries:
+            if amount is not None:
+                total += to_decimal(amount)
+            self.dates.append(date)
+            self.sums.append(total)
+        self.lists = transactions
+        self.count = count
+        self.stale = False
+
+    def current_lists(self):
+        return list(self.account._transactions.values())
+
+    def is_valid(self):
+        """Tell whether the index still matches the transactions of the
+        account."""
+        if self.stale:
+            return False
+        lists = self.current_lists()
+        return len(lists) == len(self.lists) and \
+            all(old is new for (old, new) in zip(self.lists, lists)) and \
+            sum(len(items) for items in lists) == self.count
+
+    def add(self, item):
+        """Index a transaction just added to the account."""
+        if self.stale:
+            return
+        self.lists = self.current_lists()
+        self.count += 1
+        date = getattr(item, 'date', None)
+        if date is None:
+            return
+        if self.dates and date < self.dates[-1]:
+            # built again when needed
+            self.stale = True
+            return
+        amount = getattr(item, 'amount', None)
+        total = self.sums[-1] if self.sums else Decimal(0)
+        if amount is not None:
+            total += to_decimal(amount)
+        self.dates.append(date)
+        self.sums.append(total)
+
+    def balance(self, date=None):
+        """Return the balance at the end of date (at the end of the
+        history without one)."""
+        if date is None:
+            return self.sums[-1] if self.sums else Decimal(0)
+        position = bisect_right(self.dates, date_bounds(None, date)[1])
+        return self.sums[position - 1] if position else Decimal(0)
+
+    def change(self, start, end):
+        """Return the sum of the amounts dated from start to end, both
+        included."""
+        (start, end) = date_bounds(start, end)
+        first = bisect_left(self.dates, start)
+        last = bisect_right(self.dates, end)
+        if last <= first:
+            return Decimal(0)
+        before = self.sums[first - 1] if first else Decimal(0)
+        return self.sums[last - 1] - before
+
+
+def statement_amount(value):
+    """Return a balance amount of an account as a Decimal, or None.
+
+    Parsed amounts of accounts are left as they are in the file, like
+    '1,234.56'.
+    """
+    if value is None:
+        return None
+    if isinstance(value, six.string_types):
+        return Decimal(value.replace(',', '').strip())
+    return to_decimal(value)
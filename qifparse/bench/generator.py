@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""Generate synthetic QIF files, the same ones for the same seed.
+
+Usage: python -m qifparse.bench.generator PATH [--records N] [--seed S]
+
+The files look like the ones exported by Quicken: tags, classes and a tree
+of categories, an auto-switch block listing the accounts, then each account
+with its transactions, and the memorized transactions.  The dates of a
+file use several styles (zero or space padding, and the "'" Quicken
+writes before the years from 2000), all read with DATE_FORMAT; amounts of
+1,000 and more may be written with comma separators.
+
+Accounts have no credit limit nor balance, so that the files can be
+written back by Qif.write once parsed.
+"""
+import argparse
+import io
+import random
+from datetime import datetime, timedelta
+
+# Format of the dates of the generated files, to give to the parser
+DATE_FORMAT = '%m/%d/%y'
+
+# Ways of writing dates: '03/09/99', ' 3/ 9/99', and "3/9'01" (the last
+# one only applies to the years from 2000)
+DATE_STYLES = ('padded', 'spaces', 'quote')
+
+# Number of records written at a time
+WRITE_BATCH_SIZE = 1024
+
+ACCOUNT_TYPES = ('Bank', 'CCard', 'Cash', 'Oth A', 'Oth L')
+INVESTMENT_ACTIONS = ('Buy', 'Sell', 'Div', 'ReinvDiv', 'IntInc', 'ShrsIn',
+                      'ShrsOut', 'BuyX', 'SellX', 'MiscExp')
+SECURITIES = ('IBM', 'Vanguard 500', 'Apple', 'Treasury Bond', 'MSFT',
+              'Fidelity Contrafund')
+PAYEES = ('Grocery Store', 'Gas Station', 'Fancy Car Dealer', 'Electric Co',
+          'Landlord', 'Employer Inc', 'Pharmacy', 'Restaurant', 'Bookshop',
+          'Insurance Co', 'Phone Company', 'Hardware Store')
+CATEGORY_TREE = (
+    ('Auto', ('Gas', 'Insurance', 'Service', 'Registration')),
+    ('Bills', ('Electricity', 'Phone', 'Water', 'Internet')),
+    ('Food', ('Groceries', 'Dining', 'Lunch')),
+    ('Housing', ('Rent', 'Repairs')),
+    ('Medical', ('Doctor', 'Pharmacy')),
+    ('Salary', ()),
+    ('Tax', ('Fed', 'State', 'Soc Sec', 'Medicare')),
+)
+INCOME_CATEGORIES = ('Salary',)
+CLASSES = ('Home', 'Business', 'Vacation')
+TAGS = ('Sandwiches', 'Reimbursable', 'Gift')
+MEMORIZED_TYPES = ('C', 'D', 'P', 'E')
+
+START_DATE = datetime(1995, 1, 1)
+
+
+class QifGenerator(object):
+    """Generate QIF records at random, from a seed.
+
+    accounts is the number of bank-like accounts, and investments the
+    number of investment accounts; split_ratio is the share of the
+    transactions which have splits, comma_ratio the share of the amounts of
+    1,000 and more written with commas.
+    """
+
+    def __init__(self, seed=0, accounts=8, investments=2, memorized=50,
+                 split_ratio=0.15, comma_ratio=0.5, auto_switch=True,
+                 date_styles=DATE_STYLES, newline='\n'):
+        self.random = random.Random(seed)
+        self.accounts = accounts
+        self.investments = investments
+        self.memorized = memorized
+        self.split_ratio = split_ratio
+        self.comma_ratio = comma_ratio
+        self.auto_switch = auto_switch
+        self.date_styles = date_styles
+        self.newline = newline
+        self.categories = []
+        for (parent, children) in CATEGORY_TREE:
+            self.categories.append(parent)
+            self.categories.extend(parent + ':' + child
+                                   for child in children)
+
+    def account_names(self):
+        names = ['%s %d' % (ACCOUNT_TYPES[index % len(ACCOUNT_TYPES)],
+                            index + 1)
+                 for index in range(self.accounts)]
+        names.extend('Brokerage %d' % (index + 1)
+                     for index in range(self.investments))
+        return names
+
+    def format_date(self, date):
+        style = self.random.choice(self.date_styles)
+        if style == 'quote' and date.year >= 2000:
+            # as Quicken writes them: "12/31' 2"
+            return "%d/%d'%2d" % (date.month, date.day, date.year % 100)
+        if style == 'spaces':
+            return '%d/%2d/%02d' % (date.month, date.day, date.year % 100)
+        return date.strftime('%m/%d/%y')
+
+    def format_amount(self, cents):
+        text = '%d.%02d' % (abs(cents) // 100, abs(cents) % 100)
+        if abs(cents) >= 100000 and self.random.random() < self.comma_ratio:
+            (units, decimals) = text.split('.')
+            groups = []
+            while len(units) > 3:
+                groups.insert(0, units[-3:])
+                units = units[:-3]
+            text = ','.join([units] + groups) + '.' + decimals
+        if cents < 0:
+            text = '-' + text
+        return text
+
+    def random_cents(self, large=False):
+        # most amounts are small, a few are large
+        cents = int(self.random.expovariate(1.0 / 8000)) + 1
+        if large or self.random.random() < 0.02:
+            cents *= 100
+        return cents
+
+    def header_records(self):
+        """Yield the records of the tags, classes and categories."""
+        records = []
+        records.append(['!Type:Tag'])
+        for name in TAGS:
+            records[-1].extend(['N' + name])
+            records.append([])
+        records[-1].append('!Type:Class')
+        for name in CLASSES:
+            records[-1].extend(['N' + name, 'D' + name + ' expenses'])
+            records.append([])
+        records[-1].append('!Type:Cat')
+        for name in self.categories:
+            lines = ['N' + name, 'D' + name.replace(':', ' - ')]
+            if name.split(':')[0] in INCOME_CATEGORIES:
+                lines.append('I')
+            else:
+                if name.startswith('Tax'):
+                    lines.extend(['T', 'R%d' % self.random.randint(7000, 7999)])
+                lines.append('E')
+            records[-1].extend(lines)
+            records.append([])
+        records.pop()
+        return records
+
+    def account_lines(self, name):
+        if name.startswith('Brokerage'):
+            atype = 'Invst'
+        else:
+            atype = name.rsplit(' ', 1)[0]
+        return ['N' + name, 'T' + atype, 'D' + name + ' account']
+
+    def transaction_lines(self, date):
+        cents = self.random_cents()
+        if self.random.random() < 0.1:
+            cents *= 10
+        else:
+            cents = -cents
+        amount = self.format_amount(cents)
+        lines = ['D' + self.format_date(date), 'U' + amount, 'T' + amount,
+                 'C' + self.random.choice(('', '*', 'X', 'X'))]
+        if self.random.random() < 0.3:
+            lines.append('N%d' % self.random.randint(100, 9999))
+        lines.append('P' + self.random.choice(PAYEES))
+        if self.random.random() < 0.2:
+            lines.append('Mmemo %d' % self.random.randint(1, 500))
+        category = self.random.choice(self.categories)
+        if self.random.random() < 0.2:
+            category += '/' + self.random.choice(CLASSES)
+        lines.append('L' + category)
+        if self.random.random() < self.split_ratio:
+            lines.extend(self.split_lines(cents))
+        return lines
+
+    def split_lines(self, cents):
+        lines = []
+        count = self.random.randint(2, 6)
+        left = cents
+        for index in range(count):
+            if index == count - 1:
+                part = left
+            else:
+                part = int(left * self.random.uniform(0.1, 0.6))
+            left -= part
+            lines.append('S' + self.random.choice(self.categories))
+            if self.random.random() < 0.5:
+                lines.append('Esplit %d' % (index + 1))
+            lines.append('$' + self.format_amount(part))
+        return lines
+
+    def investment_lines(self, date, accounts):
+        action = self.random.choice(INVESTMENT_ACTIONS)
+        lines = ['D' + self.format_date(date), 'N' + action]
+        if action not in ('IntInc', 'MiscExp'):
+            lines.append('Y' + self.random.choice(SECURITIES))
+        cents = self.random_cents(large=True)
+        if action in ('Buy', 'Sell', 'BuyX', 'SellX', 'ReinvDiv', 'ShrsIn',
+                      'ShrsOut'):
+            price = self.random.randint(1000, 500000)
+            lines.append('I%d.%03d' % (price // 1000, price % 1000))
+            quantity = self.random.randint(1000, 1000000)
+            lines.append('Q%d.%03d' % (quantity // 1000, quantity % 1000))
+            cents = price * quantity // 10000
+        lines.append('C' + self.random.choice(('', 'R', 'X')))
+        lines.append('T' + self.format_amount(cents))
+        if action.endswith('X'):
+            lines.append('L[%s]' % self.random.choice(accounts))
+            lines.append('$' + self.format_amount(cents))
+        if action in ('Buy', 'Sell', 'BuyX', 'SellX') and \
+                self.random.random() < 0.5:
+            lines.append('O%d.%02d' % (self.random.randint(0, 30),
+                                       self.random.randint(0, 99)))
+        if self.random.random() < 0.1:
+            lines.append('Mlot %d' % self.random.randint(1, 100))
+        return lines
+
+    def memorized_lines(self):
+        cents = -self.random_cents()
+        amount = self.format_amount(cents)
+        lines = ['K' + self.random.choice(MEMORIZED_TYPES),
+                 'U' + amount, 'T' + amount,
+                 'P' + self.random.choice(PAYEES),
+                 'L' + self.random.choice(self.categories)]
+        if self.random.random() < 0.2:
+            lines.extend(['A' + self.random.choice(PAYEES),
+                          'A%d Main Street' % self.random.randint(1, 999)])
+        if self.random.random() < self.split_ratio:
+            lines.extend(self.split_lines(cents))
+        return lines
+
+    def iter_records(self, count):
+        """Yield about count records, as lists of lines.
+
+        The first line of a record may be a section header; most of the
+        records are transactions, spread over the accounts.
+        """
+        records = self.header_records()
+        for record in records:
+            yield record
+        names = self.account_names()
+        start = []
+        if self.auto_switch:
+            lines = ['!Option:AutoSwitch', '!Account']
+            for name in names:
+                yield lines + self.account_lines(name)
+                lines = []
+            # the block ends with the first line of the next record
+            start = ['!Clear:AutoSwitch']
+            count -= len(names)
+        count -= len(records) + self.memorized
+        per_account = max(count // len(names) - 1, 0) if names else 0
+        for name in names:
+            yield start + ['!Account'] + self.account_lines(name)
+            start = []
+            investment = name.startswith('Brokerage')
+            header = '!Type:Invst' if investment else \
+                '!Type:' + name.rsplit(' ', 1)[0]
+            date = START_DATE
+            step = max(7300.0 / (per_account or 1), 0.01)
+            elapsed = 0.0
+            for index in range(per_account):
+                elapsed += self.random.uniform(0, 2 * step)
+                date = START_DATE + timedelta(days=int(elapsed))
+                if investment:
+                    lines = self.investment_lines(date, names)
+                else:
+                    lines = self.transaction_lines(date)
+                if not index:
+                    lines.insert(0, header)
+                yield lines
+        lines = ['!Type:Memorized']
+        for index in range(self.memorized):
+            yield lines + self.memorized_lines()
+            lines = []
+
+    def write(self, file_handle, count):
+        """Write about count records to a text file handle.
+
+        Returns the number of records written.
+        """
+        newline = self.newline
+        separator = newline + '^' + newline
+        written = 0
+        batch = []
+        for lines in self.iter_records(count):
+            batch.append(newline.join(lines))
+            if len(batch) >= WRITE_BATCH_SIZE:
+                file_handle.write(separator.join(batch) + separator)
+                written += len(batch)
+                batch = []
+        if batch:
+            file_handle.write(separator.join(batch) + separator)
+            written += len(batch)
+        return written
+
+
+def generate_file(path, count, seed=0, encoding='ascii', **options):
+    """Write a QIF file of about count records; see QifGenerator.
+
+    Returns the number of records written.
+    """
+    generator = QifGenerator(seed, **options)
+    with io.open(path, 'w', encoding=encoding, newline='') as file_handle:
+        return generator.write(file_handle, count)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--crlf', action='store_true',
+                        help='write Windows newlines')
+    args = parser.parse_args(argv)
+    count = generate_file(args.path, args.records, args.seed,
+                          newline='\r\n' if args.crlf else '\n')
+    print('%d records written to %s' % (count, args.path))
+
+
+if __name__ == '__main__':
+    main()
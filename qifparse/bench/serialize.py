@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Measure how many records per second each entry class serializes.
+
+Usage: python -m qifparse.bench.serialize [--records N] [--repeat R]
+"""
+import argparse
+import time
+from datetime import datetime
+from decimal import Decimal
+from qifparse import qif
+
+
+def sample_records(count):
+    """Build count records of each entry class, keyed by class name."""
+    date = datetime(2013, 10, 23)
+    records = {}
+    records['Transaction'] = []
+    for i in range(count):
+        tr = qif.Transaction(date=date, amount=Decimal('-48.00'),
+                             uamount=Decimal('-48.00'), payee='Payee %d' % i,
+                             cleared='X', num=str(i), category='food:lunch',
+                             address=['via Roma', '44100, Ferrara'])
+        tr.splits.append(qif.AmountSplit(to_account='My Cc',
+                                         amount=Decimal('-31.00')))
+        tr.splits.append(qif.AmountSplit(category='food:lunch',
+                                         amount=Decimal('-17.00')))
+        records['Transaction'].append(tr)
+    records['MemorizedTransaction'] = [
+        qif.MemorizedTransaction(mtype='P', amount=Decimal('-5.00'),
+                                 payee='Payee %d' % i, to_account='My Bank')
+        for i in range(count)]
+    records['AmountSplit'] = [
+        qif.AmountSplit(category='food', amount=Decimal('-17.00'),
+                        memo='memo %d' % i)
+        for i in range(count)]
+    records['Investment'] = [
+        qif.Investment(date=date, action='Buy', security='ACME',
+                       price=Decimal('12.345'), quantity=Decimal('10'),
+                       amount=Decimal('123.45'), commission=Decimal('1.50'))
+        for i in range(count)]
+    records['Account'] = [
+        qif.Account(name='Account %d' % i, account_type='Bank',
+                    description='Checking')
+        for i in range(count)]
+    records['Category'] = [
+        qif.Category(name='food:%d' % i, description='Food')
+        for i in range(count)]
+    records['Class'] = [qif.Class(name='class %d' % i, description='Class')
+                        for i in range(count)]
+    records['Tag'] = [qif.Tag(name='tag %d' % i, description='Tag')
+                      for i in range(count)]
+    return records
+
+
+def run(count, repeat):
+    """Return the best records/s rate of str() for each entry class."""
+    results = {}
+    for name, entries in sorted(sample_records(count).items()):
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            for entry in entries:
+                str(entry)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        results[name] = count / best
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+    for name, rate in sorted(run(args.records, args.repeat).items()):
+        print('%-22s %12.0f records/s' % (name, rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Measure how fast generated QIF files are parsed and written.
+
+Usage: python -m qifparse.bench.throughput [--sizes 1k,10k,...]
+       [--output FILE.json] [--compare OLD.json]
+
+For each size, a file of that many records is generated (see
+qifparse.bench.generator; files are kept in --directory and reused), then
+parsed with QifParser.parseFile and written back with Qif.write.  Each
+measure runs in a new process, so that its peak memory (the maximum
+resident set size of the process, on platforms with the resource module)
+is its own.
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+from datetime import datetime
+from multiprocessing import Pool
+from qifparse import __version__
+from qifparse.bench.generator import generate_file, DATE_FORMAT
+from qifparse.files import map_file
+from qifparse.parallel import iter_record_ranges
+from qifparse.parser import QifParser
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000, 10000000)
+MODES = ('parse', 'write')
+
+# Suffixes accepted in the sizes given on the command line
+SIZE_SUFFIXES = {'k': 1000, 'm': 1000000}
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    if text and text[-1] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+
+def peak_memory():
+    """Return the peak resident set size of the process, in MB, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == 'Darwin':
+        # in bytes there, in kilobytes elsewhere
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+
+def measure(task):
+    """Run one measure; task is a (mode, path, fixed_point) tuple.
+
+    Returns the elapsed time, the number of bytes read or written, and the
+    peak memory of the process (which, for a write, includes the parse
+    of the file).
+    """
+    (mode, path, fixed_point) = task
+    start = time.time()
+    qif_obj = QifParser.parseFile(path, DATE_FORMAT, fixed_point)
+    elapsed = time.time() - start
+    size = os.path.getsize(path)
+    if mode == 'write':
+        with tempfile.TemporaryFile('w+') as file_handle:
+            start = time.time()
+            qif_obj.write(file_handle)
+            file_handle.flush()
+            elapsed = time.time() - start
+            size = file_handle.tell()
+    return (elapsed, size, peak_memory())
+
+
+def count_records(path):
+    with map_file(path) as buf:
+        return sum(1 for _ in iter_record_ranges(buf))
+
+
+def corpus_path(directory, size, seed):
+    return os.path.join(directory, 'corpus-%d-%d.qif' % (size, seed))
+
+
+def run(sizes=DEFAULT_SIZES, modes=MODES, directory=None, seed=0, repeat=1,
+        fixed_point=None, isolate=True):
+    """Return the results of the measures, as a dictionary ready for JSON.
+
+    The best time out of repeat runs is kept for each size and mode.
+    Without isolate, the measures run in this process, whose peak memory
+    then includes the one of the previous measures.
+    """
+    if directory is None:
+        directory = tempfile.gettempdir()
+    results = []
+    for size in sizes:
+        path = corpus_path(directory, size, seed)
+        if not os.path.exists(path):
+            # the file is complete or not there at all
+            tmp_path = path + '.tmp'
+            generate_file(tmp_path, size, seed)
+            os.rename(tmp_path, path)
+        records = count_records(path)
+        for mode in modes:
+            best = None
+            for _ in range(repeat):
+                task = (mode, path, fixed_point)
+                if isolate:
+                    pool = Pool(1)
+                    try:
+                        result = pool.apply(measure, (task,))
+                    finally:
+                        pool.terminate()
+                        pool.join()
+                else:
+                    result = measure(task)
+                if best is None or result[0] < best[0]:
+                    best = result
+            (elapsed, nbytes, peak) = best
+            results.append({
+                'mode': mode,
+                'records': records,
+                'bytes': nbytes,
+                'seconds': elapsed,
+                'records_per_second': records / elapsed if elapsed else None,
+                'mb_per_second': (nbytes / (1024.0 * 1024.0) / elapsed
+                                  if elapsed else None),
+                'peak_memory_mb': peak,
+            })
+    return {
+        'qifparse': __version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'date': datetime.now().isoformat(),
+        'seed': seed,
+        'fixed_point': bool(fixed_point),
+        'results': results,
+    }
+
+
+def compare(old, new):
+    """Return (mode, records, old rate, new rate, ratio) rows for the
+    measures of two runs which have the same mode and number of records.
+    """
+    rates = dict(((result['mode'], result['records']),
+                  result['records_per_second'])
+                 for result in old['results'])
+    rows = []
+    for result in new['results']:
+        key = (result['mode'], result['records'])
+        if rates.get(key) and result['records_per_second']:
+            rows.append(key + (rates[key], result['records_per_second'],
+                               result['records_per_second'] / rates[key]))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(
+        str(size) for size in DEFAULT_SIZES),
+        help='numbers of records, like 1k,10k,1M')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--directory', help='where generated files are kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--fixed-point', action='store_true')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--compare', help='results of a previous run')
+    args = parser.parse_args(argv)
+    results = run([parse_size(size) for size in args.sizes.split(',')],
+                  args.modes.split(','), args.directory, args.seed,
+                  args.repeat, args.fixed_point or None)
+    for result in results['results']:
+        print('%-6s %10d records %8.2fs %12.0f records/s %8.2f MB/s '
+              '%8s MB peak' % (
+                  result['mode'], result['records'], result['seconds'],
+                  result['records_per_second'] or 0,
+                  result['mb_per_second'] or 0,
+                  '%.0f' % result['peak_memory_mb']
+                  if result['peak_memory_mb'] is not None else '?'))
+    if args.output:
+        with open(args.output, 'w') as file_handle:
+            json.dump(results, file_handle, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as file_handle:
+            old = json.load(file_handle)
+        for row in compare(old, results):
+            print('%-6s %10d records %12.0f -> %12.0f records/s (x%.2f)'
+                  % row)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""Cache of parsed QIF files, on disk.
+
+A ParseCache keeps a snapshot (see qifparse.snapshot) of each file parsed
+through it, keyed by the path of the file and the options of the parse.
+A snapshot is used as long as the size, modification time and content
+hash of the file are unchanged, and as long as it was made by the same
+version of qifparse, with the same entry classes.  The least recently used
+snapshots are removed when the cache grows beyond its size limit.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+from qifparse import __version__, snapshot
+from qifparse.dates import CacheInfo
+from qifparse.qif import (
+    Transaction,
+    MemorizedTransaction,
+    AmountSplit,
+    Account,
+    Investment,
+    Category,
+    Class,
+    Tag,
+)
+
+# Maximum size of the snapshots kept by a ParseCache, in bytes
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+# Bump it when a change of the parser gives other results for a file
+CACHE_VERSION = 1
+
+CACHE_MAGIC = b'QIFCACHE'
+ENTRY_SUFFIX = '.snapshot'
+
+# Size of the blocks read to hash files, in bytes
+HASH_BLOCK_SIZE = 1024 * 1024
+
+ENTRY_CLASSES = (Transaction, MemorizedTransaction, AmountSplit, Account,
+                 Investment, Category, Class, Tag)
+
+
+def _schema():
+    digest = hashlib.sha1()
+    for cls in ENTRY_CLASSES:
+        fields = ','.join('%s:%s' % (field.name, field.ftype)
+                          for field in cls._fields)
+        slots = ','.join(cls._slot_names)
+        digest.update(('%s(%s)[%s];' % (cls.__name__, fields, slots))
+                      .encode('ascii'))
+    return digest.hexdigest()
+
+
+# Digest of the fields and slots of the entry classes
+SCHEMA = _schema()
+
+
+def cache_version():
+    """Return what a snapshot must have been made with to be used."""
+    return (CACHE_VERSION, snapshot.SNAPSHOT_VERSION, __version__, SCHEMA)
+
+
+def parse_options(date_format=None, fixed_point=None, encoding=None):
+    """Return the key of the options of QifParser.parseFile."""
+    if isinstance(fixed_point, dict):
+        fixed_point = tuple(sorted(fixed_point.items()))
+    return (date_format, fixed_point, encoding)
+
+
+def file_digest(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as file_handle:
+        while True:
+            block = file_handle.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ParseCache(object):
+    """Snapshots of parsed files, kept in a directory.
+
+    With check_content false, the content of a file is not hashed when
+    its size and modification time are unchanged, which makes hits even
+    cheaper for large files.  The hits, misses, stores and evictions
+    counters tell how well the cache is doing.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE,
+                 check_content=True):
+        self.directory = directory
+        self.max_size = max_size
+        self.check_content = check_content
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def entry_path(self, filename, options=()):
+        key = repr((os.path.abspath(filename), options)).encode('utf-8')
+        return os.path.join(self.directory,
+                            hashlib.sha1(key).hexdigest() + ENTRY_SUFFIX)
+
+    def source(self, filename):
+        """Return the (size, mtime, digest) of a file, to be given to put
+        when it is read before parsing the file."""
+        stat = os.stat(filename)
+        return (stat.st_size, stat.st_mtime, file_digest(filename))
+
+    def get(self, filename, options=()):
+        """Return the Qif object of filename parsed with options, or None
+        if it is not in the cache."""
+        path = self.entry_path(filename, options)
+        qif_obj = None
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as file_handle:
+                    if file_handle.read(len(CACHE_MAGIC)) == CACHE_MAGIC and \
+                            self._matches(pickle.load(file_handle),
+                                          filename):
+                        qif_obj = snapshot.load(file_handle)
+            except Exception:
+                # a damaged or foreign snapshot is just not used
+                qif_obj = None
+        if qif_obj is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # the modification time of the snapshots tells which ones were
+        # used last
+        os.utime(path, None)
+        return qif_obj
+
+    def _matches(self, meta, filename):
+        if meta.get('version') != cache_version():
+            return False
+        stat = os.stat(filename)
+        if stat.st_size != meta['size']:
+            return False
+        if stat.st_mtime == meta['mtime'] and not self.check_content:
+            return True
+        return file_digest(filename) == meta['digest']
+
+    def put(self, filename, qif_obj, options=(), source=None):
+        """Store the Qif object of filename parsed with options.
+
+        source is the (size, mtime, digest) of the file when it was parsed,
+        as given by the source method; by default, the current one.
+        """
+        if source is None:
+            source = self.source(filename)
+        meta = {
+            'version': cache_version(),
+            'path': os.path.abspath(filename),
+            'options': options,
+            'size': source[0],
+            'mtime': source[1],
+            'digest': source[2],
+        }
+        (fd, tmp_path) = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as file_handle:
+                file_handle.write(CACHE_MAGIC)
+                pickle.dump(meta, file_handle, 2)
+                snapshot.dump(qif_obj, file_handle)
+            getattr(os, 'replace', os.rename)(
+                tmp_path, self.entry_path(filename, options))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        self.stores += 1
+        self.evict()
+
+    def _entries(self):
+        """Return the (mtime, size, path) of the snapshots, oldest first."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(ENTRY_SUFFIX):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    def evict(self):
+        """Remove the least recently used snapshots, until the cache fits
+        in max_size."""
+        entries = self._entries()
+        total = sum(size for (mtime, size, path) in entries)
+        for (mtime, size, path) in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def cache_info(self):
+        size = sum(size for (mtime, size, path) in self._entries())
+        return CacheInfo(self.hits, self.misses, self.max_size, size)
+
+    def cache_clear(self):
+        for (mtime, size, path) in self._entries():
+            os.remove(path)
+        self.hits = self.misses = self.stores = self.evictions = 0
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""The categories of a Qif object as a tree, with the amounts of each.
+
+Category names are paths, like 'Auto:Fuel', which a transaction may
+follow with a class, like 'Auto:Fuel/Business'.  Qif.category_tree
+returns a CategoryTree holding a CategoryNode for each level of the
+categories of the !Type:Cat section and of the ones used by transactions
+and splits.  Each node lists the amounts given to its category, and keeps
+their total and the total of its subtree, which are updated when
+transactions are added, so that finding a category (in as many steps as
+it has levels) gives its totals at once.
+
+Like rollups, the amounts of the splits of a transaction go to their
+categories, and what they leave of the amount of the transaction to its
+own category; amounts without category belong to the root of the tree.
+Memorized transactions are left out.
+"""
+import re
+from decimal import Decimal
+from qifparse.query import (
+    base_category,
+    changed_lists,
+    to_decimal,
+    CATEGORY_SEPARATOR,
+)
+
+# Names of the levels which only hold a place, like the 'ZZZZZ' of
+# 'Auto:ZZZZZ': a character repeated at least three times
+PLACEHOLDER_NAME = re.compile(r'^(\w)\1{2,}$', re.UNICODE)
+
+
+class CategoryNode(object):
+    """A level of a category path.
+
+    path is the name of the category ('Auto:Fuel'), None for the root;
+    category is the Category of that name in the Qif object, if any.
+    entries lists the (account, header, transaction, amount) tuples of the
+    amounts given to the category itself, total is their sum and count
+    their number; subtotal and subcount include the subcategories.
+    placeholder tells whether the name only holds a place (see
+    PLACEHOLDER_NAME).
+    """
+
+    def __init__(self, name=None, parent=None):
+        self.name = name
+        self.parent = parent
+        if parent is None or parent.path is None:
+            self.path = name
+        else:
+            self.path = parent.path + CATEGORY_SEPARATOR + name
+        self.children = {}
+        self.category = None
+        self.entries = []
+        self.total = Decimal(0)
+        self.count = 0
+        self.subtotal = Decimal(0)
+        self.subcount = 0
+        self.placeholder = name is not None and \
+            PLACEHOLDER_NAME.match(name) is not None
+
+    def __repr__(self):
+        return '<CategoryNode %s>' % (self.path,)
+
+    @property
+    def depth(self):
+        return 0 if self.path is None else \
+            self.path.count(CATEGORY_SEPARATOR) + 1
+
+    def add(self, entry):
+        amount = entry[-1]
+        self.entries.append(entry)
+        self.total += amount
+        self.count += 1
+        node = self
+        while node is not None:
+            node.subtotal += amount
+            node.subcount += 1
+            node = node.parent
+
+    def walk(self):
+        """Yield this node and the ones below it, depth first, the
+        children of each node by name."""
+        yield self
+        for name in sorted(self.children):
+            for node in self.children[name].walk():
+                yield node
+
+    def iter_entries(self):
+        """Yield the entries of this node and of the ones below it."""
+        for node in self.walk():
+            for entry in node.entries:
+                yield entry
+
+
+class CategoryTree(object):
+    """The categories of a Qif object, as a tree of CategoryNodes; see
+    Qif.category_tree."""
+
+    def __init__(self, qif_obj):
+        self.qif_obj = qif_obj
+        self.clear()
+
+    def clear(self):
+        self.root = CategoryNode()
+        # number of the categories of the Qif object added
+        self.categories = 0
+        # id of each list of transactions added -> (list, length added)
+        self.lists = {}
+
+    def refresh(self):
+        """Add the categories and transactions added since the last
+        refresh.
+
+        Everything is built again if a list of transactions was removed
+        or shortened in between.
+        """
+        categories = self.qif_obj._categories
+        changes = changed_lists(self.lists, self.qif_obj._transaction_lists())
+        if changes is None or len(categories) < self.categories:
+            self.clear()
+            changes = changed_lists(self.lists,
+                                    self.qif_obj._transaction_lists())
+        for category in categories[self.categories:]:
+            self.node(category.name, create=True).category = category
+        self.categories = len(categories)
+        (self.lists, new) = changes
+        for (account, header, transactions, start) in new:
+            for transaction in transactions[start:]:
+                self.add(account, header, transaction)
+
+    def node(self, path, create=False):
+        """Return the node of a category ('Auto:Fuel', a class being
+        ignored), or None; with create, missing nodes are added.  None
+        gives the root."""
+        node = self.root
+        if path is None:
+            return node
+        for name in base_category(path).split(CATEGORY_SEPARATOR):
+            child = node.children.get(name)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[name] = CategoryNode(name, node)
+            node = child
+        return node
+
+    def add(self, account, header, transaction):
+        """Give the amounts of a transaction to the nodes of their
+        categories."""
+        if not transaction._dated:
+            return
+        amount = _amount(transaction)
+        splits = getattr(transaction, '_splits', None)
+        if splits:
+            for split in splits:
+                split_amount = _amount(split)
+                amount -= split_amount
+                self.node(split.category or None, create=True).add(
+                    (account, header, transaction, split_amount))
+            if not amount:
+                return
+        self.node(getattr(transaction, 'category', None) or None,
+                  create=True).add((account, header, transaction, amount))
+
+    def find(self, path):
+        """Return the node of a category, or None."""
+        return self.node(path)
+
+    def total(self, path, subcategories=True):
+        """Return the sum of the amounts of a category (and of its
+        subcategories)."""
+        node = self.node(path)
+        if node is None:
+            return Decimal(0)
+        return node.subtotal if subcategories else node.total
+
+    def transactions(self, path, subcategories=True):
+        """Return the (account, header, transaction, amount) tuples of the
+        amounts of a category (and of its subcategories)."""
+        node = self.node(path)
+        if node is None:
+            return []
+        if not subcategories:
+            return list(node.entries)
+        return list(node.iter_entries())
+
+    def walk(self):
+        """Yield the nodes of the categories, depth first, without the
+        root."""
+        nodes = self.root.walk()
+        next(nodes)
+        return nodes
+
+    def placeholders(self):
+        """Return the nodes whose name only holds a place."""
+        return [node for node in self.walk() if node.placeholder]
+
+
+def _amount(entry):
+    amount = getattr(entry, 'amount', None)
+    return Decimal(0) if amount is None else to_decimal(amount)
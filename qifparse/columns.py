@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""Columnar (NumPy) view of transactions.
+
+Qif.to_columns and Account.to_columns turn lists of entries into a
+TransactionTable, whose columns are NumPy arrays: dates as datetime64[D],
+amounts as int64 cents or float64, and text fields dictionary-encoded as
+integer codes.  Splits are stored in a child table.
+
+NumPy is an optional dependency of qifparse, only needed here.
+"""
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal, ROUND_HALF_EVEN
+from qifparse.amounts import FixedPoint
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# datetime64[D] counts days from 1970-01-01
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# code of missing values in the dictionary-encoded columns
+MISSING = -1
+
+# dictionary-encoded columns; to_account shares the dictionary of account,
+# so that transfers can be matched with the accounts by code
+CODED_COLUMNS = ('account', 'header', 'payee', 'category', 'to_account',
+                 'cleared')
+SHARED_DICTIONARIES = {'to_account': 'account'}
+
+_CENT = Decimal('0.01')
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("numpy is required to export columns")
+
+
+def _to_cents(value):
+    if value is None:
+        return 0
+    if isinstance(value, FixedPoint):
+        if value.scale == 2:
+            return int(value)
+        value = value.to_decimal()
+    if isinstance(value, Decimal):
+        return int(value.quantize(_CENT, rounding=ROUND_HALF_EVEN).scaleb(2))
+    return int(round(value * 100))
+
+
+def _to_float(value):
+    if value is None:
+        return float('nan')
+    if isinstance(value, FixedPoint):
+        return int(value) / float(10 ** value.scale)
+    return float(value)
+
+
+class Dictionary(object):
+    """Values of a dictionary-encoded column, indexed by their code."""
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def encode(self, value):
+        if value is None:
+            return MISSING
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def code(self, value):
+        """Return the code of value, or MISSING if it never appeared."""
+        return self._codes.get(value, MISSING)
+
+    def __len__(self):
+        return len(self.values)
+
+
+class Table(object):
+    """Equal-length NumPy columns, some of them dictionary-encoded."""
+
+    def __init__(self, columns, dictionaries):
+        self.columns = columns
+        self.dictionaries = dictionaries
+
+    def __len__(self):
+        for column in self.columns.values():
+            return len(column)
+        return 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def keys(self):
+        return self.columns.keys()
+
+    def decode(self, name):
+        """Return the values of a coded column, as an object array."""
+        dictionary = self.dictionaries[name]
+        values = numpy.array(dictionary.values + [None], dtype=object)
+        # MISSING (-1) picks the trailing None
+        return values[self.columns[name]]
+
+
+class TransactionTable(Table):
+    """Columns of a list of transactions, with their splits.
+
+    The splits of row i are the rows split_offsets[i] to
+    split_offsets[i + 1] of the splits table, whose parent column holds
+    the index of their transaction.
+    """
+
+    def __init__(self, columns, dictionaries, splits, split_offsets):
+        super(TransactionTable, self).__init__(columns, dictionaries)
+        self.splits = splits
+        self.split_offsets = split_offsets
+
+
+def to_columns(rows, cents=None):
+    """Build a TransactionTable out of (account, header, entry) tuples.
+
+    Amounts are int64 cents if cents is true, float64 if it is false; by
+    default cents are used when the amounts were parsed as fixed point
+    integers.  Missing amounts are 0 cents or NaN, missing dates NaT and
+    missing text fields are coded as MISSING.
+    """
+    _require_numpy()
+    dictionaries = {}
+    for name in CODED_COLUMNS:
+        if name not in SHARED_DICTIONARIES:
+            dictionaries[name] = Dictionary()
+    for name, shared in SHARED_DICTIONARIES.items():
+        dictionaries[name] = dictionaries[shared]
+
+    data = OrderedDict((name, []) for name in
+                       ('date', 'amount') + CODED_COLUMNS)
+    splits = OrderedDict((name, []) for name in
+                         ('parent', 'amount', 'category', 'to_account'))
+    offsets = [0]
+    amounts = []
+    split_amounts = []
+    for (account, header, entry) in rows:
+        row = len(offsets) - 1
+        when = getattr(entry, 'date', None)
+        data['date'].append(when.toordinal() - EPOCH_ORDINAL
+                            if when else None)
+        amounts.append(getattr(entry, 'amount', None))
+        data['account'].append(dictionaries['account'].encode(account))
+        data['header'].append(dictionaries['header'].encode(header))
+        for name in ('payee', 'category', 'to_account', 'cleared'):
+            data[name].append(
+                dictionaries[name].encode(getattr(entry, name, None)))
+        for split in getattr(entry, '_splits', None) or ():
+            splits['parent'].append(row)
+            split_amounts.append(split.amount)
+            splits['category'].append(
+                dictionaries['category'].encode(split.category))
+            splits['to_account'].append(
+                dictionaries['to_account'].encode(split.to_account))
+        offsets.append(len(splits['parent']))
+
+    if cents is None:
+        cents = bool(amounts) and all(
+            value is None or isinstance(value, FixedPoint)
+            for value in amounts)
+    if cents:
+        data['amount'] = numpy.array([_to_cents(v) for v in amounts],
+                                     dtype=numpy.int64)
+        splits['amount'] = numpy.array([_to_cents(v) for v in split_amounts],
+                                       dtype=numpy.int64)
+    else:
+        data['amount'] = numpy.array([_to_float(v) for v in amounts],
+                                     dtype=numpy.float64)
+        splits['amount'] = numpy.array(
+            [_to_float(v) for v in split_amounts], dtype=numpy.float64)
+
+    nat = numpy.iinfo(numpy.int64).min
+    data['date'] = numpy.array(
+        [nat if day is None else day for day in data['date']],
+        dtype=numpy.int64).view('datetime64[D]')
+    for name in CODED_COLUMNS:
+        data[name] = numpy.array(data[name], dtype=numpy.int32)
+    splits['parent'] = numpy.array(splits['parent'], dtype=numpy.int64)
+    for name in ('category', 'to_account'):
+        splits[name] = numpy.array(splits[name], dtype=numpy.int32)
+
+    split_dictionaries = dict((name, dictionaries[name])
+                              for name in ('category', 'to_account'))
+    return TransactionTable(data, dictionaries,
+                            Table(splits, split_dictionaries),
+                            numpy.array(offsets, dtype=numpy.int64))
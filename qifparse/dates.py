@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+import re
+from collections import Counter, namedtuple, OrderedDict
+from datetime import datetime
+
+# Maximum number of distinct date strings remembered by a DateParser
+DEFAULT_CACHE_SIZE = 4096
+
+ISO_DATE_FORMAT = '%Y-%m-%d'
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+# Layout of the dates of a file, found by detect_date_format: date_format is
+# a strptime format, confidence goes from 0.5 (a guess) to 1 (no sample
+# contradicts it), and samples is the number of dates it was found from
+DateDetection = namedtuple('DateDetection',
+                           ['date_format', 'confidence', 'samples'])
+
+# Number of dates sampled from the start of a file to detect their layout
+DEFAULT_SAMPLE_COUNT = 100
+
+# Size of the start of a file whose dates are sampled, in bytes or
+# characters
+DATE_SAMPLE_SIZE = 256 * 1024
+
+# Date lines of a record, whatever the newlines are
+_DATE_LINE = re.compile(
+    r"(?:^|[\r\n])D( *\d+ *[^\w\s%] *\d+ *[^\w\s%] *\d+)[ \t]*(?=[\r\n]|$)")
+
+# A date made of three numbers, which may be padded with spaces; "'" may
+# stand for the second separator
+_DATE_FIELDS = re.compile(r"^ *(\d+) *([^\w\s%]) *(\d+) *([^\w\s%]) *(\d+) *$")
+
+# Formats made of day, month and year, separated by punctuation, can be
+# converted without strptime
+_SIMPLE_FORMAT = re.compile(
+    r'^%([dmyY])([^\w\s%])%([dmyY])([^\w\s%])%([dmyY])$')
+
+
+def _to_day(text):
+    # strptime accepts a day padded with a space
+    if len(text) == 2 and text[0] == ' ':
+        text = text[1]
+    if not 1 <= len(text) <= 2 or not text.isdigit():
+        raise ValueError(text)
+    return int(text)
+
+
+def _to_month(text):
+    if not 1 <= len(text) <= 2 or not text.isdigit():
+        raise ValueError(text)
+    return int(text)
+
+
+def _to_short_year(text):
+    if len(text) != 2 or not text.isdigit():
+        raise ValueError(text)
+    # same pivot as strptime
+    year = int(text)
+    if year < 69:
+        return 2000 + year
+    return 1900 + year
+
+
+def _to_year(text):
+    if len(text) != 4 or not text.isdigit():
+        raise ValueError(text)
+    return int(text)
+
+
+_CONVERTERS = {
+    'd': _to_day,
+    'm': _to_month,
+    'y': _to_short_year,
+    'Y': _to_year,
+}
+
+
+def compile_date_format(date_format):
+    """Build a function converting strings in date_format to datetimes.
+
+    Only formats like '%m/%d/%y' or '%d.%m.%Y' are supported; None is
+    returned for anything else.  The function raises ValueError for every
+    string that strptime would reject, but not necessarily with the same
+    message.
+    """
+    match = _SIMPLE_FORMAT.match(date_format or '')
+    if not match:
+        return None
+    (first, sep1, second, sep2, third) = match.groups()
+    fields = (first, second, third)
+    if sorted(field.lower() for field in fields) != ['d', 'm', 'y']:
+        return None
+    day = fields.index('d')
+    month = fields.index('m')
+    year = [fields.index(c) for c in 'yY' if c in fields][0]
+    convert = [_CONVERTERS[field] for field in fields]
+
+    def parse(text):
+        if sep1 == sep2:
+            parts = text.split(sep1)
+        else:
+            (head, sep, tail) = text.partition(sep1)
+            parts = [head] + tail.split(sep2) if sep else [text]
+        if len(parts) != 3:
+            raise ValueError(text)
+        values = [convert[i](parts[i]) for i in range(3)]
+        return datetime(values[year], values[month], values[day])
+
+    return parse
+
+
+def sample_dates(text, count=DEFAULT_SAMPLE_COUNT):
+    """Return the values of the first count date lines of text.
+
+    Only the 'D' lines which look like dates are taken: the ones of
+    categories, classes or accounts are descriptions.
+    """
+    samples = []
+    for match in _DATE_LINE.finditer(text):
+        samples.append(match.group(1))
+        if len(samples) >= count:
+            break
+    return samples
+
+
+def _ordered_pairs(dates):
+    # how many dates are not before the previous one
+    return sum(1 for i in range(1, len(dates)) if dates[i - 1] <= dates[i])
+
+
+def detect_date_format(samples):
+    """Find the layout of QIF dates from samples of them.
+
+    Returns a DateDetection, or None if no sample looks like a date.  The
+    order of the day and the month is told by the samples where one of
+    them is above 12; when there are none, by the order which keeps the
+    dates sorted most often, since QIF files list transactions by date,
+    and when that does not tell either, days come first, as the parser
+    always assumed.  A year of four digits first makes a '%Y-%m-%d'-like
+    format.  The "'" Quicken writes before the years from 2000 and the
+    spaces padding the numbers are left to DateParser.detected.
+    """
+    fields = []
+    for sample in samples:
+        match = _DATE_FIELDS.match(sample)
+        if match:
+            fields.append(match.groups())
+    if not fields:
+        return None
+    separators = Counter(sep1 for (_, sep1, _, _, _) in fields)
+    separator = separators.most_common(1)[0][0]
+    if all(len(first) == 4 for (first, _, _, _, _) in fields):
+        date_format = separator.join(('%Y', '%m', '%d'))
+        return DateDetection(date_format, 1.0, len(fields))
+    long_years = sum(1 for field in fields if len(field[4]) == 4)
+    year = '%Y' if 2 * long_years > len(fields) else '%y'
+    numbers = [(int(first), int(second), int(last))
+               for (first, _, second, _, last) in fields]
+    day_first = sum(1 for (first, second, _) in numbers
+                    if first > 12 and second <= 12)
+    month_first = sum(1 for (first, second, _) in numbers
+                      if second > 12 and first <= 12)
+    if day_first or month_first:
+        confidence = float(max(day_first, month_first)) / \
+            (day_first + month_first)
+        day_first = day_first >= month_first
+    else:
+        # years are compared as written, which is enough to order the
+        # dates of a file but those around 2000
+        ordered_day_first = _ordered_pairs(
+            [(last, second, first) for (first, second, last) in numbers])
+        ordered_month_first = _ordered_pairs(
+            [(last, first, second) for (first, second, last) in numbers])
+        pairs = max(len(numbers) - 1, 1)
+        confidence = 0.5 + 0.4 * abs(ordered_day_first -
+                                     ordered_month_first) / float(pairs)
+        day_first = ordered_day_first >= ordered_month_first
+    if day_first:
+        date_format = separator.join(('%d', '%m', year))
+    else:
+        date_format = separator.join(('%m', '%d', year))
+    return DateDetection(date_format, confidence, len(fields))
+
+
+class DateParser(object):
+    """Convert QIF dates to datetime objects, remembering the results.
+
+    QIF files repeat the same dates over and over, so every distinct
+    string is converted only once: up to maxsize results are kept, the
+    oldest being dropped first.  The hits and misses counters tell how
+    well the cache is doing.
+    """
+
+    def __init__(self, date_format=None, maxsize=DEFAULT_CACHE_SIZE):
+        self.date_format = date_format
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.detection = None
+        self._cache = OrderedDict()
+        self._iso_date = compile_date_format(ISO_DATE_FORMAT)
+        if date_format:
+            self._fast = compile_date_format(date_format)
+            self._convert = self._convertFormatted
+        else:
+            self._convert = self._convertGuessed
+
+    @classmethod
+    def detected(cls, detection, maxsize=DEFAULT_CACHE_SIZE):
+        """Make a DateParser converting dates in the layout of detection,
+        a DateDetection.
+
+        Its date_format stays None, since the parse was not given one.
+        The "'" before the years and the padding spaces are accepted; as
+        when guessing, a two-digit year is in the 2000s after "'" and in
+        the 1900s otherwise.  The dates unlike the samples are guessed as
+        without a format.
+        """
+        parser = cls(None, maxsize)
+        parser.detection = detection
+        parser._separator = detection.date_format[2]
+        parser._fast = compile_date_format(detection.date_format)
+        parser._short_year = '%y' in detection.date_format
+        parser._convert = parser._convertDetected
+        return parser
+
+    def parse(self, qdate):
+        try:
+            value = self._cache[qdate]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = self._convert(qdate)
+        if len(self._cache) >= self.maxsize:
+            self._cache.popitem(last=False)
+        self._cache[qdate] = value
+        return value
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize,
+                         len(self._cache))
+
+    def cache_clear(self):
+        self._cache.clear()
+        self.hits = self.misses = 0
+
+    def _strptime(self, text, date_format, fast):
+        if fast is not None:
+            try:
+                return fast(text)
+            except ValueError:
+                # let strptime raise the error it always raised
+                pass
+        return datetime.strptime(text, date_format)
+
+    def _convertFormatted(self, qdate):
+        if "'" in qdate:
+            # It's probably necessary that we'll need to modify the
+            # string in some cases, though this particular change is
+            # quick and dirty.  TODO: need to revisit.
+            nice_date = qdate.replace("' ", "/0")
+            nice_date = nice_date.replace("'", "/")
+        else:
+            nice_date = qdate
+        return self._strptime(nice_date, self.date_format, self._fast)
+
+    def _convertDetected(self, qdate):
+        text = qdate.strip().replace("'", self._separator).replace(' ', '0')
+        try:
+            value = self._fast(text)
+            if self._short_year:
+                # the century comes from the "'", not from the pivot of %y
+                century = 2000 if "'" in qdate else 1900
+                value = value.replace(year=century + value.year % 100)
+            return value
+        except ValueError:
+            return self._convertGuessed(qdate)
+
+    def _convertGuessed(self, qdate):
+        # If date_format is not given explicitly, we will try to guess...
+        if qdate[1] == "/":
+            qdate = "0" + qdate   # Extend month to 2 digits
+        if qdate[4] == "/":
+            qdate = qdate[:3]+"0" + qdate[3:]  # Extend month to 2 digits
+        qdate = qdate.replace(" ", "0")
+        if len(qdate) == 10:  # new form with YYYY date
+            iso_date = qdate[6:10] + "-" + qdate[3:5] + "-" + qdate[0:2]
+            return self._strptime(iso_date, ISO_DATE_FORMAT, self._iso_date)
+        if qdate[5] == "'":
+            C = "20"
+        else:
+            C = "19"
+        iso_date = C + qdate[6:8] + "-" + qdate[3:5] + "-" + qdate[0:2]
+        return self._strptime(iso_date, ISO_DATE_FORMAT, self._iso_date)
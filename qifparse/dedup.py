@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""Drop the transactions already seen from overlapping exports.
+
+Banks send the same transactions again when the date windows of their
+exports overlap.  A Deduplicator gives each transaction and investment a
+fingerprint, a digest of its account and of all its fields and splits,
+and counts the entries of each fingerprint in each source (a file parsed,
+or a Qif object filtered).  Entries are only dropped up to the number of
+entries with the same fingerprint seen in an earlier source: two identical
+coffees bought the same day, in one export, are both kept.  A Deduplicator
+can be given to a QifParser, to drop entries while parsing, or to
+Qif.merge and QifParser.parse_many.
+
+The fingerprints seen, each with the number of its occurrence in its
+source, are kept in an ExactFilter, a set, or in a BloomFilter, whose
+memory does not grow with the number of transactions but which takes a
+new transaction for a seen one with a small probability.  The counts of
+the current source are kept exactly.
+
+A transaction with a new fingerprint but the same account, date and
+amount as one seen in an earlier source is a suspected near-duplicate
+(the payee or memo may have been reworded by the bank): it is kept, and
+reported.
+"""
+import hashlib
+import math
+import struct
+import six
+from datetime import datetime
+from qifparse.query import to_decimal
+
+# Fields left out of the fingerprints: the status of a transaction changes
+# between two exports of the same window
+UNSTABLE_FIELDS = ('cleared',)
+
+# Fields of the splits in the fingerprints of their transactions
+SPLIT_FIELDS = ('category', 'to_account', 'amount', 'percent', 'memo',
+                'address')
+
+# Probability of taking a new transaction for a seen one, by default, in a
+# BloomFilter
+DEFAULT_ERROR_RATE = 0.0001
+
+# Separator of the values hashed into a fingerprint
+_SEPARATOR = u'\x1f'
+
+# Entry class -> names of the fields in its fingerprints
+_fingerprint_fields = {}
+
+
+def canonical(value):
+    """Return a value of a field as text, the same for equal amounts
+    whatever their type."""
+    if value is None:
+        return u''
+    # the usual values first
+    if isinstance(value, six.text_type):
+        return value.strip()
+    if isinstance(value, datetime):
+        return six.text_type(value.isoformat())
+    if isinstance(value, (list, tuple)):
+        return u'\n'.join(canonical(item) for item in value)
+    if isinstance(value, bool):
+        return u'1' if value else u'0'
+    if isinstance(value, six.binary_type):
+        return value.decode('utf-8', 'replace').strip()
+    amount = to_decimal(value)
+    # 10.0 and 10.00 are the same amount, and so are 0 and -0
+    return six.text_type(amount.normalize() if amount else 0)
+
+
+def _digest(values):
+    text = _SEPARATOR.join(canonical(value) for value in values)
+    return hashlib.sha1(text.encode('utf-8')).digest()
+
+
+def fingerprint(entry, account=None):
+    """Return the fingerprint of a Transaction or an Investment of account
+    (the name of its account, if any), as 20 bytes."""
+    cls = type(entry)
+    names = _fingerprint_fields.get(cls)
+    if names is None:
+        names = _fingerprint_fields[cls] = [
+            field.name for field in cls._fields
+            if field.name not in UNSTABLE_FIELDS]
+    values = [account, cls.__name__]
+    values.extend(getattr(entry, name, None) for name in names)
+    for split in getattr(entry, '_splits', None) or ():
+        values.extend(getattr(split, name, None) for name in SPLIT_FIELDS)
+    return _digest(values)
+
+
+def occurrence_key(key, number):
+    """Return the key of the number-th occurrence of a key in a source."""
+    if number == 1:
+        return key
+    return hashlib.sha1(key + ('#%d' % number).encode('ascii')).digest()
+
+
+def near_key(entry, account=None):
+    """Return the digest of the account, day and amount of an entry, which
+    near-duplicates share."""
+    date = getattr(entry, 'date', None)
+    return _digest((account, type(entry).__name__,
+                    date.date().isoformat() if date is not None else None,
+                    getattr(entry, 'amount', None)))
+
+
+class ExactFilter(object):
+    """The set of the keys seen."""
+
+    def __init__(self):
+        self.keys = set()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def add(self, key):
+        """Add a key; tell whether it was new."""
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+
+class BloomFilter(object):
+    """A Bloom filter of the keys seen, sized for capacity keys.
+
+    Up to capacity keys, a new key is taken for a seen one with a
+    probability of at most error_rate; keys seen are always found.
+    """
+
+    def __init__(self, capacity, error_rate=DEFAULT_ERROR_RATE):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError('invalid Bloom filter capacity or error rate')
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = int(math.ceil(-capacity * math.log(error_rate)
+                                  / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / float(capacity)
+                                       * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7))
+                   for position in self.positions(key))
+
+    def positions(self, key):
+        # double hashing from the 16 first bytes of the digest
+        (first, second) = struct.unpack('<QQ', key[:16])
+        second |= 1
+        size = self.size
+        return [(first + index * second) % size
+                for index in range(self.hashes)]
+
+    def add(self, key):
+        """Add a key; tell whether it was new (a new key may be taken for
+        a seen one)."""
+        bits = self.bits
+        new = False
+        for position in self.positions(key):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+
+class Deduplicator(object):
+    """Drop the transactions and investments already seen.
+
+    seen holds the fingerprints of the entries, near the digests of their
+    account, day and amount (see near_key), with the number of their
+    occurrence in their source (see occurrence_key): ExactFilters by
+    default.  counts holds the number of the entries of each fingerprint
+    and digest in the current source, which new_source starts.
+    duplicates counts the entries dropped, and suspects lists the
+    (account, header, entry) tuples of the suspected near-duplicates kept;
+    on_near_duplicate(account, header, entry) is called for each of them
+    too.
+    """
+
+    def __init__(self, seen=None, near=None, on_near_duplicate=None):
+        self.seen = ExactFilter() if seen is None else seen
+        self.near = ExactFilter() if near is None else near
+        self.on_near_duplicate = on_near_duplicate
+        self.counts = {}
+        self.duplicates = 0
+        self.suspects = []
+
+    @classmethod
+    def bounded(cls, capacity, error_rate=DEFAULT_ERROR_RATE,
+                on_near_duplicate=None):
+        """Return a Deduplicator whose memory does not grow, for streams of
+        up to capacity transactions (see BloomFilter)."""
+        return cls(BloomFilter(capacity, error_rate),
+                   BloomFilter(capacity, error_rate), on_near_duplicate)
+
+    def new_source(self):
+        """Start counting the entries of another source.
+
+        QifParser calls it when a parse starts, and filter for each Qif
+        object.
+        """
+        self.counts = {}
+
+    def keep(self, entry, account=None, header=None):
+        """Tell whether an entry of account (the name of its account, or
+        None), in section header, is to be kept, and remember it."""
+        counts = self.counts
+        key = fingerprint(entry, account)
+        number = counts[key] = counts.get(key, 0) + 1
+        new = self.seen.add(occurrence_key(key, number))
+        key = near_key(entry, account)
+        number = counts[key] = counts.get(key, 0) + 1
+        near_new = self.near.add(occurrence_key(key, number))
+        if not new:
+            self.duplicates += 1
+            return False
+        if not near_new:
+            self.suspects.append((account, header, entry))
+            if self.on_near_duplicate is not None:
+                self.on_near_duplicate(account, header, entry)
+        return True
+
+    def filter(self, qif_obj):
+        """Remove from a Qif object, as a new source, the transactions
+        and investments already seen, in place; return how many were
+        removed.
+
+        Memorized transactions are left alone.  The transactions of a
+        LazyQif can't be removed: RuntimeError is raised.
+        """
+        lists = list(qif_obj._transaction_lists())
+        if any(not isinstance(transactions, list)
+               for (_, _, transactions) in lists):
+            raise RuntimeError(six.u(
+                "can't remove transactions from %s" % type(qif_obj).__name__))
+        self.new_source()
+        removed = 0
+        for (account, header, transactions) in lists:
+            kept = [entry for entry in transactions
+                    if not entry._dated or
+                    self.keep(entry, account, header)]
+            if len(kept) < len(transactions):
+                removed += len(transactions) - len(kept)
+                transactions[:] = kept
+        return removed
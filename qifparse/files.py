@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Read QIF files as bytes.
+
+QifParser.parseFile maps files in memory and decodes them one block at a
+time, so that neither the bytes nor the text of a whole file have to be
+held in memory.  Newlines are not translated: records are split on
+separators made of any of the CR, LF or CRLF newlines, and str.splitlines
+copes with all of them inside a record.
+"""
+import codecs
+import mmap
+import os
+import re
+from contextlib import contextmanager
+
+# Encoding of the files when none is given: Quicken for Windows writes them
+# in the ANSI code page
+DEFAULT_ENCODING = 'cp1252'
+
+# Size of the blocks of a mapped file decoded at a time, in bytes
+DEFAULT_MAP_BLOCK_SIZE = 256 * 1024
+
+# Records are terminated by a line containing only a caret
+RECORD_SEPARATOR = '\n^\n'
+_SEPARATOR = re.compile(r'(?:\r\n|\r|\n)\^(?:\r\n|\r|\n)')
+
+
+def split_records(text):
+    """Split text into records, whatever its newlines are.
+
+    The records are the ones text.split(RECORD_SEPARATOR) would give once
+    newlines are translated to '\\n', but the newlines inside them are
+    left as they are.
+    """
+    if '\r' not in text:
+        return text.split(RECORD_SEPARATOR)
+    return _SEPARATOR.split(text)
+
+
+def split_complete(text):
+    """Split text into its complete records and the rest, which may be the
+    start of a record continued by the text coming next."""
+    if text.endswith('\r'):
+        # it may be the first half of a Windows newline
+        chunks = split_records(text[:-1])
+        chunks[-1] += '\r'
+    else:
+        chunks = split_records(text)
+    rest = chunks.pop()
+    return (chunks, rest)
+
+
+@contextmanager
+def map_file(filename):
+    """Map a file in memory, read only.
+
+    An empty file can't be mapped: it gives b'' instead.
+    """
+    with open(filename, 'rb') as file_handle:
+        if not os.fstat(file_handle.fileno()).st_size:
+            yield b''
+            return
+        buf = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            buf.madvise(mmap.MADV_SEQUENTIAL)
+        try:
+            yield buf
+        finally:
+            buf.close()
+
+
+def iter_blocks(buf, start=0, end=None, block_size=DEFAULT_MAP_BLOCK_SIZE):
+    """Yield the bytes of buf from start to end, block by block.
+
+    The pages of a mapped file are released once yielded, so that they
+    don't add up in the memory of the process.
+    """
+    if end is None:
+        end = len(buf)
+    release = None
+    if isinstance(buf, mmap.mmap) and hasattr(mmap, 'MADV_DONTNEED') and \
+            not block_size % mmap.PAGESIZE:
+        release = buf.madvise
+    for position in range(start, end, block_size):
+        size = min(block_size, end - position)
+        yield buf[position:position + size]
+        if release is not None:
+            # only whole pages can be released
+            page_start = position - position % mmap.PAGESIZE
+            release(mmap.MADV_DONTNEED, page_start,
+                    position + size - page_start)
+
+
+def map_blocks(buf, encoding=DEFAULT_ENCODING,
+               block_size=DEFAULT_MAP_BLOCK_SIZE, start=0, end=None):
+    """Yield the text of buf (from start to end), decoded block by block.
+
+    A character whose bytes straddle two blocks is kept for the next one,
+    so some of the blocks may be empty.  See iter_blocks.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for block in iter_blocks(buf, start, end, block_size):
+        yield decoder.decode(block)
+    text = decoder.decode(b'', True)
+    if text:
+        yield text
+
+
+def read_blocks(file_handle, block_size):
+    """Yield the blocks read from a file handle, until its end."""
+    while True:
+        block = file_handle.read(block_size)
+        if not block:
+            break
+        yield block
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Parse QIF files which keep growing, one appended part at a time.
+
+QifParser.parseFileIncremental returns a Checkpoint: the Qif object the
+records were added to, the offset up to which the file was parsed, a hash
+of the bytes before that offset, and the state the parser had there.  Given
+back to a later call, it lets only the records appended since then be
+parsed.  The hashes tell whether the part already parsed was changed in
+between, in which case the file is parsed again from its start.
+
+Only the first and last RESUME_WINDOW bytes before the offset are read
+again to tell it, as long as the file is the same one (same device and
+inode); the hash of all of them is checked when it is not, or when the
+checkpoint was unpickled.  A file rewritten in place with the same bytes
+at both ends of the parsed part is thus not noticed.
+"""
+import hashlib
+import os
+from collections import namedtuple
+from qifparse.files import iter_blocks
+from qifparse.parallel import iter_record_ranges
+
+# Bytes read again at each end of the part of a file already parsed
+RESUME_WINDOW = 64 * 1024
+
+# State of an incremental parse: offset is where the next call starts to
+# parse, digest the SHA-1 of the file before offset, options the ones of
+# qifparse.cache.parse_options; last_type, transactions_header,
+# last_account and auto_switches are the state of the parser at offset,
+# date_detection the qifparse.dates.DateDetection its dates are converted
+# with, if no date format was given, and dedup_counts the counts of the
+# qifparse.dedup.Deduplicator of the parser for the file, if it has one;
+# file_id is the device and inode of the file, window the SHA-1 of its
+# bytes at both ends of the part before offset, and hasher the running
+# SHA-1 object digest comes from, which is not pickled
+_Checkpoint = namedtuple('Checkpoint', [
+    'qif',
+    'offset',
+    'digest',
+    'last_type',
+    'transactions_header',
+    'last_account',
+    'auto_switches',
+    'options',
+    'date_detection',
+    'dedup_counts',
+    'file_id',
+    'window',
+    'hasher',
+])
+
+
+class Checkpoint(_Checkpoint):
+    __slots__ = ()
+
+    def __getnewargs__(self):
+        return tuple(self)[:-1] + (None,)
+
+
+def update_digest(hasher, buf, start, end):
+    for block in iter_blocks(buf, start, end):
+        hasher.update(block)
+    return hasher
+
+
+def file_identity(filename):
+    """Return the device and inode of a file."""
+    stat = os.stat(filename)
+    return (stat.st_dev, stat.st_ino)
+
+
+def window_digest(buf, offset):
+    """Return the SHA-1 of the bytes of buf at both ends of its part
+    before offset."""
+    hasher = update_digest(hashlib.sha1(), buf, 0,
+                           min(offset, RESUME_WINDOW))
+    return update_digest(hasher, buf, max(offset - RESUME_WINDOW,
+                                          RESUME_WINDOW), offset).hexdigest()
+
+
+def resume_digest(checkpoint, buf, options, file_id):
+    """Return the hasher of the bytes of buf before checkpoint.offset, if
+    the checkpoint can be resumed from, or None.
+
+    It can't if the options changed, if the file was truncated before
+    the offset, or if the bytes before it changed.
+    """
+    if checkpoint is None or checkpoint.options != options or \
+            checkpoint.offset > len(buf) or \
+            window_digest(buf, checkpoint.offset) != checkpoint.window:
+        return None
+    if checkpoint.hasher is not None and checkpoint.file_id == file_id:
+        return checkpoint.hasher.copy()
+    hasher = update_digest(hashlib.sha1(), buf, 0, checkpoint.offset)
+    if hasher.hexdigest() != checkpoint.digest:
+        return None
+    return hasher
+
+
+def hold_tail(records, tail):
+    """Yield the records but the last one, which is appended to tail.
+
+    The last record given by QifParser.iterRecords is the text after the
+    last separator: the record which may not be completely written yet.
+    """
+    records = iter(records)
+    previous = next(records)
+    for record in records:
+        yield previous
+        previous = record
+    tail.append(previous)
+
+
+def tail_start(buf, tail, encoding, start):
+    """Return the offset of the text tail held by hold_tail in buf."""
+    offset = len(buf) - len(tail.encode(encoding))
+    if offset < start or buf[offset:].decode(encoding) != tail:
+        # the encoding doesn't give back the same bytes
+        offset = records_end(buf, start)
+    return offset
+
+
+def records_end(buf, start):
+    """Return the offset of the end of the last complete record of buf.
+
+    A record is complete once the separator following it is written; a
+    trailing CR may be the first half of the newline of a separator, so it
+    is not counted.  The offset is start when there is no complete record
+    after start.
+    """
+    end = len(buf)
+    if end > start and buf[end - 1:end] == b'\r':
+        end -= 1
+    for (record_start, record_end, may_have_header) in \
+            iter_record_ranges(buf, start, end):
+        if record_end == end:
+            # the record is not followed by a separator
+            return record_start
+    return end
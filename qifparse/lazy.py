@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+"""Parse QIF files lazily.
+
+QifParser.parseFileLazy scans a file once, without building any entry, to
+make a RecordIndex: the byte range of each record, with its kind, section
+header, owning account and date.  It returns a LazyQif, a Qif whose
+accounts, categories, classes and tags are parsed, but whose transactions
+are only parsed when they are touched, a bounded number of them being kept
+in memory at any time.
+
+The index can be saved next to the file, so that the scan is skipped the
+next time the file is opened, as long as the file does not change.  The
+byte-level scan expects an encoding in which newlines, carets and field
+codes are ASCII bytes, such as cp1252 or UTF-8.
+"""
+import mmap
+import os
+import pickle
+import re
+import sys
+from array import array
+from collections import OrderedDict
+from qifparse.dates import CacheInfo, DATE_SAMPLE_SIZE
+from qifparse.files import DEFAULT_ENCODING
+from qifparse.parallel import iter_record_ranges
+from qifparse.qif import Qif
+
+# Maximum number of transactions kept parsed by a LazyQif
+DEFAULT_MAX_RECORDS = 10000
+
+# The index of file.qif is saved as file.qif.qidx
+INDEX_SUFFIX = '.qidx'
+INDEX_MAGIC = b'QIFIDX'
+INDEX_VERSION = 1
+
+# Kinds of records, as coded in RecordIndex.kinds
+KINDS = ('category', 'account', 'transaction', 'investment', 'class', 'tag',
+         'memorized')
+_KIND_CODES = dict((kind, code) for code, kind in enumerate(KINDS))
+_NO_KIND = -1
+
+# Kinds of records parsed on demand by a LazyQif
+LAZY_KINDS = ('transaction', 'investment', 'memorized')
+
+# Byte offsets may not fit the C long of every platform
+try:
+    array('q')
+    OFFSET_TYPECODE = 'q'
+except ValueError:
+    OFFSET_TYPECODE = 'l'
+
+# The date line of a transaction or an investment, after any newline
+_DATE_LINE = re.compile(br'(?:^|(?<=\r))D([^\r\n]*)', re.M)
+
+
+class RecordIndex(object):
+    """Byte ranges and parse state of the non-empty records of a file.
+
+    Record number i spans the bytes starts[i] to ends[i], and is parsed
+    as a record of kind KINDS[kinds[i]] in the section header_names[
+    headers[i]] (or none, for -1), with an auto-switch count of
+    switches[i] before it.  owners[i] is the number of the account record
+    a transaction belongs to (-1 for none), and dates[i] the ordinal of
+    the date of a transaction or an investment (0 if it is unknown).
+    """
+
+    def __init__(self):
+        self.starts = array(OFFSET_TYPECODE)
+        self.ends = array(OFFSET_TYPECODE)
+        self.kinds = array('b')
+        self.headers = array('h')
+        self.owners = array('l')
+        self.dates = array('l')
+        self.switches = array('b')
+        self.header_names = []
+        # (size, mtime, date_format, encoding) of the indexed file
+        self.source = None
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _arrays(self):
+        return (self.starts, self.ends, self.kinds, self.headers,
+                self.owners, self.dates, self.switches)
+
+    def kind(self, number):
+        code = self.kinds[number]
+        return KINDS[code] if code != _NO_KIND else None
+
+    def header(self, number):
+        code = self.headers[number]
+        return self.header_names[code] if code >= 0 else None
+
+    def save(self, path):
+        """Write the index to path, replacing any previous file."""
+        meta = {
+            'version': INDEX_VERSION,
+            'byteorder': sys.byteorder,
+            'typecodes': [values.typecode for values in self._arrays()],
+            'count': len(self),
+            'header_names': self.header_names,
+            'source': self.source,
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file_handle:
+            file_handle.write(INDEX_MAGIC)
+            pickle.dump(meta, file_handle, 2)
+            for values in self._arrays():
+                values.tofile(file_handle)
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save, or return None if it can't be
+        used on this platform."""
+        with open(path, 'rb') as file_handle:
+            if file_handle.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                return None
+            meta = pickle.load(file_handle)
+            index = cls()
+            if meta.get('version') != INDEX_VERSION or \
+                    meta['byteorder'] != sys.byteorder or \
+                    meta['typecodes'] != [values.typecode
+                                          for values in index._arrays()]:
+                return None
+            for values in index._arrays():
+                values.fromfile(file_handle, meta['count'])
+        index.header_names = meta['header_names']
+        index.source = meta['source']
+        return index
+
+
+def file_source(filename, date_format, encoding):
+    """Describe a file, and the options its index depends on."""
+    stat = os.stat(filename)
+    return (stat.st_size, stat.st_mtime, date_format, encoding)
+
+
+def load_index(filename, date_format=None, encoding=DEFAULT_ENCODING):
+    """Return the index saved next to filename, or None if there is none
+    or if it does not match the file any more."""
+    path = filename + INDEX_SUFFIX
+    if not os.path.exists(path):
+        return None
+    try:
+        index = RecordIndex.load(path)
+    except (EOFError, ValueError, pickle.UnpicklingError):
+        return None
+    if index is None or \
+            index.source != file_source(filename, date_format, encoding):
+        return None
+    return index
+
+
+def build_index(parser, buf, encoding=DEFAULT_ENCODING):
+    """Scan the bytes of a file, and return its RecordIndex.
+
+    parser must be configured as it would be to parse the file: its
+    section headers are parsed with parser.parseTypeLines, and the dates
+    with parser.parseQifDateTime.  The records are the ones given by
+    qifparse.parallel.iter_record_ranges.
+    """
+    index = RecordIndex()
+    (starts, ends, kinds, headers, owners, dates, switches) = \
+        [values.append for values in index._arrays()]
+    header_codes = {None: -1}
+    # ordinals of the dates, as found in the file
+    ordinals = {}
+    search_date = _DATE_LINE.search
+    kind = header = None
+    kind_code = header_code = _NO_KIND
+    account = -1
+    for (start, end, may_have_header) in iter_record_ranges(buf):
+        number = len(index.starts)
+        switches(min(parser.auto_switches, 2))
+        if may_have_header:
+            lines = buf[start:end].decode(encoding).splitlines()
+            (next_type, new_header) = parser.parseTypeLines(lines)
+            if next_type:
+                kind = next_type
+                kind_code = _KIND_CODES[kind]
+            if new_header:
+                header = new_header
+                if header not in header_codes:
+                    header_codes[header] = len(index.header_names)
+                    index.header_names.append(header)
+                header_code = header_codes[header]
+        starts(start)
+        ends(end)
+        kinds(kind_code)
+        headers(header_code)
+        date = 0
+        if kind == 'transaction' or kind == 'investment':
+            owners(account)
+            match = search_date(buf, start, end)
+            if match:
+                text = match.group(1)
+                date = ordinals.get(text)
+                if date is None:
+                    try:
+                        date = parser.parseQifDateTime(
+                            text.decode(encoding)).toordinal()
+                    except (ValueError, IndexError):
+                        date = 0
+                    ordinals[text] = date
+        else:
+            owners(-1)
+            if kind == 'account':
+                account = number
+            elif kind == 'memorized':
+                account = -1
+        dates(date)
+    return index
+
+
+class RecordList(object):
+    """The transactions of a section, parsed when they are touched.
+
+    It behaves as the list a Qif or an Account keeps for each section
+    header: the indexed records come first, followed by the transactions
+    appended later, which are kept as they are.
+    """
+
+    def __init__(self, qif_obj):
+        self._qif = qif_obj
+        self._records = array('l')
+        self._added = []
+
+    def __len__(self):
+        return len(self._records) + len(self._added)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError('list index out of range')
+        if position < len(self._records):
+            return self._qif._record(self._records[position])
+        return self._added[position - len(self._records)]
+
+    def __iter__(self):
+        record = self._qif._record
+        for number in self._records:
+            yield record(number)
+        for item in self._added:
+            yield item
+
+    def append(self, item):
+        self._added.append(item)
+
+    def extend(self, items):
+        self._added.extend(items)
+
+    def between(self, first, last):
+        """Yield the transactions whose date ordinal is from first to last.
+
+        Only the indexed records in that range, or whose date is unknown,
+        are parsed.
+        """
+        dates = self._qif.index.dates
+        record = self._qif._record
+        for number in self._records:
+            date = dates[number]
+            if not date or first <= date <= last:
+                item = record(number)
+                if date or _date_between(item, first, last):
+                    yield item
+        for item in self._added:
+            if _date_between(item, first, last):
+                yield item
+
+    def __repr__(self):
+        return '<%s of %d transactions>' % (type(self).__name__, len(self))
+
+
+def _date_between(item, first, last):
+    date = getattr(item, 'date', None)
+    return date is not None and first <= date.toordinal() <= last
+
+
+class LazyQif(Qif):
+    """A Qif object whose transactions are parsed on demand.
+
+    The transactions of the accounts and of the Qif object are kept in
+    RecordLists; at most max_records of them stay parsed (None for no
+    limit), the least recently used being dropped first.  A transaction
+    parsed again after being dropped is a new object: changes made to it
+    are lost.  The file stays mapped in memory until close is called.
+    """
+
+    def __init__(self, parser, buf, index, encoding=DEFAULT_ENCODING,
+                 max_records=DEFAULT_MAX_RECORDS):
+        super(LazyQif, self).__init__()
+        self.index = index
+        self.encoding = encoding
+        self.max_records = max_records
+        self.hits = 0
+        self.misses = 0
+        self._parser = parser
+        self._buf = buf
+        self._cache = OrderedDict()
+        self._add_records()
+
+    @classmethod
+    def open(cls, parser, filename, date_format=None, fixed_point=None,
+             encoding=DEFAULT_ENCODING, max_records=DEFAULT_MAX_RECORDS,
+             save_index=False):
+        """Map filename in memory, and index it unless a valid index was
+        saved next to it; see QifParser.parseFileLazy."""
+        # an instance of its own keeps this configuration apart from the
+        # one of parser
+        if not isinstance(parser, type):
+            parser = type(parser)
+        parser = parser(date_format, fixed_point)
+        with open(filename, 'rb') as file_handle:
+            buf = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            parser.detectDateFormat(buf[:DATE_SAMPLE_SIZE], encoding)
+            index = load_index(filename, date_format, encoding)
+            if index is None:
+                source = file_source(filename, date_format, encoding)
+                index = build_index(parser, buf, encoding)
+                index.source = source
+                if save_index:
+                    index.save(filename + INDEX_SUFFIX)
+            return cls(parser, buf, index, encoding, max_records)
+        except Exception:
+            buf.close()
+            raise
+
+    def _add_records(self):
+        # Add the records as the parser would, except that the
+        # transactions are only noted in RecordLists
+        index = self.index
+        accounts = {}
+        for number in range(len(index)):
+            kind = index.kind(number)
+            if kind in LAZY_KINDS:
+                container = accounts.get(index.owners[number], self)
+                header = index.header(number)
+                records = container._transactions.get(header)
+                if records is None:
+                    records = container._transactions[header] = \
+                        RecordList(self)
+                records._records.append(number)
+                container._last_header = header
+                continue
+            item = self._parse(number)
+            if kind == 'account':
+                self.add_account(item)
+                accounts[number] = item
+            elif kind == 'category':
+                self.add_category(item)
+            elif kind == 'class':
+                self.add_class(item)
+            elif kind == 'tag':
+                self.add_tag(item)
+
+    def _parse(self, number):
+        index = self.index
+        chunk = self._buf[index.starts[number]:index.ends[number]]
+        parser = self._parser
+        parser.auto_switches = index.switches[number]
+        return parser.parseRecord(chunk.decode(self.encoding),
+                                  index.kind(number), index.header(number))[2]
+
+    def _record(self, number):
+        cache = self._cache
+        try:
+            item = cache.pop(number)
+        except KeyError:
+            self.misses += 1
+            item = self._parse(number)
+            if self.max_records is not None and \
+                    len(cache) >= self.max_records:
+                cache.popitem(last=False)
+        else:
+            self.hits += 1
+        cache[number] = item
+        return item
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.max_records,
+                         len(self._cache))
+
+    def cache_clear(self):
+        self._cache.clear()
+        self.hits = self.misses = 0
+
+    def iter_transactions(self, start=None, end=None, name=None):
+        """Yield the (account, header, transaction) tuples of the
+        transactions dated from start to end, both included.
+
+        account is the name of the account of the transaction, or None;
+        with name, only the transactions of the accounts of that name are
+        given.  Thanks to the dates of the index, only the transactions in
+        the range are parsed.
+        """
+        first = start.toordinal() if start is not None else 1
+        last = end.toordinal() if end is not None else sys.maxsize
+        containers = [(acc.name, acc) for acc in self.get_accounts(name)]
+        if not name:
+            containers.append((None, self))
+        for (account, container) in containers:
+            for header, records in container._transactions.items():
+                if isinstance(records, RecordList):
+                    items = records.between(first, last)
+                else:
+                    items = (item for item in records
+                             if _date_between(item, first, last))
+                for item in items:
+                    yield (account, header, item)
+
+    def close(self):
+        """Unmap the file: transactions which are not parsed yet can't be
+        touched any more."""
+        self._buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Parse QIF files with several processes.
+
+For QifParser.parseFileParallel, a single file is scanned for record
+separators and section headers, and cut into byte ranges made of whole
+records.  Each range is parsed by a worker process, starting from the state
+the parser would have at the beginning of the range; the records are then
+added to one Qif object, in the order they have in the file.
+
+For QifParser.parse_many, each worker process parses whole files.
+"""
+import pickle
+import re
+import six
+from collections import namedtuple
+from qifparse import QifParserException
+from qifparse.files import map_file, split_records, DEFAULT_ENCODING
+
+# Number of ranges given to each worker, so that the workers which finish
+# early can take over some of the work of the others
+RANGES_PER_WORKER = 4
+
+# The caret of a record separator, as found in the file: it is followed
+# (and preceded) by any of the CR, LF or CRLF newlines.  The group catches
+# the start of the next record when its first line may be a section header.
+# Searching for the caret rather than for the newline before it is much
+# faster, but the newline must then be checked separately.
+SEPARATOR = re.compile(br'\^(?:\r\n|\r|\n)([^\r\n!]*!)?')
+NEWLINES = (b'\r', b'\n')
+
+# Outcome of the parse of a file by QifParser.parse_many: error is the
+# exception raised while parsing or merging the file, or None
+ParseResult = namedtuple('ParseResult', ['path', 'qif', 'error'])
+
+
+def iter_record_ranges(buf, start=0, end=None):
+    """Yield the (start, end, may_have_header) tuples of the non-empty
+    records of the content of a file, or of the part of it from start
+    to end.
+
+    The records are the ones qifparse.files.split_records would give;
+    may_have_header is false when the first line of the record can't be a
+    section header.
+    """
+    if end is None:
+        end = len(buf)
+    record_start = start
+    may_have_header = True
+    for match in SEPARATOR.finditer(buf, start, end):
+        caret = match.start()
+        if caret <= record_start or buf[caret - 1:caret] not in NEWLINES:
+            # see scan_ranges
+            continue
+        record_end = caret - 1
+        if buf[record_end - 1:caret] == b'\r\n':
+            record_end -= 1
+        if record_start < record_end:
+            yield (record_start, record_end, may_have_header)
+        if match.group(1) is None:
+            may_have_header = False
+            record_start = match.end()
+        else:
+            may_have_header = True
+            record_start = match.start(1)
+    if record_start < end:
+        yield (record_start, end, may_have_header)
+
+
+def scan_ranges(parser, buf, count, encoding=DEFAULT_ENCODING):
+    """Cut the content of a file into about count ranges of whole records.
+
+    Returns a list of (start, end, context) tuples, where context is the
+    (last_type, transactions_header, auto_switches) state the parser has
+    when it reaches start.  The section headers are parsed as they are
+    found, with parser.parseTypeLines, so that parser.auto_switches ends up
+    as it would be after parsing the whole file.  If a header can't be
+    parsed, the rest of the file makes the last range, so that the error is
+    raised in the order of the file when that range is parsed.
+    """
+    size = len(buf)
+    step = max(size // count, 1)
+    ranges = []
+    start = 0
+    context = (None, None, parser.auto_switches)
+    state = [None, None]
+    # start of the current record, if it may begin with a section header
+    header_start = 0
+    record_start = 0
+    try:
+        for match in SEPARATOR.finditer(buf):
+            caret = match.start()
+            if caret <= record_start or \
+                    buf[caret - 1:caret] not in NEWLINES:
+                # either there is no newline before the caret, or it
+                # belongs to the previous separator: str.split would not
+                # see a separator here
+                continue
+            if header_start is not None:
+                record_end = caret - 1
+                if buf[record_end - 1:caret] == b'\r\n':
+                    record_end -= 1
+                _scan_header(parser, buf[header_start:record_end], state,
+                             encoding)
+            if match.group(1) is None:
+                header_start = None
+                record_start = match.end()
+            else:
+                header_start = record_start = match.start(1)
+            if record_start >= start + step and record_start < size:
+                ranges.append((start, record_start, context))
+                start = record_start
+                context = tuple(state) + (parser.auto_switches,)
+        if header_start is not None:
+            _scan_header(parser, buf[header_start:size], state, encoding)
+    except (QifParserException, UnicodeDecodeError):
+        pass
+    ranges.append((start, size, context))
+    return ranges
+
+
+def _scan_header(parser, data, state, encoding):
+    # state is the [last_type, transactions_header] list to update
+    lines = data.decode(encoding).splitlines()
+    if lines and lines[0].strip().startswith('!'):
+        (next_type, new_header) = parser.parseTypeLines(lines)
+        if next_type:
+            state[0] = next_type
+        if new_header:
+            state[1] = new_header
+
+
+def parse_range(task):
+    """Parse the records of a range of a file, in a worker process.
+
+    task is a (parser, filename, start, end, date_format, fixed_point,
+    encoding, context, detection) tuple, context being the one given by
+    scan_ranges, and detection the qifparse.dates.DateDetection of the
+    dates of the file, if any.  Returns the list of the (last_type,
+    transactions_header, item) tuples given by parser.parseRecord for each
+    record, and the exception which stopped the parse, if any: the records
+    before it must still be added to the Qif object before raising it, as
+    a parse in a single process would.
+    """
+    (parser, filename, start, end, date_format, fixed_point, encoding,
+     context, detection) = task
+    (last_type, transactions_header, auto_switches) = context
+    parser = parser()
+    with map_file(filename) as buf:
+        text = buf[start:end].decode(encoding)
+    parser.configure(date_format, fixed_point)
+    if detection is not None:
+        parser.useDateDetection(detection)
+    parser.auto_switches = auto_switches
+    records = []
+    try:
+        for chunk in split_records(text):
+            if chunk:
+                record = parser.parseRecord(chunk, last_type,
+                                            transactions_header)
+                (last_type, transactions_header) = record[:2]
+                records.append(record)
+    except Exception as error:
+        return (records, error)
+    return (records, None)
+
+
+def parse_file(task):
+    """Parse a whole file, in a worker process.
+
+    task is a (parser, path, date_format, fixed_point, encoding) tuple.
+    Returns a ParseResult, whose qif is None if the file could not be
+    parsed.
+    """
+    (parser, path, date_format, fixed_point, encoding) = task
+    try:
+        qif = parser.parseFile(path, date_format, fixed_point,
+                               encoding=encoding)
+    except Exception as error:
+        try:
+            pickle.loads(pickle.dumps(error))
+        except Exception:
+            # the error must reach the main process
+            error = RuntimeError(six.u('%s: %s' % (type(error).__name__,
+                                                   error)))
+        return ParseResult(path, None, error)
+    return ParseResult(path, qif, None)
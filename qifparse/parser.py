@@ -1,7 +1,47 @@
 # -*- coding: utf-8 -*-
+import functools
+import gc
+import hashlib
+import inspect
+import logging
+import os
+import re
 import six
-from datetime import datetime
 from decimal import Decimal
+from multiprocessing import cpu_count, Pool
+from qifparse import QifParserException
+from qifparse.amounts import fixed_point_types, DecimalCache
+from qifparse.cache import parse_options
+from qifparse.dates import (
+    detect_date_format,
+    sample_dates,
+    DateParser,
+    DATE_SAMPLE_SIZE,
+)
+from qifparse.files import (
+    map_blocks,
+    map_file,
+    read_blocks,
+    split_complete,
+    split_records,
+    DEFAULT_ENCODING,
+)
+from qifparse.incremental import (
+    file_identity,
+    hold_tail,
+    resume_digest,
+    tail_start,
+    update_digest,
+    window_digest,
+    Checkpoint,
+)
+from qifparse.lazy import LazyQif, DEFAULT_MAX_RECORDS
+from qifparse.parallel import (
+    parse_file,
+    parse_range,
+    scan_ranges,
+    RANGES_PER_WORKER,
+)
 from qifparse.qif import (
     Transaction,
     MemorizedTransaction,
@@ -15,8 +55,20 @@ from qifparse.qif import (
     DEFAULT_ACCOUNT_TYPE,
 )
 
+logger = logging.getLogger(__name__)
+
 TYPE_HEADER = '!Type:'
 
+# Size of the blocks read from file handles, in characters
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+SECTION_HEADERS = {
+    'account': '!Account',
+    'category': TYPE_HEADER + 'Cat',
+    'class': TYPE_HEADER + 'Class',
+    'tag': TYPE_HEADER + 'Tag',
+}
+
 NON_INVST_ACCOUNT_TYPES = [
     TYPE_HEADER + DEFAULT_ACCOUNT_TYPE,
     TYPE_HEADER + 'Bank',
@@ -27,6 +79,95 @@ NON_INVST_ACCOUNT_TYPES = [
     TYPE_HEADER + 'CCard',    # Preferred capitalization
 ]
 
+# Section headers, and the kind of records they introduce
+SECTION_TYPES = dict(
+    [('!Account', 'account'),
+     (TYPE_HEADER + 'Cat', 'category'),
+     (TYPE_HEADER + 'Invst', 'investment'),
+     (TYPE_HEADER + 'Class', 'class'),
+     (TYPE_HEADER + 'Memorized', 'memorized'),
+     (TYPE_HEADER + 'Tag', 'tag')] +
+    [(header, 'transaction') for header in NON_INVST_ACCOUNT_TYPES])
+
+# Kinds of records whose section header is kept by the parser
+TRANSACTION_TYPES = ('transaction', 'investment', 'memorized')
+
+# Name of the QifParser method which builds each kind of record
+RECORD_BUILDERS = {
+    'category': 'buildCategory',
+    'account': 'buildAccount',
+    'transaction': 'buildTransaction',
+    'investment': 'buildInvestment',
+    'class': 'buildClass',
+    'tag': 'buildTag',
+    'memorized': 'buildMemorizedTransaction',
+}
+
+# The line boundaries of str.splitlines
+_LINE_BREAKS = u'\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+
+# A (code, value) token of a record: the first character of a non-empty
+# line, and the rest of the line
+TOKEN = re.compile(u'([^%s])([^%s]*)' % (_LINE_BREAKS, _LINE_BREAKS))
+
+# Dispatch tables, from field code to attribute name, for the fields whose
+# value is kept as it is found in the file
+CLASS_FIELDS = {'N': 'name', 'D': 'description'}
+TAG_FIELDS = {'N': 'name', 'D': 'description'}
+CATEGORY_FIELDS = {
+    'N': 'name',
+    'D': 'description',
+    'B': 'budget_amount',
+    'R': 'tax_schedule_info',
+}
+ACCOUNT_FIELDS = {
+    'N': 'name',
+    'D': 'description',
+    'L': 'credit_limit',
+    '$': 'balance_amount',
+}
+MEMORIZED_FIELDS = {
+    'C': 'cleared',
+    'P': 'payee',
+    'M': 'memo',
+    'K': 'mtype',
+}
+TRANSACTION_FIELDS = {
+    'N': 'num',
+    'C': 'cleared',
+    'P': 'payee',
+    'M': 'memo',
+    '1': 'first_payment_date',
+    '2': 'years_of_loan',
+    '3': 'num_payments_done',
+    '4': 'periods_per_year',
+    '5': 'interests_rate',
+    '6': 'current_loan_balance',
+    '7': 'original_loan_amount',
+}
+INVESTMENT_FIELDS = {
+    'N': 'action',
+    'Y': 'security',
+    'C': 'cleared',
+    'M': 'memo',
+    'P': 'first_line',
+}
+
+# Kind of the quantities which are not amounts of money, for the fixed
+# point mode
+QUANTITY_KINDS = {'price': 'price', 'quantity': 'quantity'}
+
+# Dispatch tables for the fields holding a quantity
+AMOUNT_FIELDS = {'T': 'amount', 'U': 'uamount'}
+INVESTMENT_AMOUNT_FIELDS = {
+    'T': 'amount',
+    'I': 'price',
+    'Q': 'quantity',
+    '$': 'amount_transfer',
+    'O': 'commission',
+}
+
+
 def is_obfuscated_account_type (account_type):
     """Recognize a type that is not written with a documented name.
 
@@ -66,389 +207,1014 @@ def is_obfuscated_type_header (first_line):
     return first_line.startswith(TYPE_HEADER) and \
         is_obfuscated_account_type(first_line[len(TYPE_HEADER):])
 
-class QifParserException(Exception):
-    pass
 
+def _deduplicated(results, dedup):
+    # the ParseResults of parse_many, filtered by dedup
+    for result in results:
+        if result.qif is not None:
+            dedup.filter(result.qif)
+        yield result
+
+
+# Attributes holding the configuration and the state of a parse, copied to
+# the QifParser class after a parse started on the class, where they used
+# to be kept
+PARSER_STATE = ('file_being_parsed', 'date_format', 'fixed_point',
+                'date_parser', 'amount_types', 'stats', 'auto_switches',
+                'qif_obj')
+
+
+def parsermethod(func):
+    """Mark a QifParser method as callable on the class too.
+
+    Called on an instance, the method uses the configuration and state of
+    that instance.  Called on the class, it runs on an instance reading
+    the class attributes, where the parser kept its state before it had
+    instances, and the state it changes is copied back to them.
+    """
+    func._starts_parse = False
+    return func
+
+
+def entrymethod(func):
+    """Mark a QifParser method starting a parse.
+
+    Called on the class, it runs on a new instance, so that parses started
+    by several threads at once don't mix their states; the state of the
+    instance is then copied to the class attributes, where callers used to
+    find it.
+    """
+    func._starts_parse = True
+    return func
+
+
+def _lookup(cls, name):
+    # the attribute called name of cls, without the properties of
+    # ParserMeta
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            return klass.__dict__[name]
+    raise AttributeError(name)
+
+
+def _parse_decimal(chunk, name=None):
+    # what parseAmount does without fixed point amounts
+    return Decimal(chunk.replace(',', ''))
+
+
+# Methods converting the values of transactions: buildTransaction calls
+# them only when a subclass overrides one of them
+VALUE_METHODS = ('parseAmount', 'parseFloat', 'parseQifDateTime')
+
+
+def _class_method(cls, name):
+    # the method called name of cls, called on the class
+    func = _lookup(cls, name)
+    if not inspect.isfunction(func):
+        return func.__get__(None, cls)
+    if getattr(func, '_starts_parse', False):
+        start = cls
+    else:
+        # an instance without a state of its own
+        start = functools.partial(object.__new__, cls)
+    if inspect.isgeneratorfunction(func):
+        def call(*args, **kwargs):
+            parser = start()
+            try:
+                for item in func(parser, *args, **kwargs):
+                    yield item
+            finally:
+                parser._publish_state(cls)
+    else:
+        def call(*args, **kwargs):
+            parser = start()
+            try:
+                return func(parser, *args, **kwargs)
+            finally:
+                parser._publish_state(cls)
+    return functools.wraps(func)(call)
+
+
+def _class_property(name):
+    return property(lambda cls: _class_method(cls, name))
+
+
+class ParserMeta(type):
+    """Metaclass making the QifParser methods marked by parsermethod and
+    entrymethod callable on the class.
+
+    The methods are plain instance methods.  Their calls on the class go
+    through properties of the metaclass, which the lookups on instances
+    never see, so they cost nothing more.
+    """
+
+    def __new__(meta, name, bases, namespace):
+        for key, value in namespace.items():
+            if hasattr(value, '_starts_parse') and key not in meta.__dict__:
+                setattr(meta, key, _class_property(key))
+        return super(ParserMeta, meta).__new__(meta, name, bases, namespace)
 
+
+@six.add_metaclass(ParserMeta)
 class QifParser(object):
+    """Parser of QIF files.
+
+    The parse methods can be called on the class, as they always could, or
+    on instances, which take default options for their parses.  Each
+    instance has its own configuration and state, so separate instances
+    can parse at the same time in different threads (in a
+    concurrent.futures.ThreadPoolExecutor, say); a single instance parses
+    one file at a time.  The parses started on the class run on new
+    instances too, but they all leave their state in the same class
+    attributes.
+    """
 
+    default_date_format = None
+    default_fixed_point = None
+    default_stats = None
     file_being_parsed = None
+    date_format = None
+    fixed_point = None
+    date_parser = DateParser()
+    amount_types = None
+    stats = None
+    dedup = None
+    auto_switches = 0
+    qif_obj = None
+    # whether the values of the transactions can be converted without
+    # going through VALUE_METHODS, and the amounts converted then; see
+    # configure
+    plain_values = False
+    decimals = None
+
+    def __init__(self, date_format=None, fixed_point=None, stats=None,
+                 dedup=None):
+        """Create a parser whose parses use these options, unless others
+        are given to them.
+
+        With dedup, a qifparse.dedup.Deduplicator, the transactions and
+        investments it has already seen, in this parse or an earlier one,
+        are left out of the results of the parses of the parser.
+        """
+        self.default_date_format = date_format
+        self.default_fixed_point = fixed_point
+        self.default_stats = stats
+        self.dedup = dedup
+        self.configure()
+
+    def _publish_state(self, cls):
+        for name in PARSER_STATE:
+            if name in self.__dict__:
+                setattr(cls, name, self.__dict__[name])
+
+    @entrymethod
+    def parseFile(self, filename, date_format=None, fixed_point=None,
+                  workers=None, encoding=DEFAULT_ENCODING, cache=None,
+                  stats=None):
+        """Parse a QIF file.
+
+        The file is mapped in memory and decoded from encoding one block
+        at a time (see qifparse.files); its newlines may be CR, LF or
+        CRLF.  With workers greater than 1, the file is parsed by a pool
+        of that many processes; see parseFileParallel.
+
+        With cache, a qifparse.cache.ParseCache, the Qif object is loaded
+        from the cache if the file was already parsed with the same
+        options, and stored in it otherwise.  The Qif object is cached
+        before the Deduplicator of the parser, if any, filters it.
+
+        With stats, a qifparse.stats.ParseStats, the parse is measured
+        and counted in it; the file is then parsed in this process,
+        whatever workers is.
+        """
+        self.configure(date_format, fixed_point, stats)
+        stats = self.stats
+        if cache is not None:
+            options = parse_options(self.date_format, self.fixed_point,
+                                    encoding)
+            qif_obj = cache.get(filename, options)
+            dedup = self.dedup
+            if qif_obj is None:
+                source = cache.source(filename)
+                self.dedup = None
+                try:
+                    qif_obj = self.parseFile(filename, self.date_format,
+                                             self.fixed_point, workers,
+                                             encoding, stats=stats)
+                finally:
+                    self.dedup = dedup
+                cache.put(filename, qif_obj, options, source)
+            if dedup is not None:
+                dedup.filter(qif_obj)
+            self.qif_obj = qif_obj
+            return qif_obj
+        if workers is not None and workers > 1 and stats is None:
+            return self.parseFileParallel(filename, self.date_format,
+                                          self.fixed_point, workers, encoding)
+        self.file_being_parsed = filename
+        self.qif_obj = Qif()
+        with map_file(filename) as buf:
+            self.detectDateFormat(buf[:DATE_SAMPLE_SIZE], encoding)
+            blocks = map_blocks(buf, encoding)
+            if stats is not None:
+                stats.bytes += len(buf)
+                blocks = stats.read(blocks)
+            self.parseChunks(self.iterRecords(blocks))
+        return self.qif_obj
+
+    @entrymethod
+    def parseFileParallel(self, filename, date_format=None, fixed_point=None,
+                          workers=2, encoding=DEFAULT_ENCODING):
+        """Parse a QIF file with a pool of worker processes.
+
+        The file is cut into ranges of whole records (see
+        qifparse.parallel), which the workers parse knowing the section
+        header and auto-switch state each range starts with.  The records
+        are then added to the Qif object in the order of the file, so the
+        result is the same as the one of a parse in a single process.
+        """
+        self.file_being_parsed = filename
+        self.configure(date_format, fixed_point)
+        self.qif_obj = Qif()
+        with map_file(filename) as buf:
+            if not len(buf):
+                raise QifParserException('Data is empty')
+            detection = self.detectDateFormat(buf[:DATE_SAMPLE_SIZE],
+                                              encoding)
+            ranges = scan_ranges(self, buf, workers * RANGES_PER_WORKER,
+                                 encoding)
+        tasks = [(type(self), filename, start, end, self.date_format,
+                  self.fixed_point, encoding, context, detection)
+                 for (start, end, context) in ranges]
+        pool = Pool(workers)
+        # the records received from the workers only add objects to the
+        # heap: let the garbage collector wait until they are all merged
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            last_account = None
+            for (records, error) in pool.imap(parse_range, tasks):
+                for (last_type, transactions_header, item) in records:
+                    last_account = self.addRecord(item, last_type,
+                                                  transactions_header,
+                                                  last_account)
+                if error is not None:
+                    raise error
+        finally:
+            if gc_enabled:
+                gc.enable()
+            pool.terminate()
+            pool.join()
+        return self.qif_obj
+
+    @entrymethod
+    def parseFileLazy(self, filename, date_format=None, fixed_point=None,
+                      encoding=DEFAULT_ENCODING,
+                      max_records=DEFAULT_MAX_RECORDS, save_index=False):
+        """Parse a QIF file lazily, returning a qifparse.lazy.LazyQif.
+
+        The file is scanned once to index its records; the accounts,
+        categories, classes and tags are parsed, but the transactions are
+        only parsed when they are touched, and at most max_records of them
+        are kept in memory.  With save_index, the index is saved next to
+        the file (as filename + qifparse.lazy.INDEX_SUFFIX); a saved index
+        is used instead of the scan as long as the file and the options
+        are unchanged.
+        """
+        if not os.path.getsize(filename):
+            raise QifParserException('Data is empty')
+        self.configure(date_format, fixed_point)
+        return LazyQif.open(self, filename, self.date_format,
+                            self.fixed_point, encoding, max_records,
+                            save_index)
 
-    @classmethod
-    def parseFile(cls_, filename, date_format=None):
-        cls_.file_being_parsed = filename
-        return cls_.parseFileHandle(open(filename, 'U'), date_format)
+    @entrymethod
+    def parseFileIncremental(self, filename, date_format=None,
+                             fixed_point=None, encoding=DEFAULT_ENCODING,
+                             checkpoint=None):
+        """Parse the records appended to a QIF file since a checkpoint.
 
-    @classmethod
-    def parseFileHandle(cls_, file_handle, date_format):
-        if not cls_.file_being_parsed:
-            cls_.file_being_parsed = 'given file handle'
+        Returns a qifparse.incremental.Checkpoint, whose qif is the Qif
+        object the records were added to.  Given to a later call, it lets
+        only the records appended to the file in between be parsed, into
+        the same Qif object.  Without a checkpoint, or if the file was
+        truncated or rewritten since, or if the options changed, the whole
+        file is parsed into a new Qif object.
+
+        The last record is left for the next call until it is followed by
+        a separator, as it may not be completely written yet.  If the
+        parse fails, the Qif object may have some of the new records: the
+        checkpoint should not be used any more.
+        """
+        self.file_being_parsed = filename
+        self.configure(date_format, fixed_point)
+        options = parse_options(self.date_format, self.fixed_point, encoding)
+        file_id = file_identity(filename)
+        with map_file(filename) as buf:
+            hasher = resume_digest(checkpoint, buf, options, file_id)
+            if hasher is None:
+                hasher = hashlib.sha1()
+                start = 0
+                state = (None, None, None)
+                self.qif_obj = Qif()
+                self.detectDateFormat(buf[:DATE_SAMPLE_SIZE], encoding)
+            else:
+                if checkpoint.date_detection is not None:
+                    self.useDateDetection(checkpoint.date_detection)
+                start = checkpoint.offset
+                state = (checkpoint.last_type,
+                         checkpoint.transactions_header,
+                         checkpoint.last_account)
+                self.auto_switches = checkpoint.auto_switches
+                self.qif_obj = checkpoint.qif
+                if self.dedup is not None:
+                    # the appended records belong to the same source
+                    self.dedup.counts = checkpoint.dedup_counts or {}
+            end = start
+            if len(buf) > start:
+                tail = []
+                state = self.parseChunks(hold_tail(self.iterRecords(
+                    map_blocks(buf, encoding, start=start)), tail), state)
+                end = tail_start(buf, tail[0], encoding, start)
+                update_digest(hasher, buf, start, end)
+            window = window_digest(buf, end)
+        (last_type, transactions_header, last_account) = state
+        return Checkpoint(self.qif_obj, end, hasher.hexdigest(), last_type,
+                          transactions_header, last_account,
+                          self.auto_switches, options,
+                          self.date_parser.detection,
+                          self.dedup.counts if self.dedup is not None
+                          else None, file_id, window, hasher)
+
+    @entrymethod
+    def parse_many(self, paths, workers=None, merge=False, date_format=None,
+                   fixed_point=None, ordered=True, encoding=DEFAULT_ENCODING,
+                   dedup=None):
+        """Parse many QIF files with a pool of worker processes.
+
+        Each file is parsed by parseFile, in one of the workers (by default,
+        as many as there are CPUs).  Without merge, an iterator of
+        qifparse.parallel.ParseResult(path, qif, error) tuples is returned:
+        the results come in the order of paths if ordered is true, as soon
+        as they are ready otherwise.  A file which can't be parsed gives a
+        result whose qif is None and whose error is the exception raised;
+        the other files are parsed anyway.
+
+        With merge, the Qif objects are merged into one, in the order of
+        paths, with Qif.merge (auto-switch accounts are merged as
+        add_account does), and a (qif, failures) tuple is returned.
+        failures lists the results of the files which could not be parsed
+        or merged; a file is either merged completely or not at all.
+
+        With dedup, a qifparse.dedup.Deduplicator, the transactions
+        already seen in the files before are left out of the Qif object of
+        each file, in the order the results come in (see Qif.merge).
+        """
+        results = self.iterParseMany(paths, workers, date_format,
+                                     fixed_point, ordered or merge, encoding)
+        if not merge:
+            if dedup is not None:
+                return _deduplicated(results, dedup)
+            return results
+        qif_obj = Qif()
+        failures = []
+        for result in results:
+            if result.error is None:
+                try:
+                    qif_obj.merge(result.qif, dedup)
+                except RuntimeError as error:
+                    result = result._replace(error=error)
+            if result.error is not None:
+                failures.append(result)
+        return (qif_obj, failures)
+
+    @entrymethod
+    def iterParseMany(self, paths, workers=None, date_format=None,
+                      fixed_point=None, ordered=True,
+                      encoding=DEFAULT_ENCODING):
+        """Yield the ParseResult of each file; see parse_many."""
+        paths = list(paths)
+        if not paths:
+            return
+        self.configure(date_format, fixed_point)
+        tasks = [(type(self), path, self.date_format, self.fixed_point,
+                  encoding) for path in paths]
+        workers = workers or cpu_count()
+        # many small files are sent to the workers a few at a time
+        chunksize = max(1, len(tasks) // (workers * RANGES_PER_WORKER))
+        pool = Pool(workers)
+        try:
+            if ordered:
+                results = pool.imap(parse_file, tasks, chunksize)
+            else:
+                results = pool.imap_unordered(parse_file, tasks, chunksize)
+            for result in results:
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @entrymethod
+    def parseFileHandle(self, file_handle, date_format=None, fixed_point=None,
+                        stats=None):
+        if not self.file_being_parsed:
+            self.file_being_parsed = 'given file handle'
         if isinstance(file_handle, type('')):
             raise RuntimeError(
                 six.u("parse() takes in a file handle, not a string"))
-        data = file_handle.read()
-        if len(data) == 0:
-            raise QifParserException('Data is empty')
-        return cls_.parseData(data, date_format)
-
-    @classmethod
-    def parseData(cls_, data, date_format=None):
-        cls_.date_format = date_format
-        cls_.auto_switches = 0
-        cls_.qif_obj = Qif()
-        chunks = data.split('\n^\n')
-        last_type = None
-        last_account = None
-        transactions_header = None
+        self.configure(date_format, fixed_point, stats)
+        stats = self.stats
+        self.qif_obj = Qif()
+        blocks = read_blocks(file_handle, DEFAULT_BLOCK_SIZE)
+        if stats is not None:
+            blocks = stats.read(blocks)
+        self.parseChunks(self.iterRecords(self.detectingDates(blocks)))
+        return self.qif_obj
+
+    @entrymethod
+    def parseData(self, data, date_format=None, fixed_point=None,
+                  stats=None):
+        self.configure(date_format, fixed_point, stats)
+        stats = self.stats
+        self.qif_obj = Qif()
+        self.detectDateFormat(data[:DATE_SAMPLE_SIZE])
+        if stats is None:
+            self.parseChunks(split_records(data))
+        else:
+            stats.characters += len(data)
+            start = stats.timer()
+            chunks = split_records(data)
+            stats.add_time('split', stats.timer() - start)
+            self.parseChunks(chunks)
+        return self.qif_obj
+
+    @parsermethod
+    def configure(self, date_format=None, fixed_point=None, stats=None):
+        """Reset the parser state before parsing a new file.
+
+        date_format is the strptime format of the dates; if not given, the
+        parser tries to guess it for each date.  With fixed_point, amounts,
+        prices and quantities are parsed as qifparse.amounts.FixedPoint
+        integers instead of Decimals: see fixed_point_types for the
+        accepted values.  stats is the qifparse.stats.ParseStats the parse
+        is measured in, if any.  The options which are not given are the
+        default ones of the parser.  The Deduplicator of the parser, if
+        any, starts a new source.
+        """
+        if date_format is None:
+            date_format = self.default_date_format
+        if fixed_point is None:
+            fixed_point = self.default_fixed_point
+        if stats is None:
+            stats = self.default_stats
+        self.date_format = date_format
+        self.fixed_point = fixed_point
+        self.date_parser = DateParser(date_format)
+        self.amount_types = fixed_point_types(fixed_point)
+        self.auto_switches = 0
+        self.stats = stats
+        cls = type(self)
+        self.plain_values = self.amount_types is None and stats is None \
+            and all(_lookup(cls, name) is QifParser.__dict__[name]
+                    for name in VALUE_METHODS)
+        self.decimals = DecimalCache() if self.plain_values else None
+        if self.dedup is not None:
+            # each parse is a source of its own
+            self.dedup.new_source()
+
+    @parsermethod
+    def detectDateFormat(self, text, encoding=None):
+        """Detect the layout of the dates from the start of a file, when no
+        date format was given, so that all its dates are converted the same
+        way instead of being guessed one at a time.
+
+        text is the start of the file, as bytes in encoding if that is
+        given.  Returns the qifparse.dates.DateDetection used, if any.
+        """
+        if self.date_format is not None:
+            return None
+        if encoding is not None:
+            # the last character may be cut
+            text = text.decode(encoding, 'ignore')
+        detection = detect_date_format(sample_dates(text))
+        if detection is not None:
+            self.useDateDetection(detection)
+        return detection
+
+    @parsermethod
+    def useDateDetection(self, detection):
+        """Convert the dates in the layout of detection, a
+        qifparse.dates.DateDetection."""
+        self.date_parser = DateParser.detected(detection)
+
+    @parsermethod
+    def detectingDates(self, blocks):
+        """Yield the blocks of text of a file, detecting the layout of its
+        dates from the first ones; see detectDateFormat."""
+        if self.date_format is not None:
+            for block in blocks:
+                yield block
+            return
+        blocks = iter(blocks)
+        head = []
+        size = 0
+        for block in blocks:
+            head.append(block)
+            size += len(block)
+            if size >= DATE_SAMPLE_SIZE:
+                break
+        self.detectDateFormat(''.join(head))
+        for block in head:
+            yield block
+        for block in blocks:
+            yield block
+
+    @parsermethod
+    def parseChunks(self, chunks, state=(None, None, None)):
+        """Parse records into self.qif_obj.
+
+        state is the (last_type, transactions_header, last_account) state
+        of the parser before the first record; the one after the last
+        record is returned.
+        """
+        if self.stats is not None:
+            return self.parseChunksWithStats(chunks, state)
+        (last_type, transactions_header, last_account) = state
+        parseChunk = self.parseChunk
         for chunk in chunks:
             if chunk:
                 (last_type, transactions_header, last_account) \
-                    = cls_.parseChunk(chunk, last_type,
-                                      transactions_header, last_account)
-        return cls_.qif_obj
-
-    @classmethod
-    def parseChunk(cls_, chunk, last_type, transactions_header, last_account):
-        parsers = {
-            'category': cls_.parseCategory,
-            'account': cls_.parseAccount,
-            'transaction': cls_.parseTransaction,
-            'investment': cls_.parseInvestment,
-            'class': cls_.parseClass,
-            'tag': cls_.parseTag,
-            'memorized': cls_.parseMemorizedTransaction
-        }
-
-        (next_type, new_header) = cls_.parseType(chunk)
-        if next_type:
-            last_type = next_type
-        if new_header:
-            transactions_header = new_header
+                    = parseChunk(chunk, last_type, transactions_header,
+                                 last_account)
+        return (last_type, transactions_header, last_account)
+
+    @parsermethod
+    def parseChunksWithStats(self, chunks, state):
+        """Do what parseChunks does, measuring each phase in self.stats."""
+        stats = self.stats
+        timer = stats.timer
+        phases = stats.phases
+        (last_type, transactions_header, last_account) = state
+        for chunk in stats.time_iter(chunks, 'split'):
+            if not chunk:
+                continue
+            start = timer()
+            lines = chunk.splitlines()
+            (next_type, new_header) = self.parseTypeLines(lines)
+            if next_type:
+                last_type = next_type
+            if new_header:
+                transactions_header = new_header
+            typed = timer()
+            dates = phases['dates']
+            builder = getattr(self, RECORD_BUILDERS[last_type])
+            item = builder([(line[0], line[1:]) for line in lines if line])
+            built = timer()
+            last_account = self.addRecord(item, last_type,
+                                          transactions_header, last_account)
+            inserted = timer()
+            stats.add_time('type', typed - start)
+            # the dates were converted while the fields were parsed
+            stats.add_time('fields',
+                           built - typed - (phases['dates'] - dates))
+            stats.add_time('insert', inserted - built)
+            stats.record(last_type, lines, chunk, inserted - start)
+        return (last_type, transactions_header, last_account)
+
+    @parsermethod
+    def unknownLine(self, kind, line):
+        """Skip a line the parser does not recognize in a record of kind.
+
+        It is counted in self.stats, if any, and logged otherwise.
+        """
+        if self.stats is not None:
+            self.stats.unknown_line(kind, line)
+        else:
+            logger.debug('Skipping unknown line of %s: %s', kind, line)
+
+    @entrymethod
+    def iterparse(self, file_handle, date_format=None,
+                  block_size=DEFAULT_BLOCK_SIZE, fixed_point=None):
+        """Parse a file handle incrementally, one record at a time.
+
+        The handle is read in blocks of at most block_size characters, and
+        nothing is added to a Qif object, so memory use does not depend on
+        the size of the file.  For each record, a tuple
+        (item, header, account) is yielded: header is the section header
+        the record belongs to (e.g. '!Type:Bank' or '!Account'), and
+        account is the last Account read before a transaction or an
+        investment, or None.
+
+        Note that accounts are yielded as they are found: auto-switch
+        accounts are not merged with their later definition, as
+        Qif.add_account does.
+        """
+        if isinstance(file_handle, type('')):
+            raise RuntimeError(
+                six.u("iterparse() takes in a file handle, not a string"))
+        self.configure(date_format, fixed_point)
+        state = (None, None, None)
+        blocks = self.detectingDates(read_blocks(file_handle, block_size))
+        for chunk in self.iterRecords(blocks):
+            if chunk:
+                (state, entry) = self.parseEntry(chunk, state)
+                (item, header, account) = entry
+                if not self.isDuplicate(item, state[0], header, account):
+                    yield entry
+
+    @parsermethod
+    def parseEntry(self, chunk, state):
+        """Parse a single record into the tuple iterparse yields for it.
+
+        state is the (last_type, transactions_header, last_account) state
+        of the parser before the record; the one after it is returned,
+        together with the (item, header, account) tuple.
+        """
+        (last_type, transactions_header, last_account) = state
+        (last_type, transactions_header, item) \
+            = self.parseRecord(chunk, last_type, transactions_header)
+        if last_type == 'account':
+            last_account = item
+            entry = (item, SECTION_HEADERS[last_type], None)
+        elif last_type == 'memorized':
+            last_account = None
+            entry = (item, transactions_header, None)
+        elif last_type == 'transaction' or last_type == 'investment':
+            entry = (item, transactions_header, last_account)
+        else:
+            entry = (item, SECTION_HEADERS[last_type], None)
+        return ((last_type, transactions_header, last_account), entry)
+
+    @parsermethod
+    def iterChunks(self, file_handle, block_size=DEFAULT_BLOCK_SIZE):
+        """Yield the records of a file handle, reading it in blocks.
+
+        The chunks are the same that split_records would return for the
+        whole content of the file, but only one block and the last
+        incomplete record are kept in memory at any time.
+        """
+        return self.iterRecords(read_blocks(file_handle, block_size))
+
+    @parsermethod
+    def iterRecords(self, blocks):
+        """Yield the records of a text given as an iterable of blocks."""
+        empty = True
+        rest = ''
+        for block in blocks:
+            empty = False
+            (chunks, rest) = split_complete(rest + block)
+            for chunk in chunks:
+                yield chunk
+        if empty:
+            raise QifParserException('Data is empty')
+        yield rest
+
+    @parsermethod
+    def parseRecord(self, chunk, last_type, transactions_header):
+        """Parse a single record, without adding it to any container.
+
+        Returns the updated (last_type, transactions_header) state,
+        together with the parsed item.
+        """
+        first = chunk[:1]
+        if first == '!' or first.isspace():
+            # the first line may be a section header
+            (next_type, new_header) = self.parseTypeLines(chunk.splitlines())
+            if next_type:
+                last_type = next_type
+            if new_header:
+                transactions_header = new_header
 
         # if no header is found, we use the previous one
-        item = parsers[last_type](chunk)
+        builder = getattr(self, RECORD_BUILDERS[last_type])
+        return (last_type, transactions_header,
+                builder(TOKEN.findall(chunk)))
+
+    @parsermethod
+    def parseChunk(self, chunk, last_type, transactions_header, last_account):
+        (last_type, transactions_header, item) \
+            = self.parseRecord(chunk, last_type, transactions_header)
+        last_account = self.addRecord(item, last_type, transactions_header,
+                                      last_account)
+        return (last_type, transactions_header, last_account)
+
+    @parsermethod
+    def addRecord(self, item, last_type, transactions_header, last_account):
+        """Add a record returned by parseRecord to self.qif_obj.
+
+        Transactions go to last_account, if any; the account the next
+        transactions belong to is returned.
+        """
         if last_type == 'account':
-            cls_.qif_obj.add_account(item)
+            self.qif_obj.add_account(item)
             last_account = item
         elif last_type == 'memorized':
             last_account = None
-            cls_.qif_obj.add_transaction(item, header=transactions_header)
+            self.qif_obj.add_transaction(item, header=transactions_header)
         elif last_type == 'transaction' or last_type == 'investment':
-            if last_account:
+            if self.dedup is not None and self.isDuplicate(
+                    item, last_type, transactions_header, last_account):
+                pass
+            elif last_account:
                 last_account.add_transaction(item, header=transactions_header)
             else:
-                cls_.qif_obj.add_transaction(item, header=transactions_header)
+                self.qif_obj.add_transaction(item, header=transactions_header)
         elif last_type == 'category':
-            cls_.qif_obj.add_category(item)
+            self.qif_obj.add_category(item)
         elif last_type == 'class':
-            cls_.qif_obj.add_class(item)
+            self.qif_obj.add_class(item)
         elif last_type == 'tag':
-            cls_.qif_obj.add_tag(item)
-        return (last_type, transactions_header, last_account)
+            self.qif_obj.add_tag(item)
+        return last_account
+
+    @parsermethod
+    def isDuplicate(self, item, last_type, transactions_header,
+                    last_account):
+        """Tell whether a record is a transaction or an investment
+        self.dedup has already seen."""
+        if self.dedup is None or (last_type != 'transaction' and
+                                  last_type != 'investment'):
+            return False
+        return not self.dedup.keep(
+            item, last_account.name if last_account else None,
+            transactions_header)
+
+    @parsermethod
+    def tokenize(self, chunk):
+        """Split a record into (code, value) tokens.
 
-    @classmethod
-    def parseType(cls_, chunk):
-        lines = chunk.splitlines()
+        There is one token for each non-empty line: the code is the first
+        character of the line, and the value is the rest of it.
+        """
+        return TOKEN.findall(chunk)
+
+    @parsermethod
+    def parseType(self, chunk):
+        return self.parseTypeLines(chunk.splitlines())
 
+    @parsermethod
+    def parseTypeLines(self, lines):
         index = 0
         first_line = lines[index].strip()
+        if not first_line.startswith('!'):
+            return (None, None)
         while first_line == '!Clear:AutoSwitch' or \
               first_line == '!Option:AutoSwitch':
             index += 1
-            cls_.auto_switches += 1
+            self.auto_switches += 1
             first_line = lines[index].strip()
 
-        if first_line == '!Account':
-            return ('account', None)
-        elif first_line == TYPE_HEADER + 'Cat':
-            return ('category', None)
-        elif first_line in NON_INVST_ACCOUNT_TYPES:
-            return ('transaction', first_line)
-        elif first_line == TYPE_HEADER + 'Invst':
-            return ('investment', first_line)
-        elif first_line == TYPE_HEADER + 'Class':
-            return ('class', None)
-        elif first_line == TYPE_HEADER + 'Memorized':
-            return ('memorized', first_line)
+        if first_line in SECTION_TYPES:
+            next_type = SECTION_TYPES[first_line]
+            if next_type in TRANSACTION_TYPES:
+                return (next_type, first_line)
+            return (next_type, None)
         elif is_obfuscated_type_header(first_line):
             return ('transaction', TYPE_HEADER + DEFAULT_ACCOUNT_TYPE)
-        elif first_line == TYPE_HEADER + 'Tag':
-            return ('tag', None)
         elif first_line.startswith('!'):
             raise QifParserException('Section header not recognized: ' +
                                      first_line)
         else:
             return (None, None)
 
-    @classmethod
-    def parseClass(cls_, chunk):
+    @parsermethod
+    def parseClass(self, chunk):
+        return self.buildClass(self.tokenize(chunk))
+
+    @parsermethod
+    def buildClass(self, tokens):
         """
         """
-        curItem = Class()
-        lines = chunk.splitlines()
-        for line in lines:
-            if not len(line) or line[0] == '\n' or \
-                    line.startswith(TYPE_HEADER + 'Class'):
-                continue
-            elif line[0] == 'N':
-                curItem.name = line[1:]
-            elif line[0] == 'D':
-                curItem.description = line[1:]
+        curItem = Class._new()
+        for code, value in tokens:
+            attr = CLASS_FIELDS.get(code)
+            if attr is not None:
+                setattr(curItem, attr, value)
         return curItem
 
-    @classmethod
-    def parseTag(cls_, chunk):
+    @parsermethod
+    def parseTag(self, chunk):
+        return self.buildTag(self.tokenize(chunk))
+
+    @parsermethod
+    def buildTag(self, tokens):
         """
         """
-        curItem = Tag()
-        lines = chunk.splitlines()
-        for line in lines:
-            if not len(line) or line[0] == '\n' or \
-                    line.startswith(TYPE_HEADER + 'Tag'):
-                continue
-            elif line[0] == 'N':
-                curItem.name = line[1:]
-            elif line[0] == 'D':
-                curItem.description = line[1:]
+        curItem = Tag._new()
+        for code, value in tokens:
+            attr = TAG_FIELDS.get(code)
+            if attr is not None:
+                setattr(curItem, attr, value)
         return curItem
 
-    @classmethod
-    def parseCategory(cls_, chunk):
+    @parsermethod
+    def parseCategory(self, chunk):
+        return self.buildCategory(self.tokenize(chunk))
+
+    @parsermethod
+    def buildCategory(self, tokens):
         """
         """
-        curItem = Category()
-        lines = chunk.splitlines()
-        for line in lines:
-            if not len(line) or line[0] == '\n' or line.startswith(TYPE_HEADER):
-                continue
-            elif line[0] == 'E':
+        curItem = Category._new()
+        for code, value in tokens:
+            attr = CATEGORY_FIELDS.get(code)
+            if attr is not None:
+                setattr(curItem, attr, value)
+            elif code == 'E':
                 curItem.expense_category = True
-            elif line[0] == 'I':
+            elif code == 'I':
                 curItem.income_category = True
                 curItem.expense_category = False  # if ommitted is True
-            elif line[0] == 'T':
+            elif code == 'T':
                 curItem.tax_related = True
-            elif line[0] == 'D':
-                curItem.description = line[1:]
-            elif line[0] == 'B':
-                curItem.budget_amount = line[1:]
-            elif line[0] == 'R':
-                curItem.tax_schedule_info = line[1:]
-            elif line[0] == 'N':
-                curItem.name = line[1:]
         return curItem
 
-    @classmethod
-    def parseAccount(cls_, chunk):
+    @parsermethod
+    def parseAccount(self, chunk):
+        return self.buildAccount(self.tokenize(chunk))
+
+    @parsermethod
+    def buildAccount(self, tokens):
         """
         """
         curItem = Account()
-        curItem.is_auto_switch = (cls_.auto_switches == 1)
-        lines = chunk.splitlines()
-        for line in lines:
-            if not len(line) or line[0] == '\n' or line.startswith('!Account'):
-                continue
-            elif line[0] == 'N':
-                curItem.name = line[1:]
-            elif line[0] == 'D':
-                curItem.description = line[1:]
-            elif line[0] == 'T':
-                account_type = line[1:]
-                if is_obfuscated_account_type(account_type):
+        curItem.is_auto_switch = (self.auto_switches == 1)
+        for code, value in tokens:
+            attr = ACCOUNT_FIELDS.get(code)
+            if attr is not None:
+                setattr(curItem, attr, value)
+            elif code == 'T':
+                if is_obfuscated_account_type(value):
                     curItem.account_type = DEFAULT_ACCOUNT_TYPE
                 else:
-                    curItem.account_type = account_type
-            elif line[0] == 'L':
-                curItem.credit_limit = line[1:]
-            elif line[0] == '/':
-                curItem.balance_date = cls_.parseQifDateTime(line[1:])
-            elif line[0] == '$':
-                curItem.balance_amount = line[1:]
-            elif line == '!Clear:AutoSwitch' or line == '!Option:AutoSwitch':
+                    curItem.account_type = value
+            elif code == '/':
+                curItem.balance_date = self.parseQifDateTime(value)
+            elif code == '!' and (value.startswith('Account') or
+                                  value == 'Clear:AutoSwitch' or
+                                  value == 'Option:AutoSwitch'):
                 pass
             else:
-                print('Line of account not recognized: ' + line)
+                self.unknownLine('account', code + value)
         return curItem
 
-    @classmethod
-    def parseMemorizedTransaction(cls_, chunk):
+    @parsermethod
+    def parseMemorizedTransaction(self, chunk):
+        return self.buildMemorizedTransaction(self.tokenize(chunk))
+
+    @parsermethod
+    def buildMemorizedTransaction(self, tokens):
         """
         """
 
-        curItem = MemorizedTransaction()
-        if cls_.date_format:
-            curItem.date_format = cls_.date_format
-        lines = chunk.splitlines()
-        for line in lines:
-            if not len(line) or line[0] == '\n' or \
-                    line.startswith(TYPE_HEADER + 'Memorized'):
-                continue
-            elif line[0] == 'T':
-                curItem.amount = cls_.parseFloat(line[1:])
-            elif line[0] == 'U':
-                curItem.uamount = cls_.parseFloat(line[1:])
-            elif line[0] == 'C':
-                curItem.cleared = line[1:]
-            elif line[0] == 'P':
-                curItem.payee = line[1:]
-            elif line[0] == 'M':
-                curItem.memo = line[1:]
-            elif line[0] == 'K':
-                curItem.mtype = line[1:]
-            elif line[0] == 'A':
+        curItem = MemorizedTransaction._new()
+        if self.date_format:
+            curItem.date_format = self.date_format
+        parseAmount = self.parseAmount
+        for code, value in tokens:
+            attr = MEMORIZED_FIELDS.get(code)
+            if attr is not None:
+                setattr(curItem, attr, value)
+            elif code in AMOUNT_FIELDS:
+                attr = AMOUNT_FIELDS[code]
+                setattr(curItem, attr, parseAmount(value, attr))
+            elif code == 'A':
                 if not curItem.address:
                     curItem.address = []
-                curItem.address.append(line[1:])
-            elif line[0] == 'L':
-                cat = line[1:]
-                if cat.startswith('['):
-                    curItem.to_account = cat[1:-1]
+                curItem.address.append(value)
+            elif code == 'L':
+                if value.startswith('['):
+                    curItem.to_account = value[1:-1]
                 else:
-                    curItem.category = cat
-            elif line[0] == 'S':
-                curItem.splits.append(AmountSplit())
-                split = curItem.splits[-1]
-                cat = line[1:]
-                if cat.startswith('['):
-                    split.to_account = cat[1:-1]
+                    curItem.category = value
+            elif code == 'S':
+                split = AmountSplit._new()
+                curItem.splits.append(split)
+                if value.startswith('['):
+                    split.to_account = value[1:-1]
                 else:
-                    split.category = cat
-            elif line[0] == 'E':
-                split = curItem.splits[-1]
-                split.memo = line[1:-1]
-            elif line[0] == 'A':
+                    split.category = value
+            elif code == 'E':
                 split = curItem.splits[-1]
-                if not split.address:
-                    split.address = []
-                split.address.append(line[1:])
-            elif line[0] == '$':
-                amt = cls_.parseFloat(line[1:-1])
+                split.memo = value[:-1]
+            elif code == '$':
+                amt = parseAmount(value[:-1])
                 if amt:
                     if curItem.splits:
                         split = curItem.splits[-1]
                         split.amount = amt
                     else:
                         raise QifParserException('no split found')
+            elif code == '!' and value.startswith('Type:Memorized'):
+                continue
             else:
                 # don't recognize this line; ignore it
-                print ("Skipping unknown line of memorized transaction:\n" +
-                       str(line))
+                self.unknownLine('memorized', code + value)
         return curItem
 
-    @classmethod
-    def parseTransaction(cls_, chunk):
+    @parsermethod
+    def parseTransaction(self, chunk):
+        return self.buildTransaction(self.tokenize(chunk))
+
+    @parsermethod
+    def buildTransaction(self, tokens):
         """
         """
 
-        curItem = Transaction()
-        if cls_.date_format:
-            curItem.date_format = cls_.date_format
-        lines = chunk.splitlines()
-        for line in lines:
-            if not len(line) or line[0] == '\n' or line.startswith(TYPE_HEADER):
-                continue
-            elif line[0] == 'D':
-                curItem.date = cls_.parseQifDateTime(line[1:])
-            elif line[0] == 'N':
-                curItem.num = line[1:]
-            elif line[0] == 'T':
-                curItem.amount = cls_.parseFloat(line[1:])
-            elif line[0] == 'U':
-                curItem.uamount = cls_.parseFloat(line[1:])
-            elif line[0] == 'C':
-                curItem.cleared = line[1:]
-            elif line[0] == 'P':
-                curItem.payee = line[1:]
-            elif line[0] == 'M':
-                curItem.memo = line[1:]
-            elif line[0] == '1':
-                curItem.first_payment_date = line[1:]
-            elif line[0] == '2':
-                curItem.years_of_loan = line[1:]
-            elif line[0] == '3':
-                curItem.num_payments_done = line[1:]
-            elif line[0] == '4':
-                curItem.periods_per_year = line[1:]
-            elif line[0] == '5':
-                curItem.interests_rate = line[1:]
-            elif line[0] == '6':
-                curItem.current_loan_balance = line[1:]
-            elif line[0] == '7':
-                curItem.original_loan_amount = line[1:]
-            elif line[0] == 'A':
-                if not curItem.address:
-                    curItem.address = []
-                curItem.address.append(line[1:])
-            elif line[0] == 'L':
-                cat = line[1:]
-                if cat.startswith('['):
-                    curItem.to_account = cat[1:-1]
+        curItem = Transaction._new()
+        if self.date_format:
+            curItem.date_format = self.date_format
+        decimals = self.decimals
+        if self.plain_values:
+            # the values are converted as parseAmount and parseQifDateTime
+            # would, without the method calls
+            parseAmount = _parse_decimal
+            parseDate = self.date_parser.parse
+        else:
+            parseAmount = self.parseAmount
+            parseDate = self.parseQifDateTime
+        for code, value in tokens:
+            # the most frequent fields first
+            if code == 'D':
+                curItem.date = parseDate(value)
+            elif code == 'T':
+                curItem.amount = parseAmount(value, 'amount') \
+                    if decimals is None else decimals[value]
+            elif code == 'U':
+                curItem.uamount = parseAmount(value, 'uamount') \
+                    if decimals is None else decimals[value]
+            elif code in TRANSACTION_FIELDS:
+                setattr(curItem, TRANSACTION_FIELDS[code], value)
+            elif code == 'L':
+                if value.startswith('['):
+                    curItem.to_account = value[1:-1]
                 else:
-                    curItem.category = cat
-            elif line[0] == 'S':
-                curItem.splits.append(AmountSplit())
-                split = curItem.splits[-1]
-                cat = line[1:]
-                if cat.startswith('['):
-                    split.to_account = cat[1:-1]
+                    curItem.category = value
+            elif code == 'S':
+                split = AmountSplit._new()
+                curItem.splits.append(split)
+                if value.startswith('['):
+                    split.to_account = value[1:-1]
                 else:
-                    split.category = cat
-            elif line[0] == 'E':
-                split = curItem.splits[-1]
-                split.memo = line[1:-1]
-            elif line[0] == 'A':
+                    split.category = value
+            elif code == '$':
                 split = curItem.splits[-1]
-                if not split.address:
-                    split.address = []
-                split.address.append(line[1:])
-            elif line[0] == '$':
+                split.amount = parseAmount(value[:-1], 'amount')
+            elif code == 'A':
+                if not curItem.address:
+                    curItem.address = []
+                curItem.address.append(value)
+            elif code == 'E':
                 split = curItem.splits[-1]
-                split.amount = cls_.parseFloat(line[1:-1])
+                split.memo = value[:-1]
+            elif code == '!' and value.startswith('Type:'):
+                continue
             else:
                 # don't recognize this line; ignore it
-                print ("Skipping unknown line of transaction:\n" + str(line))
+                self.unknownLine('transaction', code + value)
         return curItem
 
-    @classmethod
-    def parseInvestment(cls_, chunk):
+    @parsermethod
+    def parseInvestment(self, chunk):
+        return self.buildInvestment(self.tokenize(chunk))
+
+    @parsermethod
+    def buildInvestment(self, tokens):
         """
         """
 
-        curItem = Investment()
-        if cls_.date_format:
-            curItem.date_format = cls_.date_format
-        lines = chunk.splitlines()
-        for line in lines:
-            if not len(line) or line[0] == '\n' or line.startswith(TYPE_HEADER):
-                continue
-            elif line[0] == 'D':
-                curItem.date = cls_.parseQifDateTime(line[1:])
-            elif line[0] == 'T':
-                curItem.amount = cls_.parseFloat(line[1:])
-            elif line[0] == 'N':
-                curItem.action = line[1:]
-            elif line[0] == 'Y':
-                curItem.security = line[1:]
-            elif line[0] == 'I':
-                curItem.price = cls_.parseFloat(line[1:])
-            elif line[0] == 'Q':
-                curItem.quantity = cls_.parseFloat(line[1:])
-            elif line[0] == 'C':
-                curItem.cleared = line[1:]
-            elif line[0] == 'M':
-                curItem.memo = line[1:]
-            elif line[0] == 'P':
-                curItem.first_line = line[1:]
-            elif line[0] == 'L':
-                curItem.to_account = line[2:-1]
-            elif line[0] == '$':
-                curItem.amount_transfer = cls_.parseFloat(line[1:])
-            elif line[0] == 'O':
-                curItem.commission = cls_.parseFloat(line[1:])
+        curItem = Investment._new()
+        if self.date_format:
+            curItem.date_format = self.date_format
+        parseAmount = self.parseAmount
+        for code, value in tokens:
+            attr = INVESTMENT_FIELDS.get(code)
+            if attr is not None:
+                setattr(curItem, attr, value)
+            elif code in INVESTMENT_AMOUNT_FIELDS:
+                attr = INVESTMENT_AMOUNT_FIELDS[code]
+                setattr(curItem, attr, parseAmount(value, attr))
+            elif code == 'D':
+                curItem.date = self.parseQifDateTime(value)
+            elif code == 'L':
+                curItem.to_account = value[1:-1]
         return curItem
 
-    @classmethod
-    def parseFloat(cls_, chunk):
+    @parsermethod
+    def parseAmount(self, chunk, name='amount'):
+        """convert the quantity held by the field called name
+
+        Quantities are Decimals, unless the parser is configured to use
+        fixed point integers, whose scale depends on the kind of the
+        field.
+        """
+        if self.amount_types is None:
+            return self.parseFloat(chunk)
+        kind = QUANTITY_KINDS.get(name, 'amount')
+        return self.amount_types[kind].parse(chunk)
+
+    @parsermethod
+    def parseFloat(self, chunk):
         """convert from QIF float format to a quantity
 
         To avoid rounding errors, use a Decimal class rather than float.
@@ -467,41 +1233,24 @@ class QifParser(object):
         """
         return Decimal(chunk.replace(',', ''))
 
-    @classmethod
-    def parseQifDateTime(cls_, qdate):
+    @parsermethod
+    def parseQifDateTime(self, qdate):
         """ convert from QIF time format to ISO date string
 
         QIF is like "7/ 9/98"  "9/ 7/99" or "10/10/99" or "10/10'01" for y2k
              or, it seems (citibankdownload 20002) like "01/22/2002"
              or, (Paypal 2011) like "3/2/2011".
         ISO is like   YYYY-MM-DD  I think @@check
-        """
 
-        if cls_.date_format:
-            if "'" in qdate:
-                # It's probably necessary that we'll need to modify the
-                # string in some cases, though this particular change is
-                # quick and dirty.  TODO: need to revisit.
-                nice_date = qdate.replace("' ", "/0")
-                nice_date = nice_date.replace("'", "/")
-            else:
-                nice_date = qdate
-            return datetime.strptime(nice_date, cls_.date_format)
-
-        # If date_format is not given explicitly, we will try to guess...
-        if qdate[1] == "/":
-            qdate = "0" + qdate   # Extend month to 2 digits
-        if qdate[4] == "/":
-            qdate = qdate[:3]+"0" + qdate[3:]  # Extend month to 2 digits
-        for i in range(len(qdate)):
-            if qdate[i] == " ":
-                qdate = qdate[:i] + "0" + qdate[i+1:]
-        if len(qdate) == 10:  # new form with YYYY date
-            iso_date = qdate[6:10] + "-" + qdate[3:5] + "-" + qdate[0:2]
-            return datetime.strptime(iso_date, '%Y-%m-%d')
-        if qdate[5] == "'":
-            C = "20"
-        else:
-            C = "19"
-        iso_date = C + qdate[6:8] + "-" + qdate[3:5] + "-" + qdate[0:2]
-        return datetime.strptime(iso_date, '%Y-%m-%d')
+        The conversion is done by self.date_parser, set by configure,
+        which remembers the dates it has already seen; see its
+        cache_info() to know how many of them were found in the cache.
+        """
+        date_parser = self.date_parser
+        stats = self.stats
+        if stats is None:
+            return date_parser.parse(qdate)
+        start = stats.timer()
+        value = date_parser.parse(qdate)
+        stats.add_time('dates', stats.timer() - start)
+        return value
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Parse QIF data pushed in pieces, as it arrives.
+
+A PushParser is given the bytes of a file in pieces of any size with feed,
+as they come from a socket or a queue, and returns the records completed
+by each piece as soon as it has them; close tells it the data is over.
+Only the last incomplete record is kept between two pieces, so memory use
+does not grow with the size of the data; without a date format, the
+records wait until the layout of their dates is detected (see PushParser).
+See qifparse.aio for the same thing over asyncio streams.
+"""
+import codecs
+import six
+from qifparse.dates import (
+    detect_date_format,
+    sample_dates,
+    DATE_SAMPLE_SIZE,
+    DEFAULT_SAMPLE_COUNT,
+)
+from qifparse.files import split_complete, split_records, DEFAULT_ENCODING
+from qifparse.parser import QifParser, QifParserException
+
+
+class PushParser(object):
+    """Parse the records of a QIF file fed to it piece by piece.
+
+    The records are returned as the (item, header, account) tuples that
+    QifParser.iterparse yields.  The pieces are bytes in encoding, or text.
+    parser is the QifParser, or subclass, instance parsing the records;
+    one is made from date_format and fixed_point if not given.  The
+    transactions the Deduplicator of parser has already seen, if it has
+    one, are left out.
+
+    Without a date format, the complete records are held until the layout
+    of their dates is detected, as QifParser.detectDateFormat does for a
+    file: as soon as a date tells it for sure (one whose day is above 12,
+    or whose year comes first), else once hold_dates dates or hold_size
+    characters were held, or on close.  A lower hold_dates gives the
+    records sooner, but the layout of ambiguous dates from fewer samples.
+    """
+
+    def __init__(self, date_format=None, fixed_point=None,
+                 encoding=DEFAULT_ENCODING, parser=None,
+                 hold_dates=DEFAULT_SAMPLE_COUNT, hold_size=DATE_SAMPLE_SIZE):
+        if parser is None:
+            parser = QifParser(date_format, fixed_point)
+        parser.configure(date_format, fixed_point)
+        self.parser = parser
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.rest = ''
+        # (last_type, transactions_header, last_account), see
+        # QifParser.parseEntry
+        self.state = (None, None, None)
+        self.empty = True
+        self.closed = False
+        # the records held until the layout of the dates is detected, or
+        # None, and the dates they have
+        self.held = None if parser.date_format is not None else []
+        self.held_size = 0
+        self.samples = []
+        self.hold_dates = hold_dates
+        self.hold_size = hold_size
+
+    def feed(self, data):
+        """Add a piece of data; return the records it completes."""
+        if self.closed:
+            raise RuntimeError(six.u('feed() called after close()'))
+        if not isinstance(data, six.text_type):
+            data = self.decoder.decode(data)
+        if not data:
+            return []
+        self.empty = False
+        (chunks, self.rest) = split_complete(self.rest + data)
+        if self.held is not None:
+            chunks = self.hold(chunks, False)
+        return self.parse(chunks)
+
+    def hold(self, chunks, last):
+        # return the records held once the layout of their dates is
+        # detected, or none
+        self.held.extend(chunks)
+        self.held_size += sum(len(chunk) for chunk in chunks)
+        if len(self.samples) < self.hold_dates:
+            self.samples.extend(sample_dates(
+                '\n'.join(chunks), self.hold_dates - len(self.samples)))
+        detection = detect_date_format(self.samples)
+        if not last and len(self.samples) < self.hold_dates and \
+                self.held_size < self.hold_size and \
+                (detection is None or detection.confidence < 1):
+            return []
+        if detection is not None:
+            self.parser.useDateDetection(detection)
+        chunks = self.held
+        self.held = None
+        return chunks
+
+    def close(self):
+        """Tell that the data is over; return the records left."""
+        if self.closed:
+            return []
+        self.closed = True
+        text = self.rest + self.decoder.decode(b'', True)
+        self.rest = ''
+        if self.empty and not text:
+            raise QifParserException('Data is empty')
+        chunks = split_records(text)
+        if self.held is not None:
+            chunks = self.hold(chunks, True)
+        return self.parse(chunks)
+
+    def parse(self, chunks):
+        entries = []
+        state = self.state
+        parse_entry = self.parser.parseEntry
+        for chunk in chunks:
+            if chunk:
+                (state, entry) = parse_entry(chunk, state)
+                (item, header, account) = entry
+                if not self.parser.isDuplicate(item, state[0], header,
+                                               account):
+                    entries.append(entry)
+        self.state = state
+        return entries
@@ -1,7 +1,17 @@
 # -*- coding: utf-8 -*-
+import re
 import six
+from collections import OrderedDict
 from datetime import datetime
+from decimal import Decimal
 from qifparse import DEFAULT_DATETIME_FORMAT
+from qifparse.amounts import FixedPoint
+from qifparse.balances import BalanceIndex, statement_amount
+from qifparse.categories import CategoryTree
+from qifparse.columns import to_columns
+from qifparse.dedup import Deduplicator
+from qifparse.query import TransactionIndex
+from qifparse.rollups import rollup, GROUP_KEYS
 
 DEFAULT_ACCOUNT_TYPE = 'Cash';
 
@@ -21,6 +31,9 @@ ACCOUNT_SUBTYPES = {
     '401(k)/403(b)': 'Invst',
 }
 
+# Number of lines gathered by Qif.write before writing them
+DEFAULT_WRITE_BATCH_SIZE = 4096
+
 MEMORIZED_TRANSACTION_TYPES = [
     'C',  # Check
     'D',  # Deposit
@@ -31,54 +44,131 @@ MEMORIZED_TRANSACTION_TYPES = [
 
 
 class Qif(object):
+    # Number of the changes of the names and account types of the entries
+    # added to Qif objects; see _check_indexes
+    _index_changes = 0
+
     def __init__(self):
-        self._accounts = []
+        # accounts are keyed by id, so that an auto-switch account can be
+        # replaced without scanning the list
+        self._accounts = OrderedDict()
         self._categories = []
         self._classes = []
         self._tags = []
         self._transactions = {}
         self._last_header = None
+        # indexes by name (and by type, for accounts), kept in sync by the
+        # add_* methods, and built again after an entry added is renamed
+        self._accounts_by_name = {}
+        self._accounts_by_type = {}
+        self._categories_by_name = {}
+        self._classes_by_name = {}
+        self._tags_by_name = {}
+        self._index_version = Qif._index_changes
+        # built by the first query, see qifparse.query
+        self._query_index = None
+        # the lists of transactions rollups were computed from, their
+        # lengths, and the rollups and tables computed; see Qif.rollup
+        self._rollups = None
+        # built when first asked for, see Qif.category_tree
+        self._category_tree = None
 
     def add_account(self, item):
+        orig = self._check_account(item)
+        if orig is not None:
+            # Remove orig from the accounts list; it will be "replaced" by
+            # the new item
+            self._remove_account(orig)
+            # Merge the original item into the new item
+            item.merge(orig)
+        self._accounts[id(item)] = item
+        self._index_account(item)
+
+    def _index_account(self, item):
+        item._indexed = True
+        self._accounts_by_name.setdefault(item.name, []).append(item)
+        self._accounts_by_type.setdefault(
+            item.account_type, OrderedDict())[id(item)] = item
+
+    def _check_account(self, item):
+        """Raise the error add_account would raise for item, if any.
+
+        Returns the auto-switch account item would be merged with, or
+        None.
+        """
         if not isinstance(item, Account):
             raise RuntimeError(six.u("item not recognized"))
         existing = self.get_accounts(item.name)
-        if existing:
-            if len(existing) > 1:
-                raise RuntimeError(
-                    six.u("found two accounts with same name: %s" % item.name))
-            orig = existing[0]
-            if orig.is_auto_switch:
-                if item.is_auto_switch:
-                    raise RuntimeError(
-                        six.u("can't merge two auto-switch accounts: %s"
-                              % item.name))
-                else:
-                    # Remove orig from the accounts list; it will be
-                    # "replaced" by the new item
-                    self._accounts = [x for x in self._accounts if x != orig]
-                    # Merge the original item into the new item
-                    item.merge(orig)
-            else:
-                raise RuntimeError(
-                    six.u("can't merge non-auto-switch accounts: %s"
-                          % item.name))
-        self._accounts.append(item)
+        if not existing:
+            return None
+        if len(existing) > 1:
+            raise RuntimeError(
+                six.u("found two accounts with same name: %s" % item.name))
+        orig = existing[0]
+        if not orig.is_auto_switch:
+            raise RuntimeError(
+                six.u("can't merge non-auto-switch accounts: %s"
+                      % item.name))
+        if item.is_auto_switch:
+            raise RuntimeError(
+                six.u("can't merge two auto-switch accounts: %s"
+                      % item.name))
+        item._check_merge(orig)
+        return orig
+
+    def _remove_account(self, item):
+        # the indexes were checked by _check_account
+        del self._accounts[id(item)]
+        self._accounts_by_name[item.name].remove(item)
+        del self._accounts_by_type[item.account_type][id(item)]
+
+    def _check_indexes(self):
+        """Build the indexes again if an entry added to a Qif object was
+        renamed, or an account changed type, since they were built."""
+        if self._index_version != Qif._index_changes:
+            self._build_indexes()
+
+    def _build_indexes(self):
+        self._index_version = Qif._index_changes
+        self._accounts_by_name = {}
+        self._accounts_by_type = {}
+        for acc in self._accounts.values():
+            self._index_account(acc)
+        for name in ('categories', 'classes', 'tags'):
+            index = {}
+            for entry in getattr(self, '_' + name):
+                entry._indexed = True
+                index.setdefault(entry.name, []).append(entry)
+            setattr(self, '_%s_by_name' % name, index)
+
+    def _mark_indexed(self):
+        # the entries of indexes restored from a snapshot
+        for entries in (self._accounts.values(), self._categories,
+                        self._classes, self._tags):
+            for entry in entries:
+                entry._indexed = True
+        self._index_version = Qif._index_changes
 
     def add_category(self, item):
         if not isinstance(item, Category):
             raise RuntimeError(six.u("item not recognized"))
         self._categories.append(item)
+        item._indexed = True
+        self._categories_by_name.setdefault(item.name, []).append(item)
 
     def add_class(self, item):
         if not isinstance(item, Class):
             raise RuntimeError(six.u("item not recognized"))
         self._classes.append(item)
+        item._indexed = True
+        self._classes_by_name.setdefault(item.name, []).append(item)
 
     def add_tag(self, item):
         if not isinstance(item, Tag):
             raise RuntimeError(six.u("item not recognized"))
         self._tags.append(item)
+        item._indexed = True
+        self._tags_by_name.setdefault(item.name, []).append(item)
 
     def add_transaction(self, item, header=None):
         if not isinstance(item, Transaction)\
@@ -94,16 +184,91 @@ class Qif(object):
             raise RuntimeError(six.u("no header provided yet"))
         self._transactions[header].append(item)
 
+    def merge(self, other, dedup=None):
+        """Add all the entries of another Qif object to this one.
+
+        The accounts go through add_account, so an auto-switch account is
+        merged with the later definition of the same account, as it would
+        be in a single file.  If one of the accounts can't be added, a
+        RuntimeError is raised before anything is changed.  The entries are
+        not copied: other should not be used any more.
+
+        With dedup, a qifparse.dedup.Deduplicator, the transactions and
+        investments of other it has already seen are left out; it should
+        have seen the ones of this object (see deduplicate).  An account of
+        other which could not be added, having the name of an account of
+        this object, is then combined with it instead: its transactions are
+        added to the ones of that account, which keeps its properties.
+        """
+        accounts = other.get_accounts()
+        combined = {}
+        for acc in accounts:
+            try:
+                self._check_account(acc)
+            except RuntimeError:
+                existing = self.get_accounts(acc.name)
+                if dedup is None or len(existing) != 1:
+                    raise
+                combined[id(acc)] = existing[0]
+        if dedup is not None:
+            dedup.filter(other)
+        for acc in accounts:
+            orig = combined.get(id(acc))
+            if orig is None:
+                self.add_account(acc)
+                continue
+            for header, transactions in acc._transactions.items():
+                for tr in transactions:
+                    orig.add_transaction(tr, header)
+        for cat in other._categories:
+            self.add_category(cat)
+        for cls in other._classes:
+            self.add_class(cls)
+        for tag in other._tags:
+            self.add_tag(tag)
+        for header, transactions in other._transactions.items():
+            self._transactions.setdefault(header, []).extend(transactions)
+        if other._last_header:
+            self._last_header = other._last_header
+        return self
+
+    def deduplicate(self, dedup=None):
+        """Remove the transactions and investments seen before, in this
+        object or by dedup, a qifparse.dedup.Deduplicator (a new one by
+        default), which is returned.
+
+        The Deduplicator can then be given to merge, or to the QifParser
+        of the next files.
+        """
+        if dedup is None:
+            dedup = Deduplicator()
+        dedup.filter(self)
+        return dedup
+
+    def __getstate__(self):
+        # the query index is built again when needed
+        state = self.__dict__.copy()
+        state['_query_index'] = None
+        state['_rollups'] = None
+        state['_category_tree'] = None
+        return state
+
+    def __setstate__(self, state):
+        # the accounts are keyed by id, which is not kept by pickle
+        self.__dict__.update(state)
+        self._accounts = OrderedDict(
+            (id(acc), acc) for acc in self._accounts.values())
+        self._build_indexes()
+
     def get_accounts(self, name=None, atype=None):
         if not name and not atype:
-            return tuple(self._accounts)
-        res = []
-        for acc in self._accounts:
-            valid_name = (not name or acc.name == name) and True or False
-            valid_type = (not atype or acc.account_type == atype) \
-                and True or False
-            if valid_name and valid_type:
-                res.append(acc)
+            return tuple(self._accounts.values())
+        self._check_indexes()
+        if not name:
+            return tuple(self._accounts_by_type.get(atype, {}).values())
+        res = self._accounts_by_name.get(name, ())
+        if atype:
+            res = [acc for acc in res if acc.account_type == atype]
         return tuple(res)
 
     def get_categories(self, name=None, income=None, expense=None):
@@ -112,28 +277,32 @@ class Qif(object):
                 six.u("item can be either income or expense, not both"))
         if not name and not income and not expense:
             return tuple(self._categories)
+        if name:
+            self._check_indexes()
+            candidates = self._categories_by_name.get(name, ())
+        else:
+            candidates = self._categories
         res = []
-        for cat in self._categories:
-            valid_name = (not name or cat.name == name) and True or False
+        for cat in candidates:
             valid_income = (not income or
                             cat.income == income) and True or False
             valid_expense = (not expense or
                              cat.expense == expense) and True or False
-            if valid_name and valid_income and valid_expense:
+            if valid_income and valid_expense:
                 res.append(cat)
         return tuple(res)
 
     def get_classes(self, name=None):
         if not name:
             return tuple(self._classes)
-        res = [klass for klass in self._classes if klass.name == name]
-        return tuple(res)
+        self._check_indexes()
+        return tuple(self._classes_by_name.get(name, ()))
 
     def get_tags(self, name=None):
         if not name:
             return tuple(self._tags)
-        res = [tag for tag in self._tags if tag.name == name]
-        return tuple(res)
+        self._check_indexes()
+        return tuple(self._tags_by_name.get(name, ()))
 
     def get_transactions(self, recursive=False):
         if not recursive:
@@ -141,33 +310,173 @@ class Qif(object):
         else:
             tr = []
             tr.extend(self._transactions.values())
-            for acc in self._accounts:
-                tr.extend(acc.transactions)
+            for acc in self._accounts.values():
+                tr.extend(acc._transactions.values())
+            return tuple(tr)
 
-    def __str__(self):
-        res = []
+    def query(self, start=None, end=None, account=None, category=None,
+              payee=None, cleared=None, min_amount=None, max_amount=None):
+        """Return the transactions matching all the conditions given.
+
+        The result is a list of (account, header, transaction) tuples,
+        account being the name of the account of the transaction, or None
+        for the transactions outside any account.  They are found between
+        the start and end dates, both included (a date as end stands for
+        its whole day), in the account of that name, in category or one of
+        its subcategories (looking at the splits too), with that payee or
+        cleared status, and with an amount from min_amount to max_amount.
+        The transactions are sorted by date, the undated ones last.
+        Memorized transactions, which are only templates, are left out.
+
+        The transactions are indexed by the first query, and the ones
+        added since by the next queries; see qifparse.query.
+        """
+        return self._get_query_index().query(
+            start, end, account, category, payee, cleared, min_amount,
+            max_amount)
+
+    def explain(self, start=None, end=None, account=None, category=None,
+                payee=None, cleared=None, min_amount=None, max_amount=None):
+        """Return the qifparse.query.QueryPlan of a query, whose str tells
+        which index it starts from."""
+        return self._get_query_index().plan(
+            start, end, account, category, payee, cleared, min_amount,
+            max_amount)
+
+    def rollup(self, period='month', keys=GROUP_KEYS, subcategories=True,
+               cents=None):
+        """Return the totals of the transactions, grouped by keys.
+
+        The result is a qifparse.rollups.Rollup, whose groups are made of
+        any of the account, the category and the period of the amounts,
+        period being 'day', 'week', 'month' or 'year'.  With
+        subcategories, the amounts of a subcategory count for its parents
+        too.  cents is the one of to_columns.  Memorized transactions,
+        which are only templates, are left out.
+
+        Results are kept until transactions are added, or their lists
+        replaced; changes made to the transactions themselves are not
+        noticed.
+        """
+        lists = [transactions for (_, _, transactions)
+                 in self._transaction_lists()]
+        sizes = [len(transactions) for transactions in lists]
+        cache = getattr(self, '_rollups', None)
+        if cache is None or cache[1] != sizes or \
+                any(old is not new for (old, new) in zip(cache[0], lists)):
+            # transactions were added since
+            cache = self._rollups = (lists, sizes, {})
+        results = cache[2]
+        table = results.get(cents)
+        if table is None:
+            table = results[cents] = to_columns(
+                [row for row in self._rows() if row[2]._dated], cents)
+        key = (period, tuple(keys), bool(subcategories), cents)
+        result = results.get(key)
+        if result is None:
+            result = results[key] = rollup(table, period, keys,
+                                           subcategories)
+        return result
+
+    def category_tree(self):
+        """Return the qifparse.categories.CategoryTree of the categories
+        and of the amounts of the transactions.
+
+        The tree is built by the first call, and the categories and
+        transactions added since by the next ones; changes made to the
+        transactions themselves are not noticed.
+        """
+        if getattr(self, '_category_tree', None) is None:
+            self._category_tree = CategoryTree(self)
+        self._category_tree.refresh()
+        return self._category_tree
+
+    def _transaction_lists(self):
+        """Yield the (account, header, transactions) tuples of the lists of
+        transactions of the accounts, then of this object; account is the
+        name of the account, or None."""
+        for acc in self._accounts.values():
+            for header, transactions in acc._transactions.items():
+                yield (acc.name, header, transactions)
+        for header, transactions in self._transactions.items():
+            yield (None, header, transactions)
+
+    def _get_query_index(self):
+        if getattr(self, '_query_index', None) is None:
+            self._query_index = TransactionIndex(self)
+        return self._query_index
+
+    def to_columns(self, cents=None):
+        """Return the transactions as a qifparse.columns.TransactionTable.
+
+        The transactions of the accounts come first, followed by the ones
+        outside any account; see qifparse.columns.to_columns.
+        """
+        return to_columns(self._rows(), cents)
+
+    def _rows(self):
+        rows = []
+        for acc in self._accounts.values():
+            rows.extend(acc._rows())
+        for header, transactions in self._transactions.items():
+            rows.extend((None, header, tr) for tr in transactions)
+        return rows
+
+    def iter_lines(self):
+        """Yield the QIF text of this object line by line.
+
+        Each line ends with a newline; joined together, they give
+        str(self).  Only one record at a time is turned into text.
+        """
         if self._tags:
-            res.append('!Type:Tag')
+            yield '!Type:Tag\n'
             for tag in self._tags:
-                res.append(str(tag))
+                for line in _record_lines(tag):
+                    yield line
         if self._categories:
-            res.append('!Type:Cat')
+            yield '!Type:Cat\n'
             for cat in self._categories:
-                res.append(str(cat))
-        for acc in self._accounts:
-            res.append(str(acc))
+                for line in _record_lines(cat):
+                    yield line
+        for acc in self._accounts.values():
+            for line in acc.iter_lines():
+                yield line
         if self._transactions:
             for header in self._transactions.keys():
                 transactions = self._transactions[header]
-                res.append(header)
+                yield header + '\n'
                 for tr in transactions:
-                    res.append(str(tr))
+                    for line in _record_lines(tr):
+                        yield line
         if self._classes:
-            res.append('!Type:Class')
+            yield '!Type:Class\n'
             for cat in self._classes:
-                res.append(str(cat))
-        res.append('')
-        return '\n'.join(res)
+                for line in _record_lines(cat):
+                    yield line
+
+    def write(self, file_handle, batch_size=DEFAULT_WRITE_BATCH_SIZE):
+        """Write the QIF text to file_handle, as str(self) would give it.
+
+        Lines are written in batches of batch_size, so the whole text is
+        never held in memory.
+        """
+        batch = []
+        for line in self.iter_lines():
+            batch.append(line)
+            if len(batch) >= batch_size:
+                file_handle.write(''.join(batch))
+                batch = []
+        if batch:
+            file_handle.write(''.join(batch))
+
+    def __str__(self):
+        return ''.join(self.iter_lines())
+
+
+def _record_lines(entry):
+    # a record without any line still gives an empty line, as in str()
+    for line in entry._lines() or ['']:
+        yield line + '\n'
 
 
 class Field(object):
@@ -179,11 +488,229 @@ class Field(object):
         self.required = required
         self.default = default
         self.custom_print_format = custom_print_format
+        # number of decimals written for quantities
+        self.places = 2
+        if custom_print_format:
+            match = re.search(r'%\.(\d+)f', custom_print_format)
+            if match:
+                self.places = int(match.group(1))
+
+
+def _compile_constructor(cls):
+    """Generate the _new classmethod of an entry class.
+
+    It builds an instance with every field set to its default, like
+    calling the class without arguments, but without going through the
+    kwargs.get/setattr loop of BaseEntry.__init__.
+    """
+    names = ['date_format'] + [field.name for field in cls._fields]
+    defaults = [DEFAULT_DATETIME_FORMAT] + \
+        [field.default for field in cls._fields]
+    source = ['def _new(cls):', '    self = new(cls)']
+    for index, name in enumerate(names):
+        source.append('    self.%s = defaults[%d]' % (name, index))
+    source.append('    return self')
+    namespace = {'new': object.__new__, 'defaults': tuple(defaults)}
+    exec('\n'.join(source), namespace)
+    return classmethod(namespace['_new'])
+
+
+# Dates formatted by the serializers, keyed by (date, format)
+_date_strings = {}
+DATE_STRINGS_CACHE_SIZE = 4096
+
+
+def _format_date(date, date_format):
+    if len(_date_strings) >= DATE_STRINGS_CACHE_SIZE:
+        _date_strings.clear()
+    sdate = _date_strings[(date, date_format)] = date.strftime(date_format)
+    return sdate
 
 
+def _compile_serializer(cls):
+    """Generate the _field_lines method of an entry class.
+
+    It returns the lines of the fields which are set, in the order of
+    _fields.  The choice of the format of each field is made once, here,
+    rather than for every record written.  Decimals are formatted
+    exactly, instead of going through float as '%.2f' % value does, and
+    dates are formatted once for all the records sharing them.
+    """
+    source = ['def _field_lines(self):', '    res = []',
+              '    append = res.append']
+    namespace = {
+        'date_strings': _date_strings,
+        'format_date': _format_date,
+        'Decimal': Decimal,
+        'FixedPoint': FixedPoint,
+        'RuntimeError': RuntimeError,
+        'six': six,
+    }
+    for index, field in enumerate(cls._fields):
+        # the first letter goes in format strings
+        letter = field.first_letter.replace('%', '%%')
+        source.append('    val = self.%s' % field.name)
+        if field.required:
+            message = "required field '%s' not yet set" % field.name
+            source.append('    if not val:')
+            source.append('        raise RuntimeError(six.u(%r))' % message)
+            indent = '    '
+        else:
+            source.append('    if val:')
+            indent = '        '
+        quantity = field.ftype == 'float' or field.custom_print_format
+        if quantity:
+            source.append(indent + 'if isinstance(val, FixedPoint):')
+            source.append(indent + '    append(%r + val.format(%d))'
+                          % (field.first_letter, field.places))
+        if field.custom_print_format:
+            if re.search(r'%\.(\d+)f', field.custom_print_format):
+                source.append(indent + 'elif isinstance(val, Decimal):')
+                source.append(indent + '    append(%r + format(val, %r))'
+                              % (field.first_letter, '.%df' % field.places))
+            namespace['format%d' % index] = field.custom_print_format
+            source.append(indent + 'else:')
+            source.append(indent + '    append(format%d %% (%r, val))'
+                          % (index, field.first_letter))
+        elif field.ftype == 'string':
+            source.append(indent + 'append(%r %% (val,))' % (letter + '%s'))
+        elif field.ftype == 'multilinestring':
+            source.append(indent + 'for line in val:')
+            source.append(indent + '    append(%r %% (line,))'
+                          % (letter + '%s'))
+        elif field.ftype == 'float':
+            source.append(indent + 'elif isinstance(val, Decimal):')
+            source.append(indent + '    append(%r + format(val, %r))'
+                          % (field.first_letter, '.%df' % field.places))
+            source.append(indent + 'else:')
+            source.append(indent + '    append(%r %% (val,))'
+                          % (letter + '%.2f'))
+        elif field.ftype == 'integer':
+            source.append(indent + 'append(%r %% (val,))' % (letter + '%d'))
+        elif field.ftype == 'datetime':
+            source.append(indent + 'sdate = date_strings.get((val, '
+                          'self.date_format))')
+            source.append(indent + 'if sdate is None:')
+            source.append(indent + '    sdate = format_date(val, '
+                          'self.date_format)')
+            source.append(indent + 'append(%r + sdate)' % field.first_letter)
+        elif field.ftype == 'reference':
+            source.append(indent + 'append(%r %% (val,))' % (letter + '[%s]'))
+        elif field.ftype == 'boolean':
+            source.append(indent + 'append(%r)' % field.first_letter)
+        else:
+            # unknown types are not written
+            source.append(indent + 'pass')
+    source.append('    return res')
+    exec('\n'.join(source), namespace)
+    return namespace['_field_lines']
+
+
+class _Unset(object):
+    """Marks the slots which are not set, in pickled entries."""
+
+    def __reduce__(self):
+        return '_UNSET'
+
+
+_UNSET = _Unset()
+
+
+def _restore_entry(cls, values, decimals=()):
+    return cls._from_values(values, decimals)
+
+
+def _compile_pickling(cls):
+    """Generate the __reduce__ method of an entry class, with the
+    _from_values classmethod which undoes it.
+
+    An entry is pickled as a tuple of the values of its slots, which is
+    faster and smaller than the default state, a dictionary keyed by slot
+    name; this matters when parsed entries are sent between processes.
+    Decimal quantities are pickled as strings, together with their
+    positions in the tuple, as pickling them one by one is slow.
+    """
+    names = cls._slot_names
+    quantities = set(field.name for field in cls._fields
+                     if field.ftype == 'float' or field.custom_print_format)
+    source = ['def __reduce__(self):', '    decimals = ()']
+    for index, name in enumerate(names):
+        source.append('    v%d = getattr(self, %r, unset)' % (index, name))
+        if name in quantities:
+            source.append('    if v%d.__class__ is Decimal:' % index)
+            source.append('        v%d = str(v%d)' % (index, index))
+            source.append('        decimals += (%d,)' % index)
+    values = ''.join('v%d, ' % index for index in range(len(names)))
+    source.append('    if decimals:')
+    source.append('        return (restore, (cls, (%s), decimals))' % values)
+    source.append('    return (restore, (cls, (%s)))' % values)
+    source.extend([
+        'def _from_values(cls, values, decimals=()):',
+        '    if decimals:',
+        '        values = list(values)',
+        '        for index in decimals:',
+        '            values[index] = Decimal(values[index])',
+        '    self = new(cls)',
+        '    (%s) = values' % ''.join('self.%s, ' % name for name in names),
+    ])
+    for name in names:
+        source.append('    if self.%s is unset:' % name)
+        source.append('        del self.%s' % name)
+    source.append('    return self')
+    namespace = {'new': object.__new__, 'restore': _restore_entry,
+                 'unset': _UNSET, 'cls': cls, 'Decimal': Decimal}
+    exec('\n'.join(source), namespace)
+    return (namespace['__reduce__'], classmethod(namespace['_from_values']))
+
+
+class EntryMeta(type):
+    """Metaclass giving entry classes __slots__ built from their _fields.
+
+    Each class gets a slot for every field it declares (unless the name
+    is a property of the class) and for every name in _extra_slots, so
+    that entries carry no __dict__.  _slot_names lists all the slots of
+    the class, inherited ones included, but the ones of _cache_slots:
+    those hold what is computed from the entry, and are neither pickled,
+    merged nor copied.  _dated tells whether the class has a date field
+    (memorized transactions have none).  The metaclass also generates
+    the _new constructor, the _field_lines serializer and the pickling
+    methods of the class.
+    """
+
+    def __new__(meta, name, bases, namespace):
+        inherited = set()
+        cached = set()
+        for base in bases:
+            inherited.update(getattr(base, '_slot_names', ()))
+            cached.update(getattr(base, '_cache_slots', ()))
+        declared = [field.name for field in namespace.get('_fields', ())]
+        declared.extend(namespace.get('_extra_slots', ()))
+        slots = []
+        properties = set(slot for slot in declared for base in bases
+                         if isinstance(getattr(base, slot, None), property))
+        for slot in declared:
+            if slot not in inherited and slot not in namespace and \
+                    slot not in slots and slot not in properties:
+                slots.append(slot)
+        cache_slots = [slot for slot in namespace.get('_cache_slots', ())
+                       if slot not in cached]
+        namespace['__slots__'] = tuple(slots) + tuple(cache_slots)
+        cls = super(EntryMeta, meta).__new__(meta, name, bases, namespace)
+        cls._slot_names = tuple(sorted(inherited)) + tuple(slots)
+        cls._dated = any(field.name == 'date' for field in cls._fields)
+        if '_new' not in namespace:
+            cls._new = _compile_constructor(cls)
+        if '_field_lines' not in namespace:
+            cls._field_lines = _compile_serializer(cls)
+        (cls.__reduce__, cls._from_values) = _compile_pickling(cls)
+        return cls
+
+
+@six.add_metaclass(EntryMeta)
 class BaseEntry(object):
 
     _fields = []
+    _extra_slots = ('date_format',)
     _sub_entry = False
 
     def __init__(self, **kwargs):
@@ -193,36 +720,41 @@ class BaseEntry(object):
             setattr(self, field.name, val)
 
     def __str__(self):
-        res = []
-        for field in self._fields:
-            val = getattr(self, field.name)
-            if not field.required and not val:
-                continue
-            elif field.required and not val:
-                raise RuntimeError(
-                    six.u("required field '%s' not yet set" % field.name))
-            if field.custom_print_format:
-                cformat = field.custom_print_format
-                res.append(cformat % (field.first_letter, val))
-            elif field.ftype == 'string':
-                res.append('%s%s' % (field.first_letter, val))
-            elif field.ftype == 'multilinestring':
-                for line in val:
-                    res.append('%s%s' % (field.first_letter, line))
-            elif field.ftype == 'float':
-                res.append('%s%.2f' % (field.first_letter, val))
-            elif field.ftype == 'integer':
-                res.append('%s%d' % (field.first_letter, val))
-            elif field.ftype == 'datetime':
-                sdate = val.strftime(self.date_format)
-                res.append('%s%s' % (field.first_letter, sdate))
-            elif field.ftype == 'reference':
-                res.append('%s[%s]' % (field.first_letter, val))
-            elif field.ftype == 'boolean':
-                res.append('%s' % field.first_letter)
+        return '\n'.join(self._lines())
+
+    def _lines(self):
+        """Return the lines of the record, without newlines."""
+        res = self._field_lines()
         if not self._sub_entry:
             res.append('^')
-        return '\n'.join(res)
+        return res
+
+
+def _index_changed(entry):
+    # an entry added to a Qif object is renamed, or changes type
+    if getattr(entry, '_indexed', False):
+        Qif._index_changes += 1
+
+
+class NamedEntry(BaseEntry):
+    """An entry which Qif objects index by name: accounts, categories,
+    classes and tags.
+
+    _indexed tells whether the entry was added to a Qif object, whose
+    indexes are then built again if it is renamed.
+    """
+
+    _extra_slots = ('_name',)
+    _cache_slots = ('_indexed',)
+
+    def get_name(self):
+        return self._name
+
+    def set_name(self, name):
+        _index_changed(self)
+        self._name = name
+
+    name = property(get_name, set_name)
 
 
 class Transaction(BaseEntry):
@@ -241,19 +773,30 @@ class Transaction(BaseEntry):
         Field('small_business_expense', 'boolean', 'X'),
         Field('to_account', 'reference', 'L'),
     ]
+    _extra_slots = ('_splits',)
 
-    def __init__(self, **kwargs):
-        super(Transaction, self).__init__(**kwargs)
-        self.splits = []
+    def get_splits(self):
+        # the list is only allocated when the splits are looked at, as
+        # most transactions have none
+        try:
+            splits = self._splits
+        except AttributeError:
+            splits = None
+        if splits is None:
+            splits = self._splits = []
+        return splits
 
-    def __str__(self):
-        res = []
-        fields = super(Transaction, self).__str__()
-        res.append(fields)
-        for split in self.splits:
-            res.append(str(split))
+    def set_splits(self, splits):
+        self._splits = splits
+
+    splits = property(get_splits, set_splits)
+
+    def _lines(self):
+        res = super(Transaction, self)._lines() or ['']
+        for split in getattr(self, '_splits', None) or ():
+            res.extend(split._lines() or [''])
         res.append('^')
-        return '\n'.join(res)
+        return res
 
 
 class MemorizedTransaction(Transaction):
@@ -269,6 +812,7 @@ class MemorizedTransaction(Transaction):
         Field('current_loan_balance', 'string', '6'),
         Field('original_loan_amount', 'string', '7'),
     ])
+    _extra_slots = ('_mtype',)
 
     def set_mtype(self, type):
         if type and type not in MEMORIZED_TRANSACTION_TYPES:
@@ -311,7 +855,7 @@ class Investment(BaseEntry):
     ]
 
 
-class Account(BaseEntry):
+class Account(NamedEntry):
     _fields = [
         Field('name', 'string', 'N', required=True),
         Field('description', 'string', 'D'),
@@ -320,11 +864,19 @@ class Account(BaseEntry):
         Field('balance_date', 'datetime', '/'),
         Field('balance_amount', 'float', '$')
     ]
+    _extra_slots = ('_type', 'subtype', 'is_auto_switch', '_transactions',
+                    '_last_header')
+    _cache_slots = ('_balance_index',)
 
     def __init__(self, **kwargs):
         super(Account, self).__init__(**kwargs)
         self._transactions = {}
         self._last_header = None
+        self._balance_index = None
+
+    @classmethod
+    def _new(cls):
+        return cls()
 
     def add_transaction(self, item, header=None):
         if not isinstance(item, Transaction) and \
@@ -340,8 +892,12 @@ class Account(BaseEntry):
         if not header:
             raise RuntimeError(six.u("no header provided yet"))
         self._transactions[header].append(item)
+        index = getattr(self, '_balance_index', None)
+        if index is not None:
+            index.add(item)
 
     def set_type(self, type):
+        _index_changed(self)
         if type:
             if type in ACCOUNT_TYPES:
                 self._type = type
@@ -362,37 +918,105 @@ class Account(BaseEntry):
     def get_transactions(self):
         return tuple(self._transactions)
 
+    def to_columns(self, cents=None):
+        """Return the transactions as a qifparse.columns.TransactionTable.
+
+        See qifparse.columns.to_columns.
+        """
+        return to_columns(self._rows(), cents)
+
+    def balance(self, date=None):
+        """Return the sum of the amounts of the transactions dated up to
+        date (a datetime, or a date for the whole day), as a Decimal.
+
+        Without date, all the dated transactions are counted.  See
+        qifparse.balances.
+        """
+        return self._get_balance_index().balance(date)
+
+    def balance_change(self, start, end):
+        """Return the sum of the amounts of the transactions dated from
+        start to end, both included, as a Decimal."""
+        return self._get_balance_index().change(start, end)
+
+    def balance_discrepancy(self):
+        """Return the balance computed at balance_date minus
+        balance_amount, or None when the account has no balance."""
+        amount = statement_amount(getattr(self, 'balance_amount', None))
+        date = getattr(self, 'balance_date', None)
+        if amount is None or date is None:
+            return None
+        return self.balance(date) - amount
+
+    def _get_balance_index(self):
+        index = getattr(self, '_balance_index', None)
+        if index is None:
+            index = self._balance_index = BalanceIndex(self)
+        elif not index.is_valid():
+            index.build()
+        return index
+
+    def _rows(self):
+        return [(self.name, header, tr)
+                for header, transactions in self._transactions.items()
+                for tr in transactions]
+
     def merge(self, orig):
-        for property in orig.__dict__:
+        self._check_merge(orig)
+        if self._transactions:
+            # orig has no transactions, or _check_merge would have raised:
+            # keep the ones of self (when merging Qif objects)
+            kept = (self._transactions, self._last_header)
+        else:
+            kept = None
+        for property in orig._slot_names:
+            # Ignore the attributes which were never set
+            if not hasattr(orig, property):
+                continue
             # Ignore "properties" which are really methods
-            if not callable(orig.__dict__[property]):
-                # Raise an exception if the objects have conflicting
-                # properties; it could be possible to merge them, in
-                # some cases, but we don't expect it to come up
-                if hasattr(self, property) and \
-                   getattr(self, property) and getattr(orig, property) and \
-                   getattr(self, property) != getattr(orig, property):
-                    raise RuntimeError(six.u("can't merge properties"))
-                else:
-                    setattr(self, property, getattr(orig, property))
+            if not callable(getattr(orig, property)):
+                setattr(self, property, getattr(orig, property))
+        if kept is not None:
+            (self._transactions, self._last_header) = kept
 
         return self
 
-    def __str__(self):
-        res = []
-        res.append('!Account')
-        fields = super(Account, self).__str__()
-        res.append(fields)
+    def _check_merge(self, orig):
+        # Raise an exception if the objects have conflicting properties;
+        # it could be possible to merge them, in some cases, but we don't
+        # expect it to come up.  Nothing is changed before checking them
+        # all.
+        for property in orig._slot_names:
+            if not hasattr(orig, property) or \
+               callable(getattr(orig, property)):
+                continue
+            if hasattr(self, property) and \
+               getattr(self, property) and getattr(orig, property) and \
+               getattr(self, property) != getattr(orig, property):
+                raise RuntimeError(six.u("can't merge properties"))
+
+    def iter_lines(self):
+        """Yield the QIF text of the account and its transactions.
+
+        Each line ends with a newline; see Qif.iter_lines.
+        """
+        yield '!Account\n'
+        for line in _record_lines(self):
+            yield line
         if self._transactions:
             for header in self._transactions.keys():
                 transactions = self._transactions[header]
-                res.append(header)
+                yield header + '\n'
                 for tr in transactions:
-                    res.append(str(tr))
-        return '\n'.join(res)
+                    for line in _record_lines(tr):
+                        yield line
+
+    def __str__(self):
+        # without the newline ending the last line
+        return ''.join(self.iter_lines())[:-1]
 
 
-class Category(BaseEntry):
+class Category(NamedEntry):
     _fields = [
         Field('name', 'string', 'N', required=True),
         Field('description', 'string', 'D'),
@@ -402,16 +1026,19 @@ class Category(BaseEntry):
         Field('budget_amount', 'float', 'B'),
         Field('tax_schedule_amount', 'string', 'R'),
     ]
+    # set by the parser
+    _extra_slots = ('expense_category', 'income_category',
+                    'tax_schedule_info')
 
 
-class Class(BaseEntry):
+class Class(NamedEntry):
     _fields = [
         Field('name', 'string', 'N', required=True),
         Field('description', 'string', 'D'),
     ]
 
 
-class Tag(BaseEntry):
+class Tag(NamedEntry):
     _fields = [
         Field('name', 'string', 'N', required=True),
         Field('description', 'string', 'D'),
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""Find the transactions of a Qif object without scanning them all.
+
+Qif.query looks transactions up by date range, account, category (with
+its subcategories), payee, cleared status and amount range.  The first
+query builds a TransactionIndex: the dates of the transactions in sorted
+order, searched with bisect, and hash indexes by account, category and
+payee.  Later queries only index the transactions added since, found at
+the end of the lists of the Qif object and of its accounts.  A query
+starts from the index giving the fewest candidates and checks the other
+conditions on those only; Qif.explain tells how a query would be run.
+
+Like the indexes by name of Qif, these ones don't follow the changes made
+to the transactions once they are indexed.  Memorized transactions are not
+indexed.
+"""
+import sys
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import date as date_type, datetime, time
+from decimal import Decimal
+
+# An index a query could start from: its name, the value looked up, and
+# the number of transactions it gives (at most that many, for category)
+IndexChoice = namedtuple('IndexChoice', ['index', 'argument', 'rows'])
+
+# Separator of the categories and their subcategories, and of the class
+# which may follow them in the category of a transaction
+CATEGORY_SEPARATOR = ':'
+CLASS_SEPARATOR = '/'
+
+
+def base_category(category):
+    """Return the category of a 'category/class' value."""
+    return category.split(CLASS_SEPARATOR, 1)[0]
+
+
+def transaction_categories(transaction):
+    """Return the set of the categories of a transaction and its splits,
+    without their classes."""
+    names = set()
+    category = getattr(transaction, 'category', None)
+    if category:
+        names.add(base_category(category))
+    for split in getattr(transaction, '_splits', None) or ():
+        if split.category:
+            names.add(base_category(split.category))
+    return names
+
+
+def in_category(name, category):
+    """Tell whether category name is category or one of its
+    subcategories."""
+    return name == category or \
+        name.startswith(category + CATEGORY_SEPARATOR)
+
+
+def to_decimal(amount):
+    if hasattr(amount, 'to_decimal'):
+        # a FixedPoint
+        return amount.to_decimal()
+    if isinstance(amount, float):
+        return Decimal(repr(amount))
+    return Decimal(amount)
+
+
+def date_bounds(start, end):
+    """Return start and end as datetimes; a date given as end stands for
+    its whole day."""
+    if isinstance(start, date_type) and not isinstance(start, datetime):
+        start = datetime.combine(start, time())
+    if isinstance(end, date_type) and not isinstance(end, datetime):
+        end = datetime.combine(end, time.max)
+    return (start, end)
+
+
+def changed_lists(known, current):
+    """Tell what changed in lists of transactions since they were last
+    seen.
+
+    known maps the id of each list seen to a (list, length seen) tuple,
+    and current yields (account, header, transactions) tuples, as
+    Qif._transaction_lists does.  Returns the mapping to keep for the next
+    call and the (account, header, transactions, start) tuples of the lists
+    with transactions from start on not seen yet; or None if a list seen
+    was removed or shortened, so that everything must be seen again.
+    """
+    lists = {}
+    new = []
+    for (account, header, transactions) in current:
+        seen = known.get(id(transactions))
+        start = 0
+        if seen is not None:
+            if seen[0] is not transactions or len(transactions) < seen[1]:
+                return None
+            start = seen[1]
+        lists[id(transactions)] = (transactions, len(transactions))
+        if len(transactions) > start:
+            new.append((account, header, transactions, start))
+    if any(key not in lists for key in known):
+        return None
+    return (lists, new)
+
+
+class QueryPlan(object):
+    """How a query is run.
+
+    choices are the IndexChoices of the indexes the query could start
+    from, the one it starts from first; with none, all the transactions
+    are scanned.  checks are the conditions checked on the candidates,
+    and total the number of transactions indexed.
+    """
+
+    def __init__(self, choices, checks, total):
+        self.choices = choices
+        self.checks = checks
+        self.total = total
+
+    @property
+    def index(self):
+        return self.choices[0].index if self.choices else None
+
+    def __str__(self):
+        lines = []
+        if self.choices:
+            for (position, choice) in enumerate(self.choices):
+                lines.append('%s index %s %s (%d of %d transactions)' % (
+                    'use' if not position else 'skip', choice.index,
+                    choice.argument, choice.rows, self.total))
+        else:
+            lines.append('scan all %d transactions' % self.total)
+        if self.checks:
+            lines.append('check %s' % ', '.join(self.checks))
+        return '\n'.join(lines)
+
+
+class TransactionIndex(object):
+    """Indexes of the transactions of a Qif object; see Qif.query.
+
+    rows holds the (account, header, transaction) tuples of the
+    transactions indexed, account being the name of their account, or
+    None for the ones of the Qif object itself.  The indexes refer to the
+    rows by their position.
+    """
+
+    def __init__(self, qif_obj):
+        self.qif_obj = qif_obj
+        self.clear()
+
+    def clear(self):
+        self.rows = []
+        # date of each row, or None
+        self.row_dates = []
+        # (date, row) pairs of the dated rows, sorted
+        self.dates = []
+        self.by_account = {}
+        self.by_category = {}
+        self.by_payee = {}
+        # id of each list of transactions indexed -> (list, length indexed)
+        self.lists = {}
+
+    def refresh(self):
+        """Index the transactions added since the last refresh.
+
+        Everything is indexed again if a list of transactions was removed
+        or shortened in between.
+        """
+        changes = changed_lists(self.lists, self.qif_obj._transaction_lists())
+        if changes is None:
+            self.clear()
+            changes = changed_lists(self.lists,
+                                    self.qif_obj._transaction_lists())
+        (self.lists, new) = changes
+        dated = len(self.dates)
+        for (account, header, transactions, start) in new:
+            self.add(account, header, transactions[start:])
+        if len(self.dates) > dated:
+            # the new dates are mostly sorted already, which sort takes
+            # advantage of
+            self.dates.sort()
+
+    def add(self, account, header, transactions):
+        """Index transactions, leaving self.dates to be sorted.
+
+        Memorized transactions, which are only templates, are left out.
+        """
+        rows = self.rows
+        dates = self.dates
+        for transaction in transactions:
+            if not transaction._dated:
+                continue
+            row = len(rows)
+            rows.append((account, header, transaction))
+            date = getattr(transaction, 'date', None)
+            self.row_dates.append(date)
+            if date is not None:
+                dates.append((date, row))
+            self.by_account.setdefault(account, []).append(row)
+            for name in transaction_categories(transaction):
+                self.by_category.setdefault(name, []).append(row)
+            payee = getattr(transaction, 'payee', None)
+            if payee:
+                self.by_payee.setdefault(payee, []).append(row)
+
+    def date_range(self, start, end):
+        """Return the (first, last) positions in self.dates of the dates
+        from start to end."""
+        dates = self.dates
+        first = 0 if start is None else bisect_left(dates, (start,))
+        last = len(dates) if end is None else \
+            bisect_right(dates, (end, sys.maxsize))
+        return (first, max(first, last))
+
+    def categories(self, category):
+        return [name for name in self.by_category
+                if in_category(name, category)]
+
+    def plan(self, start=None, end=None, account=None, category=None,
+             payee=None, cleared=None, min_amount=None, max_amount=None):
+        """Return the QueryPlan of a query; see Qif.query."""
+        self.refresh()
+        (start, end) = date_bounds(start, end)
+        choices = []
+        if start is not None or end is not None:
+            (first, last) = self.date_range(start, end)
+            choices.append(IndexChoice('date', '%s..%s' % (
+                start or '', end or ''), last - first))
+        if account is not None:
+            choices.append(IndexChoice(
+                'account', repr(account),
+                len(self.by_account.get(account, ()))))
+        if category is not None:
+            choices.append(IndexChoice(
+                'category', repr(category),
+                sum(len(self.by_category[name])
+                    for name in self.categories(category))))
+        if payee is not None:
+            choices.append(IndexChoice('payee', repr(payee),
+                                       len(self.by_payee.get(payee, ()))))
+        # the first index found with the fewest rows wins
+        choices.sort(key=lambda choice: choice.rows)
+        used = choices[0].index if choices else None
+        checks = [name for (name, value) in (
+            ('date', start is not None or end is not None),
+            ('account', account is not None),
+            ('category', category is not None),
+            ('payee', payee is not None),
+            ('cleared', cleared is not None),
+            ('amount', min_amount is not None or max_amount is not None))
+            if value and name != used]
+        return QueryPlan(choices, checks, len(self.rows))
+
+    def candidates(self, index, start, end, account, category, payee):
+        if index == 'date':
+            (first, last) = self.date_range(start, end)
+            return [row for (_, row) in self.dates[first:last]]
+        if index == 'account':
+            return self.by_account.get(account, [])
+        if index == 'category':
+            rows = set()
+            for name in self.categories(category):
+                rows.update(self.by_category[name])
+            return rows
+        if index == 'payee':
+            return self.by_payee.get(payee, [])
+        return range(len(self.rows))
+
+    def query(self, start=None, end=None, account=None, category=None,
+              payee=None, cleared=None, min_amount=None, max_amount=None):
+        """Return the rows of the transactions matching all the
+        conditions given; see Qif.query."""
+        plan = self.plan(start, end, account, category, payee, cleared,
+                         min_amount, max_amount)
+        (start, end) = date_bounds(start, end)
+        if min_amount is not None:
+            min_amount = to_decimal(min_amount)
+        if max_amount is not None:
+            max_amount = to_decimal(max_amount)
+        checks = plan.checks
+        rows = self.rows
+        row_dates = self.row_dates
+        found = []
+        for row in self.candidates(plan.index, start, end, account,
+                                   category, payee):
+            (row_account, _, transaction) = rows[row]
+            if 'date' in checks:
+                date = row_dates[row]
+                if date is None or (start is not None and date < start) or \
+                        (end is not None and date > end):
+                    continue
+            if 'account' in checks and row_account != account:
+                continue
+            if 'category' in checks and not any(
+                    in_category(name, category)
+                    for name in transaction_categories(transaction)):
+                continue
+            if 'payee' in checks and \
+                    getattr(transaction, 'payee', None) != payee:
+                continue
+            if 'cleared' in checks and \
+                    getattr(transaction, 'cleared', None) != cleared:
+                continue
+            if 'amount' in checks:
+                amount = getattr(transaction, 'amount', None)
+                if amount is None:
+                    continue
+                amount = to_decimal(amount)
+                if (min_amount is not None and amount < min_amount) or \
+                        (max_amount is not None and amount > max_amount):
+                    continue
+            found.append(row)
+        # by date, the undated transactions last, then in index order
+        found.sort(key=lambda row: (row_dates[row] is None,
+                                    row_dates[row] or datetime.min, row))
+        return [rows[row] for row in found]
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""Totals of transactions by account, category and period.
+
+Qif.rollup groups the amounts of the transactions by any of their account,
+category and period (a day, a week starting on Monday, a month or a
+year), summing and counting them with NumPy on a TransactionTable (see
+qifparse.columns).  The amounts of the splits of a transaction go to the
+categories of the splits, and what they leave of the amount of the
+transaction to its own category.  Categories lose their class ('Food/Home'
+counts as 'Food'), and with subcategories, the amounts of 'Auto:Fuel' are
+added to 'Auto' as well.
+
+NumPy is needed, as for qifparse.columns.
+"""
+from datetime import date
+from qifparse.columns import numpy, EPOCH_ORDINAL, MISSING, _require_numpy
+from qifparse.query import CATEGORY_SEPARATOR, CLASS_SEPARATOR
+
+# Lengths of the periods amounts can be grouped by
+PERIODS = ('day', 'week', 'month', 'year')
+
+# What amounts can be grouped by
+GROUP_KEYS = ('account', 'category', 'period')
+
+# Days from 1970-01-01, a Thursday, to the Monday before it
+_WEEK_SHIFT = 3
+
+
+class Rollup(object):
+    """Totals and counts of amounts, by group.
+
+    keys are the names of what the amounts are grouped by, in GROUP_KEYS;
+    columns maps each of them to the value of each group (None for the
+    amounts without account or category, and the first day of the period,
+    as a datetime.date, for period), then total and count to the sum of
+    the amounts of each group and their number.  Groups are sorted by
+    their keys, None first.
+    """
+
+    def __init__(self, keys, period, columns):
+        self.keys = keys
+        self.period = period
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['total'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def rows(self):
+        """Return a (key values..., total, count) tuple for each group."""
+        columns = [list(self.columns[name])
+                   for name in self.keys + ('total', 'count')]
+        return list(zip(*columns))
+
+    def get(self, **keys):
+        """Return the (total, count) of the group with these key values,
+        or None."""
+        names = self.keys
+        for row in self.rows():
+            if all(row[names.index(name)] == value
+                   for (name, value) in keys.items()):
+                return row[-2:]
+        return None
+
+
+def category_paths(categories, subcategories):
+    """Return the codes of the category paths of each category of a
+    dictionary, and the paths.
+
+    The result is (offsets, codes, paths): the paths of category code c
+    (itself without class, and its parents with subcategories) are
+    paths[codes[offsets[c]:offsets[c + 1]]]; the last code, len(categories),
+    stands for the missing category.
+    """
+    paths = []
+    path_codes = {}
+    codes = []
+    offsets = [0]
+    for category in list(categories) + [None]:
+        names = []
+        if category is not None:
+            name = category.split(CLASS_SEPARATOR, 1)[0]
+            names.append(name)
+            while subcategories and CATEGORY_SEPARATOR in name:
+                name = name.rsplit(CATEGORY_SEPARATOR, 1)[0]
+                names.append(name)
+        else:
+            names.append(None)
+        for name in names:
+            code = path_codes.get(name)
+            if code is None:
+                code = path_codes[name] = len(paths)
+                paths.append(name)
+            codes.append(code)
+        offsets.append(len(codes))
+    return (numpy.array(offsets, dtype=numpy.int64),
+            numpy.array(codes, dtype=numpy.int64), paths)
+
+
+def period_starts(days, period):
+    """Return the first day of the period of each datetime64[D] day, as
+    days since 1970-01-01."""
+    if period == 'day':
+        return days.astype(numpy.int64)
+    if period == 'week':
+        ordinals = days.astype(numpy.int64)
+        return ordinals - (ordinals + _WEEK_SHIFT) % 7
+    unit = {'month': 'M', 'year': 'Y'}[period]
+    return days.astype('datetime64[%s]' % unit).astype(
+        'datetime64[D]').astype(numpy.int64)
+
+
+def amounts(table):
+    """Return the (row, amount, category) arrays of the amounts of a
+    TransactionTable, split by split.
+
+    A transaction without splits gives its own amount and category; one
+    with splits gives theirs, and what they leave of its amount, if
+    anything, in its own category.
+    """
+    splits = table.splits
+    split_count = numpy.diff(table.split_offsets)
+    split_total = numpy.zeros(len(table), dtype=table['amount'].dtype)
+    if len(splits['parent']):
+        split_total = numpy.bincount(splits['parent'],
+                                     weights=splits['amount'],
+                                     minlength=len(table))
+        split_total = split_total.astype(table['amount'].dtype)
+    rest = table['amount'] - split_total
+    if rest.dtype.kind == 'f':
+        # what float sums leave is not a rest
+        rest[numpy.abs(rest) < 1e-9] = 0
+    own = (split_count == 0) | (rest != 0)
+    rows = numpy.concatenate([numpy.nonzero(own)[0], splits['parent']])
+    values = numpy.concatenate([rest[own], splits['amount']])
+    categories = numpy.concatenate([table['category'][own],
+                                    splits['category']])
+    return (rows, values, categories)
+
+
+def rollup(table, period='month', keys=GROUP_KEYS, subcategories=True):
+    """Return the Rollup of the amounts of a TransactionTable; see
+    Qif.rollup."""
+    _require_numpy()
+    if period not in PERIODS:
+        raise ValueError('unknown period: %r' % (period,))
+    keys = tuple(keys)
+    for name in keys:
+        if name not in GROUP_KEYS:
+            raise ValueError('unknown group key: %r' % (name,))
+    (rows, values, categories) = amounts(table)
+    if values.dtype.kind == 'f':
+        # missing amounts are NaN
+        values = numpy.where(numpy.isnan(values), 0.0, values)
+    # undated transactions (the memorized ones) have no period
+    dated = ~numpy.isnat(table['date'][rows])
+    if 'period' in keys:
+        (rows, values, categories) = (rows[dated], values[dated],
+                                      categories[dated])
+    dictionary = table.dictionaries['category']
+    (offsets, path_codes, paths) = category_paths(dictionary.values,
+                                                  subcategories)
+    # the missing category is the last one of category_paths
+    categories = numpy.where(categories == MISSING, len(dictionary),
+                             categories)
+    if 'category' in keys:
+        # one amount for each path of its category
+        counts = offsets[categories + 1] - offsets[categories]
+        repeated = numpy.repeat(numpy.arange(len(rows)), counts)
+        starts = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        position = numpy.arange(len(repeated)) - starts
+        categories = path_codes[offsets[categories[repeated]] + position]
+        rows = rows[repeated]
+        values = values[repeated]
+    else:
+        categories = path_codes[offsets[categories]]
+
+    # the codes are replaced by the ranks of their values, so that the
+    # groups come sorted by value
+    account_names = [None] + table.dictionaries['account'].values
+    (account_ranks, account_values) = ranks(account_names)
+    (category_ranks, category_values) = ranks(paths)
+    columns = {
+        # MISSING (-1) is the first name
+        'account': account_ranks[table['account'][rows] + 1],
+        'category': category_ranks[categories],
+        'period': period_starts(table['date'][rows], period)
+        if 'period' in keys else None,
+    }
+    # the keys are combined into a single integer, in mixed radix
+    combined = numpy.zeros(len(rows), dtype=numpy.int64)
+    bases = []
+    for name in keys:
+        column = columns[name]
+        low = int(column.min()) if len(column) else 0
+        base = int(column.max()) - low + 1 if len(column) else 1
+        combined = combined * base + (column - low)
+        bases.append((low, base))
+    (groups, inverse) = numpy.unique(combined, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    totals = numpy.bincount(inverse, weights=values, minlength=len(groups))
+    if values.dtype == numpy.int64:
+        totals = numpy.rint(totals).astype(numpy.int64)
+    result = {
+        'total': totals,
+        'count': numpy.bincount(inverse, minlength=len(groups)),
+    }
+    key_codes = []
+    for (low, base) in reversed(bases):
+        key_codes.insert(0, groups % base + low)
+        groups = groups // base
+    for (name, codes) in zip(keys, key_codes):
+        if name == 'account':
+            result[name] = [account_values[code] for code in codes]
+        elif name == 'category':
+            result[name] = [category_values[code] for code in codes]
+        else:
+            days = {}
+            for day in numpy.unique(codes):
+                days[day] = date.fromordinal(EPOCH_ORDINAL + int(day))
+            result[name] = [days[day] for day in codes]
+    return Rollup(keys, period, result)
+
+
+def ranks(values):
+    """Return the rank of each of values, as an array, and the values in
+    the order of their ranks, None first."""
+    order = sorted(range(len(values)), key=lambda code: _sort_key(
+        values[code]))
+    rank = numpy.empty(len(values), dtype=numpy.int64)
+    rank[order] = numpy.arange(len(values))
+    return (rank, [values[code] for code in order])
+
+
+def _sort_key(value):
+    # None first, then the values
+    return (value is not None, value)
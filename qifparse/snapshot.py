@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""Compact binary snapshots of Qif objects.
+
+A snapshot stores the entries of a Qif object column by column: there is
+a table for each entry class, and, for each slot, the distinct values of
+the slot with an array of codes telling which one each entry has.  The
+dates, amounts, payees and categories of a file repeat a lot, so
+snapshots are small; above all, loading one creates the entries and
+fills their slots with loops which don't run any Python code for each
+value, which is much faster than parsing the file again, or than
+unpickling the entries one by one.
+"""
+import gc
+import pickle
+from array import array
+from collections import OrderedDict, deque
+from decimal import Decimal
+from itertools import repeat
+from qifparse.qif import Qif, _UNSET
+
+# Version of the layout of the snapshots
+SNAPSHOT_VERSION = 1
+
+# Slots handled by the snapshot itself, instead of being stored as columns
+SPLITS_SLOT = '_splits'
+TRANSACTIONS_SLOT = '_transactions'
+
+# Kinds of columns: values shared by the entries, lists copied for each
+# entry, and values which can't be encoded (unhashable ones), kept as
+# they are
+_SHARED = 0
+_LISTS = 1
+_RAW = 2
+
+# Kinds of _splits values: a list follows for counts from 0
+_SPLITS_UNSET = -2
+_SPLITS_NONE = -1
+
+
+def dumps(qif_obj):
+    """Return the snapshot of a Qif object, as bytes."""
+    return pickle.dumps(_Dumper().dump(qif_obj), pickle.HIGHEST_PROTOCOL)
+
+
+def loads(data):
+    """Return the Qif object of a snapshot made by dumps."""
+    return _load(pickle.loads(data))
+
+
+def dump(qif_obj, file_handle):
+    pickle.dump(_Dumper().dump(qif_obj), file_handle,
+                pickle.HIGHEST_PROTOCOL)
+
+
+def load(file_handle):
+    return _load(pickle.load(file_handle))
+
+
+class _Dumper(object):
+
+    def __init__(self):
+        self.classes = []
+        self.tables = {}
+
+    def add(self, entries):
+        """Add entries to the tables of their classes.
+
+        Returns the (table, start, count) runs of consecutive entries of
+        the same class, which give back the entries once loaded.
+        """
+        runs = []
+        classes = set(entry.__class__ for entry in entries)
+        for cls in classes:
+            if cls not in self.tables:
+                self.tables[cls] = []
+                self.classes.append(cls)
+        if len(classes) == 1:
+            # the common case, without any loop
+            cls = classes.pop()
+            table = self.tables[cls]
+            runs.append((self.classes.index(cls), len(table), len(entries)))
+            table.extend(entries)
+            return runs
+        for entry in entries:
+            number = self.classes.index(entry.__class__)
+            table = self.tables[entry.__class__]
+            if runs and runs[-1][0] == number and \
+                    runs[-1][1] + runs[-1][2] == len(table):
+                runs[-1] = (number, runs[-1][1], runs[-1][2] + 1)
+            else:
+                runs.append((number, len(table), 1))
+            table.append(entry)
+        return runs
+
+    def add_transactions(self, transactions):
+        return [(header, self.add(list(entries)))
+                for header, entries in transactions.items()]
+
+    def dump(self, qif_obj):
+        qif_obj._check_indexes()
+        accounts = qif_obj.get_accounts()
+        structure = {
+            'categories': self.add(list(qif_obj._categories)),
+            'classes': self.add(list(qif_obj._classes)),
+            'tags': self.add(list(qif_obj._tags)),
+            'accounts': self.add(list(accounts)),
+            'account_transactions': [
+                self.add_transactions(acc._transactions)
+                for acc in accounts],
+            'transactions': self.add_transactions(qif_obj._transactions),
+            'last_header': qif_obj._last_header,
+        }
+        positions = dict((id(acc), position)
+                         for position, acc in enumerate(accounts))
+        structure['accounts_by_name'] = dict(
+            (name, [positions[id(acc)] for acc in accs])
+            for name, accs in qif_obj._accounts_by_name.items())
+        structure['accounts_by_type'] = dict(
+            (atype, [positions[id(acc)] for acc in accs.values()])
+            for atype, accs in qif_obj._accounts_by_type.items())
+        for name in ('categories', 'classes', 'tags'):
+            entries = getattr(qif_obj, '_' + name)
+            positions = dict((id(entry), position)
+                             for position, entry in enumerate(entries))
+            structure[name + '_by_name'] = dict(
+                (key, [positions[id(entry)] for entry in values])
+                for key, values in
+                getattr(qif_obj, '_%s_by_name' % name).items())
+
+        # the splits add entries to other tables: the tables are only
+        # encoded once they are all complete
+        splits = []
+        for cls in list(self.classes):
+            if SPLITS_SLOT in cls._slot_names:
+                splits.append(self.dump_splits(self.tables[cls]))
+        structure['splits'] = splits
+        structure['tables'] = [
+            (cls, len(self.tables[cls]), self.dump_columns(cls))
+            for cls in self.classes]
+        return (SNAPSHOT_VERSION, structure)
+
+    def dump_splits(self, entries):
+        counts = array('l')
+        children = []
+        for entry in entries:
+            value = getattr(entry, SPLITS_SLOT, _UNSET)
+            if value is _UNSET:
+                counts.append(_SPLITS_UNSET)
+            elif value is None:
+                counts.append(_SPLITS_NONE)
+            else:
+                counts.append(len(value))
+                children.extend(value)
+        return (counts, self.add(children) if children else [])
+
+    def dump_columns(self, cls):
+        entries = self.tables[cls]
+        columns = []
+        for name in cls._slot_names:
+            if name == SPLITS_SLOT or name == TRANSACTIONS_SLOT:
+                continue
+            values = [getattr(entry, name, _UNSET) for entry in entries]
+            columns.append((name,) + _encode_column(values))
+        return columns
+
+
+def _encode_column(values):
+    """Return the (kind, present, distinct, codes) encoding of values.
+
+    present lists the positions of the values which are set, or is None
+    if they all are.  codes is the number of values when they are all
+    the same.
+    """
+    present = None
+    if _UNSET in values:
+        present = array('l', [position for position, value
+                               in enumerate(values) if value is not _UNSET])
+        values = [value for value in values if value is not _UNSET]
+    kind = _SHARED
+    keys = {}
+    distinct = []
+    codes = []
+    try:
+        for value in values:
+            cls = value.__class__
+            if cls is list:
+                kind = _LISTS
+                key = (cls, tuple(value))
+            elif cls is Decimal:
+                # Decimal('1.0') == Decimal('1.00'), but they are written
+                # differently
+                key = (cls, str(value))
+            else:
+                key = (cls, value)
+            code = keys.get(key)
+            if code is None:
+                code = keys[key] = len(distinct)
+                distinct.append(value)
+            codes.append(code)
+    except TypeError:
+        return (_RAW, present, values, None)
+    if len(distinct) == 1:
+        codes = len(codes)
+    else:
+        codes = array(_code_typecode(len(distinct)), codes)
+    return (kind, present, distinct, codes)
+
+
+def _code_typecode(count):
+    """Return the smallest array typecode for codes below count."""
+    for typecode in ('B', 'H', 'L'):
+        if count <= 1 << (8 * array(typecode).itemsize):
+            return typecode
+    return 'Q'
+
+
+def _slot(cls, name):
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            return klass.__dict__[name]
+    raise AttributeError(name)
+
+
+def _consume(iterator):
+    deque(iterator, maxlen=0)
+
+
+def _load(snapshot):
+    (version, structure) = snapshot
+    if version != SNAPSHOT_VERSION:
+        raise ValueError('unknown snapshot version: %r' % (version,))
+    # the entries only add objects to the heap: let the garbage collector
+    # wait until they are all created
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _load_structure(structure)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _column_values(column):
+    (name, kind, present, distinct, codes) = column
+    if kind == _RAW:
+        return distinct
+    if isinstance(codes, int):
+        values = repeat(distinct[0], codes)
+    else:
+        values = map(distinct.__getitem__, codes)
+    if kind == _LISTS:
+        values = [list(value) if value.__class__ is list else value
+                  for value in values]
+    return values
+
+
+# Functions building the entries of a class out of rows of slot values,
+# keyed by (class, slot names)
+_builders = {}
+
+
+def _builder(cls, names):
+    """Generate a function building entries of cls out of rows of values
+    for the given slots.
+
+    Assigning the slots of each entry at once is much faster than setting
+    each slot of every entry through its descriptor.
+    """
+    key = (cls, names)
+    if key not in _builders:
+        source = ['def build(rows):', '    entries = []',
+                  '    append = entries.append',
+                  '    for (%s) in rows:' % ''.join(
+                      'v%d, ' % index for index in range(len(names))),
+                  '        self = new(cls)']
+        for index, name in enumerate(names):
+            source.append('        self.%s = v%d' % (name, index))
+        source.append('        append(self)')
+        source.append('    return entries')
+        namespace = {'new': object.__new__, 'cls': cls}
+        exec('\n'.join(source), namespace)
+        _builders[key] = namespace['build']
+    return _builders[key]
+
+
+def _load_structure(structure):
+    tables = []
+    for (cls, count, columns) in structure['tables']:
+        # the slots set in every entry are assigned as the entries are
+        # built, the others afterwards
+        dense = [column for column in columns if column[2] is None]
+        if dense:
+            build = _builder(cls, tuple(column[0] for column in dense))
+            entries = build(zip(*[_column_values(column)
+                                  for column in dense]))
+        else:
+            entries = list(map(object.__new__, repeat(cls, count)))
+        for column in columns:
+            present = column[2]
+            if present is not None:
+                _consume(map(_slot(cls, column[0]).__set__,
+                             map(entries.__getitem__, present),
+                             _column_values(column)))
+        tables.append(entries)
+
+    def gather(runs):
+        res = []
+        for (table, start, count) in runs:
+            res.extend(tables[table][start:start + count])
+        return res
+
+    owners = [(cls, table) for (table, (cls, count, columns)) in
+              zip(tables, structure['tables'])
+              if SPLITS_SLOT in cls._slot_names]
+    for ((cls, owner_entries), (counts, runs)) in zip(owners,
+                                                      structure['splits']):
+        children = gather(runs)
+        position = 0
+        slot = _slot(cls, SPLITS_SLOT)
+        for (entry, count) in zip(owner_entries, counts):
+            if count >= 0:
+                slot.__set__(entry, children[position:position + count])
+                position += count
+            elif count == _SPLITS_NONE:
+                slot.__set__(entry, None)
+
+    qif_obj = Qif()
+    accounts = gather(structure['accounts'])
+    for (acc, transactions) in zip(accounts,
+                                   structure['account_transactions']):
+        acc._transactions = dict((header, gather(runs))
+                                 for (header, runs) in transactions)
+        qif_obj._accounts[id(acc)] = acc
+    qif_obj._accounts_by_name = dict(
+        (name, [accounts[position] for position in positions])
+        for name, positions in structure['accounts_by_name'].items())
+    qif_obj._accounts_by_type = dict(
+        (atype, OrderedDict((id(accounts[position]), accounts[position])
+                            for position in positions))
+        for atype, positions in structure['accounts_by_type'].items())
+    for name in ('categories', 'classes', 'tags'):
+        values = gather(structure[name])
+        setattr(qif_obj, '_' + name, values)
+        setattr(qif_obj, '_%s_by_name' % name, dict(
+            (key, [values[position] for position in positions])
+            for key, positions in structure[name + '_by_name'].items()))
+    qif_obj._mark_indexed()
+    qif_obj._transactions = dict((header, gather(runs)) for (header, runs)
+                                 in structure['transactions'])
+    qif_obj._last_header = structure['last_header']
+    return qif_obj
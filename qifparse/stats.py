@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Counters and timings of the parse of QIF files.
+
+A ParseStats object given to QifParser.parseFile (or parseData and
+parseFileHandle) counts the records of each kind, the lines of each field
+code and the lines the parser does not recognize, measures the time spent
+in each phase of the parse, and calls the hooks it was given for unknown
+lines and slow records.  Without one, the parser runs without measuring
+anything.
+"""
+import time
+from collections import Counter
+
+try:
+    _timer = time.perf_counter
+except AttributeError:
+    _timer = time.time
+
+# Phases of the parse: reading and decoding the file, splitting it into
+# records, finding the section headers, building the entries from their
+# fields, converting dates, and adding the entries to the Qif object
+PHASES = ('read', 'split', 'type', 'fields', 'dates', 'insert')
+
+# Time above which a record is given to the on_slow_record hook, in seconds
+DEFAULT_SLOW_RECORD_THRESHOLD = 0.01
+
+
+class ParseStats(object):
+    """Statistics of a parse, and hooks called during it.
+
+    records counts the records by kind ('transaction', 'account', ...),
+    fields the lines by (kind, field code), and unknown_lines the lines
+    the parser skipped, by (kind, line).  phases holds the seconds spent
+    in each of PHASES; bytes is the size of the files parsed, characters
+    the length of the text split into records.
+
+    on_unknown_line(kind, line) is called for each line the parser
+    skips, and on_slow_record(kind, record, seconds) for each record
+    which took at least slow_record_threshold seconds to parse.
+    """
+
+    def __init__(self, on_unknown_line=None, on_slow_record=None,
+                 slow_record_threshold=DEFAULT_SLOW_RECORD_THRESHOLD,
+                 timer=_timer):
+        self.on_unknown_line = on_unknown_line
+        self.on_slow_record = on_slow_record
+        self.slow_record_threshold = slow_record_threshold
+        self.timer = timer
+        self.records = Counter()
+        self.fields = Counter()
+        self.unknown_lines = Counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.bytes = 0
+        self.characters = 0
+        # seconds added to any phase so far, to tell how much of a time
+        # measure was already counted by a nested one
+        self._counted = 0.0
+
+    def add_time(self, phase, seconds):
+        self.phases[phase] += seconds
+        self._counted += seconds
+
+    def time_iter(self, iterable, phase):
+        """Yield the items of iterable, counting the time taken to get
+        them in phase.
+
+        The time counted in other phases meanwhile, by the iterables
+        iterable is made of, is left out.
+        """
+        iterator = iter(iterable)
+        timer = self.timer
+        while True:
+            counted = self._counted
+            start = timer()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(phase,
+                              timer() - start - (self._counted - counted))
+                return
+            self.add_time(phase, timer() - start - (self._counted - counted))
+            yield item
+
+    def read(self, blocks):
+        """Yield the blocks of text of a file, counting them in the read
+        phase."""
+        for block in self.time_iter(blocks, 'read'):
+            self.characters += len(block)
+            yield block
+
+    def unknown_line(self, kind, line):
+        self.unknown_lines[(kind, line)] += 1
+        if self.on_unknown_line is not None:
+            self.on_unknown_line(kind, line)
+
+    def record(self, kind, lines, chunk, seconds):
+        """Count a parsed record, made of lines."""
+        self.records[kind] += 1
+        fields = self.fields
+        for line in lines:
+            if line:
+                fields[(kind, line[0])] += 1
+        if self.on_slow_record is not None and \
+                seconds >= self.slow_record_threshold:
+            self.on_slow_record(kind, chunk, seconds)
+
+    def total_time(self):
+        return sum(self.phases.values())
+
+    def as_dict(self):
+        """Return the statistics as plain values, ready for JSON."""
+        return {
+            'records': dict(self.records),
+            'fields': dict(('%s:%s' % key, count)
+                           for key, count in self.fields.items()),
+            'unknown_lines': sum(self.unknown_lines.values()),
+            'phases': dict(self.phases),
+            'bytes': self.bytes,
+            'characters': self.characters,
+        }
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import pickle
+from decimal import Decimal
+from qifparse.amounts import (
+    Cents,
+    DecimalCache,
+    fixed_point_type,
+    fixed_point_types,
+)
+from qifparse.parser import QifParser
+
+filename = os.path.join(os.path.dirname(__file__), 'file.qif')
+
+
+class TestFixedPoint(unittest.TestCase):
+
+    def testParse(self):
+        self.assertEqual(Cents.parse('-1,234.5'), -123450)
+        self.assertEqual(Cents.parse('31'), 3100)
+        self.assertEqual(Cents.parse('.07'), 7)
+        self.assertEqual(Cents.parse('+0.125'), 12)
+        self.assertEqual(Cents.parse('0.135'), 14)
+        self.assertEqual(Cents.parse('0.1251'), 13)
+        self.assertRaises(ValueError, Cents.parse, '')
+        self.assertRaises(ValueError, Cents.parse, '1.2.3')
+
+    def testFormat(self):
+        price = fixed_point_type(6).parse('12.3455')
+        self.assertEqual(price, 12345500)
+        self.assertEqual(price.format(3), '12.346')
+        self.assertEqual(Cents(-5).format(), '-0.05')
+        self.assertEqual(str(Cents(123450)), '1234.50')
+        self.assertEqual(Cents(-1234).to_decimal(), Decimal('-12.34'))
+
+    def testPickle(self):
+        value = pickle.loads(pickle.dumps(Cents(1234)))
+        self.assertEqual(value, 1234)
+        self.assertTrue(type(value) is Cents)
+        value = pickle.loads(pickle.dumps(fixed_point_type(6)(1234)))
+        self.assertEqual(value.format(), '0.001234')
+        self.assertTrue(type(value) is fixed_point_type(6))
+
+    def testTypes(self):
+        self.assertEqual(fixed_point_types(None), None)
+        types = fixed_point_types({'price': 4})
+        self.assertTrue(types['amount'] is Cents)
+        self.assertEqual(types['price'].scale, 4)
+
+
+class TestDecimalCache(unittest.TestCase):
+
+    def testCache(self):
+        cache = DecimalCache(2)
+        amount = cache['-1,234.50']
+        self.assertEqual(amount, Decimal('-1234.50'))
+        self.assertTrue(cache['-1,234.50'] is amount)
+        cache['1']
+        cache['2']
+        self.assertEqual(sorted(cache), ['2'])
+        self.assertRaises(Exception, cache.__getitem__, 'x')
+        self.assertEqual(len(cache), 1)
+
+
+class TestFixedPointParsing(unittest.TestCase):
+
+    def testParseFile(self):
+        qif = QifParser.parseFile(filename, '%d/%m/%Y', fixed_point=True)
+        cash = qif.get_accounts('My Cash')[0]
+        transactions = cash._transactions['!Type:Cash']
+        self.assertEqual([tr.amount for tr in transactions],
+                         [-650, 3100, -4800])
+        self.assertTrue(all(type(tr.amount) is Cents for tr in transactions))
+        self.assertEqual([split.amount for split in transactions[2].splits],
+                         [-3100, -1700])
+        self.assertEqual(sum(tr.amount for tr in transactions), -2350)
+
+    def testOverriddenConversions(self):
+        class HalfParser(QifParser):
+            def parseFloat(self, chunk):
+                return Decimal(chunk.replace(',', '')) / 2
+
+        parser = QifParser('%d/%m/%Y')
+        self.assertTrue(parser.plain_values)
+        half = HalfParser('%d/%m/%Y')
+        self.assertFalse(half.plain_values)
+        cash = half.parseFile(filename).get_accounts('My Cash')[0]
+        self.assertEqual(cash._transactions['!Type:Cash'][0].amount,
+                         Decimal('-3.25'))
+
+    def testRoundTrip(self):
+        decimals = QifParser.parseFile(filename, '%d/%m/%Y')
+        fixed = QifParser.parseFile(filename, '%d/%m/%Y', fixed_point=True)
+        self.assertEqual(str(decimals), str(fixed))
+
+
+if __name__ == "__main__":
+    import unittest
+    unittest.main()
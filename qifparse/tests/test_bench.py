@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from qifparse.bench import generator, throughput
+from qifparse.parser import QifParser
+
+
+class TestGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testGenerateFile(self):
+        path = os.path.join(self.tmpdir, 'corpus.qif')
+        count = generator.generate_file(path, 2000, seed=3)
+        with open(path, 'rb') as file_handle:
+            data = file_handle.read()
+        other = os.path.join(self.tmpdir, 'other.qif')
+        generator.generate_file(other, 2000, seed=3)
+        with open(other, 'rb') as file_handle:
+            self.assertEqual(file_handle.read(), data)
+        self.assertEqual(throughput.count_records(path), count)
+        self.assertTrue(b"'" in data)
+        self.assertTrue(b'/ ' in data)
+        self.assertTrue(b'!Option:AutoSwitch' in data)
+
+        qif = QifParser.parseFile(path, generator.DATE_FORMAT)
+        accounts = qif.get_accounts()
+        self.assertEqual(len(accounts), 10)
+        transactions = [tr for acc in accounts
+                        for trs in acc._transactions.values() for tr in trs]
+        self.assertTrue(len(transactions) > 1800)
+        self.assertTrue(any(tr.splits for tr in transactions
+                            if hasattr(tr, 'splits')))
+        self.assertTrue(any(tr.amount >= 1000 for tr in transactions
+                            if tr.amount))
+        self.assertEqual(len(qif.get_transactions()[0]), 50)
+        self.assertEqual(len(qif.get_accounts(atype='Invst')), 2)
+
+    def testThroughput(self):
+        results = throughput.run([500], directory=self.tmpdir, isolate=False)
+        self.assertEqual([result['mode'] for result in results['results']],
+                         list(throughput.MODES))
+        for result in results['results']:
+            self.assertTrue(result['records'] > 450)
+            self.assertTrue(result['records_per_second'] > 0)
+        results = json.loads(json.dumps(results))
+        rows = throughput.compare(results, results)
+        self.assertEqual([row[-1] for row in rows], [1.0, 1.0])
+        self.assertEqual(throughput.parse_size('10M'), 10000000)
+
+
+if __name__ == "__main__":
+    import unittest
+    unittest.main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import pickle
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from qifparse import qif
+
+
+class TestCategoryTree(unittest.TestCase):
+
+    def setUp(self):
+        self.qif_obj = qif.Qif()
+        for name in ('Auto', 'Auto:Fuel', 'Auto:ZZZZZ', 'Food'):
+            self.qif_obj.add_category(qif.Category(name=name))
+        self.bank = qif.Account(name='Bank')
+        self.qif_obj.add_account(self.bank)
+        self.add(1, '-40.00', 'Auto:Fuel/Business')
+        self.add(2, '-10.00', 'Food')
+        tr = self.add(3, '-100.00', 'Auto')
+        tr.splits.append(qif.AmountSplit(category='Auto:Service:Tires',
+                                         amount=Decimal('-60.00')))
+        tr.splits.append(qif.AmountSplit(category='Food',
+                                         amount=Decimal('-15.00')))
+        self.add(4, '500.00', None)
+        memorized = qif.MemorizedTransaction(amount=Decimal('-10.00'),
+                                             category='Food')
+        self.qif_obj.add_transaction(memorized, '!Type:Memorized')
+
+    def add(self, day, amount, category):
+        tr = qif.Transaction(date=datetime(2013, 1, day),
+                             amount=Decimal(amount), category=category)
+        self.bank.add_transaction(tr, '!Type:Bank')
+        return tr
+
+    def testTree(self):
+        tree = self.qif_obj.category_tree()
+        self.assertEqual([node.path for node in tree.walk()],
+                         ['Auto', 'Auto:Fuel', 'Auto:Service',
+                          'Auto:Service:Tires', 'Auto:ZZZZZ', 'Food'])
+        auto = tree.find('Auto')
+        self.assertTrue(
+            auto.category is self.qif_obj.get_categories('Auto')[0])
+        self.assertEqual(tree.find('Auto:Service').category, None)
+        self.assertEqual(tree.find('Auto:Fuel/Personal').total,
+                         Decimal('-40.00'))
+        self.assertEqual(tree.find('Auto:Tires'), None)
+        self.assertEqual(auto.total, Decimal('-25.00'))
+        self.assertEqual(auto.subtotal, Decimal('-125.00'))
+        self.assertEqual(auto.subcount, 3)
+        self.assertEqual(tree.total('Food'), Decimal('-25.00'))
+        self.assertEqual(tree.total('Auto', subcategories=False),
+                         Decimal('-25.00'))
+        self.assertEqual(tree.total('Travel'), 0)
+        self.assertEqual(tree.root.total, Decimal('500.00'))
+        self.assertEqual(tree.root.subtotal, Decimal('350.00'))
+        self.assertEqual([(tr.date.day, amount) for (account, _, tr, amount)
+                          in tree.transactions('Auto')],
+                         [(3, Decimal('-25.00')), (1, Decimal('-40.00')),
+                          (3, Decimal('-60.00'))])
+        self.assertEqual(tree.transactions('Travel'), [])
+        self.assertEqual([node.path for node in tree.placeholders()],
+                         ['Auto:ZZZZZ'])
+        self.assertEqual(tree.find('Auto:Service:Tires').depth, 3)
+
+    def testTreeUpdates(self):
+        tree = self.qif_obj.category_tree()
+        fuel = tree.find('Auto:Fuel')
+        self.add(5, '-20.00', 'Auto:Fuel')
+        self.qif_obj.add_category(qif.Category(name='Travel:XXX'))
+        self.assertTrue(self.qif_obj.category_tree() is tree)
+        self.assertTrue(tree.find('Auto:Fuel') is fuel)
+        self.assertEqual(fuel.total, Decimal('-60.00'))
+        self.assertEqual(tree.total('Auto'), Decimal('-145.00'))
+        self.assertEqual(len(tree.placeholders()), 2)
+        # removed transactions make the tree be built again
+        del self.bank._transactions['!Type:Bank'][0]
+        self.assertEqual(self.qif_obj.category_tree().total('Auto:Fuel'),
+                         Decimal('-20.00'))
+        copy = pickle.loads(pickle.dumps(self.qif_obj))
+        self.assertEqual(copy._category_tree, None)
+        self.assertEqual(copy.category_tree().total('Auto'),
+                         Decimal('-105.00'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+from qifparse.columns import MISSING, numpy
+from qifparse.parser import QifParser
+
+filename = os.path.join(os.path.dirname(__file__), 'file.qif')
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.qif = QifParser.parseFile(filename, '%d/%m/%Y',
+                                       fixed_point=True)
+
+    def testAccountColumns(self):
+        cash = self.qif.get_accounts('My Cash')[0]
+        table = cash.to_columns()
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table['amount'].dtype, numpy.int64)
+        self.assertEqual(list(table['amount']), [-650, 3100, -4800])
+        self.assertEqual(str(table['date'][0]), '2013-10-23')
+        self.assertEqual(list(table.decode('category')),
+                         ['food:lunch/Sandwiches', None, None])
+        self.assertEqual(list(table.decode('to_account')),
+                         [None, 'My Cc', None])
+        self.assertEqual(table['payee'][0], MISSING)
+
+        # the third transaction has two splits
+        self.assertEqual(list(table.split_offsets), [0, 0, 0, 2])
+        splits = table.splits
+        self.assertEqual(list(splits['parent']), [2, 2])
+        self.assertEqual(list(splits['amount']), [-3100, -1700])
+        self.assertEqual(list(splits.decode('to_account')), ['My Cc', None])
+        self.assertEqual(splits['amount'].sum(), table['amount'][2])
+
+    def testQifColumns(self):
+        table = self.qif.to_columns(cents=False)
+        self.assertEqual(table['amount'].dtype, numpy.float64)
+        accounts = table.decode('account')
+        # memorized transactions are outside any account
+        self.assertEqual(list(accounts),
+                         ['My Cash'] * 3 + ['My Cc'] * 2 + [None] * 2)
+        cash = accounts == 'My Cash'
+        self.assertAlmostEqual(table['amount'][cash].sum(), -23.5)
+        # vectorized filters on the codes
+        code = table.dictionaries['account'].code('My Cc')
+        self.assertEqual((table['to_account'] == code).sum(), 1)
+
+    def testDecimalAmounts(self):
+        qif = QifParser.parseFile(filename, '%d/%m/%Y')
+        self.assertEqual(qif.to_columns()['amount'].dtype, numpy.float64)
+        table = qif.to_columns(cents=True)
+        self.assertEqual(table['amount'].dtype, numpy.int64)
+        self.assertEqual(list(table['amount'][:3]), [-650, 3100, -4800])
+
+
+
+if __name__ == "__main__":
+    import unittest
+    unittest.main()
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import pickle
 import unittest
+from datetime import date, datetime
+from decimal import Decimal
 from qifparse import qif
 
 # This file tests some of the infrastructure functionality, without using any
@@ -36,6 +39,215 @@ class TestCreateQIF(unittest.TestCase):
         res = qif_obj.get_categories(name='my cat')
         self.failUnless(len(res))
 
+    def testEntriesHaveSlots(self):
+        for klass in (qif.Transaction, qif.MemorizedTransaction,
+                      qif.AmountSplit, qif.Investment, qif.Account,
+                      qif.Category, qif.Class, qif.Tag):
+            self.assertFalse(hasattr(klass(), '__dict__'))
+        self.assertRaises(AttributeError, setattr, qif.Transaction(),
+                          'no_such_field', 1)
+
+    def testFastConstructor(self):
+        tr = qif.Transaction._new()
+        tr.amount = -6.55
+        self.assertEqual(str(tr), str(qif.Transaction(amount=-6.55)))
+        self.assertEqual(qif.Category._new().expense, True)
+        self.assertEqual(qif.Account._new()._transactions, {})
+
+    def testLazySplits(self):
+        tr = qif.Transaction(amount=-10)
+        self.assertFalse(hasattr(tr, '_splits'))
+        self.assertEqual(tr.splits, [])
+        tr.splits.append(qif.AmountSplit(category='food', amount=-10))
+        self.assertEqual(len(tr.splits), 1)
+        self.assertTrue('Sfood' in str(tr))
+
+    def testAutoSwitchMerge(self):
+        qif_obj = qif.Qif()
+        for name, atype in (('Bank', 'Bank'), ('Card', 'CCard')):
+            acc = qif.Account(name=name, account_type=atype)
+            acc.is_auto_switch = True
+            qif_obj.add_account(acc)
+        bank = qif.Account(name='Bank', description='Checking')
+        bank.is_auto_switch = False
+        qif_obj.add_account(bank)
+
+        self.assertEqual([acc.name for acc in qif_obj.get_accounts()],
+                         ['Card', 'Bank'])
+        self.assertEqual(qif_obj.get_accounts('Bank'), (bank,))
+        self.assertEqual(bank.account_type, 'Bank')
+        self.assertEqual(qif_obj.get_accounts(atype='Bank'), (bank,))
+        self.assertEqual(qif_obj.get_accounts('Bank', 'CCard'), ())
+        self.assertEqual(len(qif_obj.get_accounts(atype='CCard')), 1)
+        self.assertEqual(qif_obj.get_accounts('Nope'), ())
+
+    def testGetClassesAndTags(self):
+        qif_obj = qif.Qif()
+        qif_obj.add_class(qif.Class(name='work'))
+        qif_obj.add_tag(qif.Tag(name='trip'))
+        qif_obj.add_tag(qif.Tag(name='trip', description='again'))
+        self.assertEqual(len(qif_obj.get_classes('work')), 1)
+        self.assertEqual(qif_obj.get_classes('home'), ())
+        self.assertEqual(len(qif_obj.get_tags('trip')), 2)
+        self.assertEqual(len(qif_obj.get_tags()), 2)
+
+    def testIndexesFollowChanges(self):
+        qif_obj = qif.Qif()
+        acc = qif.Account(name='A')
+        qif_obj.add_account(acc)
+        acc.account_type = 'Bank'
+        self.assertEqual(qif_obj.get_accounts(atype='Bank'), (acc,))
+        self.assertEqual(qif_obj.get_accounts('A', 'Bank'), (acc,))
+        acc.name = 'B'
+        self.assertEqual(qif_obj.get_accounts('A'), ())
+        self.assertEqual(qif_obj.get_accounts('B'), (acc,))
+        # a renamed auto-switch account is still replaced
+        acc.is_auto_switch = True
+        other = qif.Account(name='B', description='Savings')
+        other.is_auto_switch = False
+        qif_obj.add_account(other)
+        self.assertEqual(qif_obj.get_accounts(), (other,))
+        self.assertEqual(other.account_type, 'Bank')
+        tag = qif.Tag(name='trip')
+        qif_obj.add_tag(tag)
+        copy = pickle.loads(pickle.dumps(qif_obj))
+        tag.name = 'work'
+        self.assertEqual(qif_obj.get_tags('work'), (tag,))
+        copy.get_tags()[0].name = 'home'
+        self.assertEqual(len(copy.get_tags('home')), 1)
+        self.assertEqual(copy.get_tags('trip'), ())
+
+    def testSerializer(self):
+        tr = qif.Transaction(date=datetime(2013, 10, 23),
+                             amount=Decimal('2.675'), payee='Bar',
+                             address=['via Roma', 'Ferrara'])
+        self.assertEqual(str(tr).split('\n'),
+                         ['D23/10/2013', 'T2.68', 'PBar', 'Avia Roma',
+                          'AFerrara', '^'])
+        tr.date_format = '%m/%d/%y'
+        self.assertTrue(str(tr).startswith('D10/23/13\n'))
+        tr.amount = 1.5
+        self.assertTrue('\nT1.50\n' in str(tr))
+        self.assertRaises(RuntimeError, str, qif.Account())
+
+    def testMergeQif(self):
+        qif_obj = qif.Qif()
+        acc = qif.Account(name='My Cc', account_type='CCard',
+                          description='Visa')
+        acc.is_auto_switch = True
+        qif_obj.add_account(acc)
+        other = qif.Qif()
+        acc = qif.Account(name='My Cc', account_type='CCard')
+        acc.is_auto_switch = False
+        other.add_account(acc)
+        other.add_category(qif.Category(name='food'))
+        other.add_transaction(qif.Transaction(amount=-1), header='!Type:Cash')
+        acc = qif.Account(name='Cash')
+        acc.is_auto_switch = False
+        other.add_account(acc)
+        qif_obj.merge(other)
+        self.assertEqual(len(qif_obj.get_accounts()), 2)
+        self.assertEqual(qif_obj.get_accounts('My Cc')[0].description, 'Visa')
+        self.assertEqual(len(qif_obj.get_categories('food')), 1)
+        self.assertEqual(len(qif_obj.get_transactions()[0]), 1)
+
+        # nothing is merged when an account conflicts
+        conflict = qif.Qif()
+        for name in ('Savings', 'Cash'):
+            acc = qif.Account(name=name)
+            acc.is_auto_switch = False
+            conflict.add_account(acc)
+        self.assertRaises(RuntimeError, qif_obj.merge, conflict)
+        self.assertEqual(qif_obj.get_accounts('Savings'), ())
+
+    def testPickle(self):
+        qif_obj = qif.Qif()
+        acc = qif.Account(name='My Cc', account_type='CCard')
+        qif_obj.add_account(acc)
+        tr = qif.Transaction(amount=Decimal('-6.55'), payee='Bar')
+        tr.splits.append(qif.AmountSplit(category='food', amount=-6.55))
+        acc.add_transaction(tr, header='!Type:CCard')
+        copy = pickle.loads(pickle.dumps(qif_obj, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(str(copy), str(qif_obj))
+        (acc,) = copy.get_accounts(atype='CCard')
+        self.assertEqual(copy.get_accounts('My Cc'), (acc,))
+        copy._remove_account(acc)
+        self.assertEqual(copy.get_accounts(), ())
+        self.assertFalse(hasattr(pickle.loads(pickle.dumps(qif.Transaction())),
+                                 '_splits'))
+
+    def testGetTransactionsRecursive(self):
+        qif_obj = qif.Qif()
+        acc = qif.Account(name='My Cc')
+        qif_obj.add_account(acc)
+        tr1 = qif.Transaction(amount=Decimal('1'))
+        acc.add_transaction(tr1, header='!Type:CCard')
+        tr2 = qif.Transaction(amount=Decimal('2'))
+        qif_obj.add_transaction(tr2, header='!Type:Bank')
+        self.assertEqual(qif_obj.get_transactions(), ([tr2],))
+        self.assertEqual(qif_obj.get_transactions(recursive=True),
+                         ([tr2], [tr1]))
+
+
+class TestAccountBalances(unittest.TestCase):
+
+    def setUp(self):
+        self.account = qif.Account(name='Bank')
+        for (day, amount) in ((3, '-10.00'), (1, '100.00'), (3, '-5.50'),
+                              (7, '20.00')):
+            self.add(day, amount)
+
+    def add(self, day, amount, header='!Type:Bank'):
+        tr = qif.Transaction(date=datetime(2013, 1, day),
+                             amount=Decimal(amount))
+        self.account.add_transaction(tr, header)
+        return tr
+
+    def testBalance(self):
+        account = self.account
+        self.assertEqual(account.balance(datetime(2012, 12, 31)), 0)
+        self.assertEqual(account.balance(datetime(2013, 1, 1)),
+                         Decimal('100.00'))
+        self.assertEqual(account.balance(date(2013, 1, 3)), Decimal('84.50'))
+        self.assertEqual(account.balance(datetime(2013, 1, 6)),
+                         Decimal('84.50'))
+        self.assertEqual(account.balance(), Decimal('104.50'))
+        self.assertEqual(account.balance_change(date(2013, 1, 2),
+                                                date(2013, 1, 7)),
+                         Decimal('4.50'))
+        self.assertEqual(account.balance_change(date(2013, 1, 4),
+                                                date(2013, 1, 6)), 0)
+        self.assertEqual(account.balance_discrepancy(), None)
+        account.balance_date = datetime(2013, 1, 3)
+        account.balance_amount = '84.50'
+        self.assertEqual(account.balance_discrepancy(), 0)
+        account.balance_amount = '1,084.50'
+        self.assertEqual(account.balance_discrepancy(), Decimal('-1000'))
+
+    def testIndexUpdates(self):
+        account = self.account
+        account.balance()
+        index = account._balance_index
+        self.add(9, '1.00')
+        self.add(9, '2.00', '!Type:Cash')
+        self.assertFalse(index.stale)
+        self.assertEqual(len(index.dates), 6)
+        self.assertEqual(account.balance(date(2013, 1, 8)), Decimal('104.50'))
+        self.assertEqual(account.balance(), Decimal('107.50'))
+        # an earlier transaction makes the index be built again
+        self.add(2, '-7.50')
+        self.assertTrue(index.stale)
+        self.assertEqual(account.balance(date(2013, 1, 2)), Decimal('92.50'))
+        self.assertFalse(index.stale)
+        # so does one added straight to the lists of the account
+        account._transactions['!Type:Bank'].append(qif.Transaction(
+            date=datetime(2013, 1, 1), amount=Decimal('1.00')))
+        self.assertEqual(account.balance(date(2013, 1, 1)), Decimal('101.00'))
+        copy = pickle.loads(pickle.dumps(account))
+        self.assertEqual(getattr(copy, '_balance_index', None), None)
+        self.assertEqual(copy.balance(), account.balance())
+        self.assertFalse('_balance_index' in qif.Account._slot_names)
+
 
 if __name__ == "__main__":
     import unittest
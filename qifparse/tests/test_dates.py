@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+from datetime import datetime
+from qifparse.dates import (
+    detect_date_format,
+    sample_dates,
+    compile_date_format,
+    DateParser,
+)
+from qifparse.parser import QifParser
+
+filename = os.path.join(os.path.dirname(__file__), 'win2008.qif')
+
+
+class TestDateParsing(unittest.TestCase):
+
+    def testCompiledFormatMatchesStrptime(self):
+        for date_format in ('%m/%d/%y', '%d/%m/%Y', '%Y-%m-%d', '%d.%m.%y'):
+            convert = compile_date_format(date_format)
+            for text in ('3/31/99', '12/ 1/02', '31/12/2002', '2013-10-23',
+                         '1.2.68', '1.2.69', '13/13/13', '2/30/03', '1/1'):
+                try:
+                    expected = datetime.strptime(text, date_format)
+                except ValueError:
+                    self.assertRaises(ValueError, convert, text)
+                else:
+                    self.assertEqual(convert(text), expected)
+
+    def testUnsupportedFormat(self):
+        self.assertEqual(compile_date_format('%b %d %Y'), None)
+        parser = DateParser('%b %d %Y')
+        self.assertEqual(parser.parse('Mar 31 1999'), datetime(1999, 3, 31))
+
+    def testY2KMarker(self):
+        parser = DateParser('%m/%d/%y')
+        self.assertEqual(parser.parse("12/31' 2"), datetime(2002, 12, 31))
+        self.assertEqual(parser.parse("1/15'03"), datetime(2003, 1, 15))
+
+    def testGuessedFormat(self):
+        parser = DateParser()
+        self.assertEqual(parser.parse("23/10/2013"), datetime(2013, 10, 23))
+        self.assertEqual(parser.parse(" 7/ 9/98"), datetime(1998, 9, 7))
+        self.assertEqual(parser.parse("10/10'01"), datetime(2001, 10, 10))
+        self.assertRaises(ValueError, parser.parse, "3/31/99")
+
+    def testDetectDateFormat(self):
+        detection = detect_date_format(['1/2/03', '3/31/03', '4/1/03'])
+        self.assertEqual(detection, ('%m/%d/%y', 1.0, 3))
+        detection = detect_date_format(['01.02.2003', '31.03.2003', 'x'])
+        self.assertEqual(detection, ('%d.%m.%Y', 1.0, 2))
+        detection = detect_date_format(['2003-02-01'])
+        self.assertEqual(detection.date_format, '%Y-%m-%d')
+        # no day above 12: the order keeping the dates sorted wins
+        detection = detect_date_format(['1/2/03', '1/9/03', '2/1/03'])
+        self.assertEqual(detection.date_format, '%m/%d/%y')
+        self.assertTrue(0.5 < detection.confidence < 1)
+        detection = detect_date_format(['1/2/03'])
+        self.assertEqual(detection, ('%d/%m/%y', 0.5, 1))
+        detection = detect_date_format(['1/2/03', '13/2/03', '2/14/03',
+                                        '2/15/03'])
+        self.assertEqual(detection.date_format, '%m/%d/%y')
+        self.assertAlmostEqual(detection.confidence, 2 / 3.0)
+        self.assertEqual(detect_date_format(['Checking', '']), None)
+
+    def testSampleDates(self):
+        text = ('!Type:Cat\r\nNAuto\r\nDCar expenses\r\nE\r\n^\r\n'
+                "!Type:Bank\r\nD12/31' 2\r\nT-1\r\n^\r\nD 1/ 2/03\r\n^")
+        self.assertEqual(sample_dates(text), ["12/31' 2", ' 1/ 2/03'])
+        self.assertEqual(sample_dates(text, 1), ["12/31' 2"])
+
+    def testDetectedParser(self):
+        parser = DateParser.detected(detect_date_format(['3/31/99']))
+        self.assertEqual(parser.date_format, None)
+        self.assertEqual(parser.parse("12/31' 2"), datetime(2002, 12, 31))
+        self.assertEqual(parser.parse(" 7/ 9/98"), datetime(1998, 7, 9))
+        # a date unlike the samples is guessed
+        self.assertEqual(parser.parse("23/10/2013"), datetime(2013, 10, 23))
+
+    def testDetectedCentury(self):
+        # a two-digit year is in the 1900s unless "'" comes before it,
+        # whatever the pivot of strptime
+        parser = DateParser.detected(detect_date_format(['3/31/99']))
+        self.assertEqual(parser.parse("12/31/68"), datetime(1968, 12, 31))
+        self.assertEqual(parser.parse("12/31/69"), datetime(1969, 12, 31))
+        self.assertEqual(parser.parse("12/31'68"), datetime(2068, 12, 31))
+        self.assertEqual(parser.parse("12/31'05"), datetime(2005, 12, 31))
+        # as the guesses without a format
+        guessed = DateParser()
+        self.assertEqual(guessed.parse("31/12/68"), datetime(1968, 12, 31))
+        self.assertEqual(guessed.parse("31/12'68"), datetime(2068, 12, 31))
+
+    def testParserDetection(self):
+        data = ('!Type:Bank\nD3/1/99\nT1\n^\nD3/2/99\nT2\n^\n'
+                'D4/1/99\nT3\n^\n')
+        qif = QifParser.parseData(data)
+        self.assertEqual(QifParser.date_parser.detection.date_format,
+                         '%m/%d/%y')
+        self.assertEqual([tr.date for tr in qif.get_transactions()[0]],
+                         [datetime(1999, 3, 1), datetime(1999, 3, 2),
+                          datetime(1999, 4, 1)])
+        QifParser.parseData(data, '%d/%m/%y')
+        self.assertEqual(QifParser.date_parser.detection, None)
+
+    def testCache(self):
+        parser = DateParser('%m/%d/%y', maxsize=2)
+        for text in ('1/1/01', '1/1/01', '1/2/01', '1/3/01', '1/1/01'):
+            parser.parse(text)
+        info = parser.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 4, 2))
+
+    def testParserCounters(self):
+        QifParser.parseFile(filename, '%m/%d/%y')
+        info = QifParser.date_parser.cache_info()
+        # the two transactions of 12/31/02 share a cache entry
+        self.assertEqual((info.hits, info.misses), (1, 3))
+
+
+if __name__ == "__main__":
+    import unittest
+    unittest.main()
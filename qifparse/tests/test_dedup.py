@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from qifparse import cache, dedup
+from qifparse.parser import QifParser
+from qifparse.qif import Account, Qif, Transaction
+
+filename = os.path.join(os.path.dirname(__file__), 'win2008.qif')
+date_format = '%m/%d/%y'
+
+COFFEE = '!Type:Bank\nD1/2/13\nT-5.00\nPCoffee\n^\n'
+LUNCH = '!Type:Bank\nD1/2/13\nT-12.00\nPLunch\n^\n'
+
+
+def count_transactions(qif_obj):
+    # memorized transactions are not deduplicated
+    return sum(1 for (_, _, transactions) in qif_obj._transaction_lists()
+               for item in transactions if item._dated)
+
+
+class TestDeduplication(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def writeFile(self, data, name='data.qif'):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as file_handle:
+            file_handle.write(data.encode('ascii'))
+        return path
+
+    def testParseTwice(self):
+        seen = dedup.Deduplicator()
+        parser = QifParser(date_format, dedup=seen)
+        first = parser.parseFile(filename)
+        self.assertEqual(seen.duplicates, 0)
+        self.assertEqual(count_transactions(first), 4)
+        second = parser.parseFile(filename)
+        self.assertEqual(count_transactions(second), 0)
+        self.assertEqual(len(second.get_accounts()), 3)
+        self.assertEqual(seen.duplicates, 4)
+        with open(filename) as file_handle:
+            entries = list(parser.iterparse(file_handle))
+        self.assertFalse(any(type(item) is Transaction
+                             for (item, _, _) in entries))
+        self.assertEqual(seen.duplicates, 8)
+        self.assertEqual(seen.suspects, [])
+
+    def testIdenticalTransactions(self):
+        # the same purchase twice in a day is kept, in any export
+        seen = dedup.Deduplicator()
+        parser = QifParser('%m/%d/%y', dedup=seen)
+        self.assertEqual(count_transactions(parser.parseData(
+            COFFEE + COFFEE[11:] + LUNCH[11:])), 3)
+        self.assertEqual(count_transactions(parser.parseData(
+            COFFEE + LUNCH[11:])), 0)
+        qif_obj = parser.parseData(COFFEE + COFFEE[11:] + COFFEE[11:])
+        self.assertEqual(count_transactions(qif_obj), 1)
+        self.assertEqual(seen.duplicates, 4)
+        qif_obj = QifParser.parseData(COFFEE + COFFEE[11:], '%m/%d/%y')
+        self.assertEqual(qif_obj.deduplicate().duplicates, 0)
+        self.assertEqual(count_transactions(qif_obj), 2)
+
+    def testMerge(self):
+        first = QifParser.parseFile(filename, date_format)
+        second = QifParser.parseFile(filename, date_format)
+        self.assertRaises(RuntimeError, first.merge, second)
+        seen = first.deduplicate()
+        first.merge(second, seen)
+        self.assertEqual(seen.duplicates, 4)
+        self.assertEqual(count_transactions(first), 4)
+        self.assertEqual(len(first.get_accounts()), 3)
+        # amounts are compared whatever their type
+        fixed = QifParser.parseFile(filename, date_format, fixed_point=True)
+        self.assertEqual(first.merge(fixed, seen), first)
+        self.assertEqual(count_transactions(first), 4)
+
+    def testNearDuplicates(self):
+        reported = []
+        seen = dedup.Deduplicator(
+            on_near_duplicate=lambda *args: reported.append(args))
+        sources = []
+        for payees in (['Shop'], ['Shop', 'SHOP #12', 'Shop']):
+            qif_obj = Qif()
+            account = Account(name='Bank')
+            qif_obj.add_account(account)
+            for payee in payees:
+                account.add_transaction(Transaction(
+                    date=datetime(2013, 1, 2), amount=Decimal('-10.00'),
+                    payee=payee, cleared='X'), '!Type:Bank')
+            sources.append(account)
+            qif_obj.deduplicate(seen)
+        self.assertEqual([tr.payee
+                          for tr in sources[1]._transactions['!Type:Bank']],
+                         ['SHOP #12', 'Shop'])
+        self.assertEqual(seen.duplicates, 1)
+        # the second Shop is new: the first source had a single one
+        self.assertEqual(reported, [])
+        qif_obj = Qif()
+        account = Account(name='Bank')
+        qif_obj.add_account(account)
+        account.add_transaction(Transaction(
+            date=datetime(2013, 1, 2), amount=Decimal('-10.0'),
+            payee='Shop #12', cleared=None), '!Type:Bank')
+        for _ in range(4):
+            account.add_transaction(Transaction(
+                date=datetime(2013, 1, 2), amount=Decimal('-10.00'),
+                payee='Shop'))
+        qif_obj.deduplicate(seen)
+        self.assertEqual(len(account._transactions['!Type:Bank']), 3)
+        # the Shops beyond the two of the second source are new, and
+        # match no other purchase of that day and amount
+        self.assertEqual([(name, tr.payee) for (name, _, tr) in reported],
+                         [('Bank', 'Shop #12')])
+        self.assertEqual(seen.suspects, reported)
+
+    def testBloomFilter(self):
+        keys = [dedup.fingerprint(Transaction(
+            date=datetime(2013, 1, 1), amount=Decimal(number)))
+            for number in range(2000)]
+        bloom = dedup.BloomFilter(1000, 0.01)
+        self.assertEqual(bloom.hashes, 7)
+        added = sum(bloom.add(key) for key in keys[:1000])
+        self.assertTrue(added > 980)
+        self.assertFalse(any(bloom.add(key) for key in keys[:1000]))
+        self.assertTrue(all(key in bloom for key in keys[:1000]))
+        false_positives = sum(key in bloom for key in keys[1000:])
+        self.assertTrue(false_positives < 30)
+        self.assertRaises(ValueError, dedup.BloomFilter, 0)
+        seen = dedup.Deduplicator.bounded(100)
+        parser = QifParser(date_format, dedup=seen)
+        parser.parseFile(filename)
+        self.assertEqual(count_transactions(parser.parseFile(filename)), 0)
+        qif_obj = parser.parseData(COFFEE + COFFEE[11:])
+        self.assertEqual(count_transactions(qif_obj), 2)
+
+    def testCache(self):
+        parse_cache = cache.ParseCache(os.path.join(self.tmpdir, 'cache'))
+        path = self.writeFile(COFFEE + COFFEE[11:] + LUNCH[11:])
+        seen = dedup.Deduplicator()
+        parser = QifParser(date_format, dedup=seen)
+        parser.parseData(COFFEE)
+        qif_obj = parser.parseFile(path, date_format, cache=parse_cache)
+        self.assertEqual(count_transactions(qif_obj), 2)
+        # the cache keeps the file as it is
+        qif_obj = QifParser().parseFile(path, date_format,
+                                        cache=parse_cache)
+        self.assertEqual(count_transactions(qif_obj), 3)
+        self.assertEqual(parse_cache.hits, 1)
+        # and the Deduplicator filters what it loads
+        qif_obj = parser.parseFile(path, date_format, cache=parse_cache)
+        self.assertEqual(count_transactions(qif_obj), 0)
+        self.assertEqual(parse_cache.hits, 2)
+
+    def testParseMany(self):
+        paths = [self.writeFile(COFFEE, 'first.qif'),
+                 self.writeFile(COFFEE + LUNCH[11:], 'second.qif')]
+        seen = dedup.Deduplicator()
+        results = list(QifParser.parse_many(paths, workers=2,
+                                            date_format='%m/%d/%y',
+                                            dedup=seen))
+        self.assertEqual([count_transactions(result.qif)
+                          for result in results], [1, 1])
+        self.assertEqual(seen.duplicates, 1)
+        (qif_obj, failures) = QifParser.parse_many(
+            paths, workers=2, merge=True, date_format='%m/%d/%y',
+            dedup=dedup.Deduplicator())
+        self.assertEqual(failures, [])
+        self.assertEqual(count_transactions(qif_obj), 2)
+
+    def testGrowingFile(self):
+        seen = dedup.Deduplicator()
+        parser = QifParser('%m/%d/%y', dedup=seen)
+        path = self.writeFile(COFFEE)
+        checkpoint = parser.parseFileIncremental(path)
+        # the same purchase again, later in the same file
+        path = self.writeFile(COFFEE + COFFEE[11:])
+        checkpoint = parser.parseFileIncremental(path,
+                                                 checkpoint=checkpoint)
+        self.assertEqual(count_transactions(checkpoint.qif), 2)
+        self.assertEqual(seen.duplicates, 0)
+
+    def testLazyQif(self):
+        with QifParser.parseFileLazy(filename, date_format) as qif_obj:
+            self.assertRaises(RuntimeError, dedup.Deduplicator().filter,
+                              qif_obj)
+
+
+if __name__ == "__main__":
+    unittest.main()
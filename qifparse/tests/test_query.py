@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import pickle
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from qifparse import qif
+
+
+class TestQueryQIF(unittest.TestCase):
+
+    def setUp(self):
+        self.qif_obj = qif.Qif()
+        self.bank = qif.Account(name='Bank')
+        self.qif_obj.add_account(self.bank)
+        self.card = qif.Account(name='Card')
+        self.qif_obj.add_account(self.card)
+        self.add(self.bank, 3, '-10.00', 'Grocery', 'Food:Groceries', 'X')
+        self.add(self.bank, 1, '-50.00', 'Garage', 'Auto:Service/Home')
+        self.add(self.card, 2, '-20.00', 'Grocery', 'Food', '*')
+        split = self.add(self.card, 5, '-30.00', 'Market', None)
+        split.splits.append(qif.AmountSplit(category='Auto:Gas',
+                                            amount=Decimal('-30.00')))
+        self.add(self.qif_obj, 4, '100.00', 'Employer', 'Salary')
+        memorized = qif.MemorizedTransaction(payee='Grocery', category='Food')
+        self.qif_obj.add_transaction(memorized, '!Type:Memorized')
+
+    def add(self, container, day, amount, payee, category, cleared=None):
+        tr = qif.Transaction(date=datetime(2013, 1, day),
+                             amount=Decimal(amount), payee=payee,
+                             category=category, cleared=cleared)
+        container.add_transaction(tr, '!Type:Bank')
+        return tr
+
+    def payees(self, **conditions):
+        return [(account, tr.payee)
+                for (account, header, tr) in self.qif_obj.query(**conditions)]
+
+    def testQuery(self):
+        # the memorized transaction is only a template
+        self.assertEqual(len(self.qif_obj.query()), 5)
+        self.assertEqual(self.payees(start=datetime(2013, 1, 2),
+                                     end=datetime(2013, 1, 4)),
+                         [('Card', 'Grocery'), ('Bank', 'Grocery'),
+                          (None, 'Employer')])
+        self.assertEqual(self.payees(category='Auto'),
+                         [('Bank', 'Garage'), ('Card', 'Market')])
+        self.assertEqual(self.payees(category='Food'),
+                         [('Card', 'Grocery'), ('Bank', 'Grocery')])
+        self.assertEqual(self.payees(category='Foo'), [])
+        self.assertEqual(self.payees(payee='Grocery', account='Bank'),
+                         [('Bank', 'Grocery')])
+        self.assertEqual(self.payees(cleared='*'), [('Card', 'Grocery')])
+        self.assertEqual(self.payees(min_amount=-30, max_amount=-20),
+                         [('Card', 'Grocery'), ('Card', 'Market')])
+        self.assertEqual(self.payees(start=datetime(2013, 1, 2).date(),
+                                     end=datetime(2013, 1, 3).date(),
+                                     category='Food'),
+                         [('Card', 'Grocery'), ('Bank', 'Grocery')])
+
+    def testExplain(self):
+        plan = self.qif_obj.explain(start=datetime(2013, 1, 5),
+                                    category='Food', cleared='X')
+        self.assertEqual(plan.index, 'date')
+        self.assertEqual([choice.rows for choice in plan.choices], [1, 2])
+        self.assertEqual(plan.checks, ['category', 'cleared'])
+        self.assertTrue(str(plan).startswith('use index date'))
+        plan = self.qif_obj.explain(cleared='X')
+        self.assertEqual(plan.index, None)
+        self.assertEqual(str(plan), 'scan all 5 transactions\ncheck cleared')
+
+    def testIndexUpdates(self):
+        self.assertEqual(len(self.qif_obj.query(payee='Grocery')), 2)
+        index = self.qif_obj._query_index
+        self.add(self.bank, 6, '-5.00', 'Grocery', 'Food')
+        self.assertEqual(self.payees(start=datetime(2013, 1, 6)),
+                         [('Bank', 'Grocery')])
+        self.assertEqual(len(self.qif_obj.query(payee='Grocery')), 3)
+        self.assertTrue(self.qif_obj._query_index is index)
+        self.assertEqual(len(index.rows), 6)
+        # an account replaced by a merge is indexed again
+        other = qif.Qif()
+        auto_switch = qif.Account(name='Savings')
+        auto_switch.is_auto_switch = True
+        self.qif_obj.add_account(auto_switch)
+        self.add(self.qif_obj, 7, '1.00', 'Bank', None)
+        savings = qif.Account(name='Savings')
+        savings.is_auto_switch = False
+        self.add(savings, 8, '2.00', 'Interest', None)
+        other.add_account(savings)
+        self.qif_obj.merge(other)
+        self.assertEqual(self.payees(account='Savings'),
+                         [('Savings', 'Interest')])
+        copy = pickle.loads(pickle.dumps(self.qif_obj))
+        self.assertEqual(copy._query_index, None)
+        self.assertEqual(len(copy.query()), 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
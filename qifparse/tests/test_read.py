@@ -1,9 +1,23 @@
 # -*- coding: utf-8 -*-
+import gc
 import unittest
 import os
+import pickle
+import shutil
+import six
+import sys
+import tempfile
+import weakref
 from datetime import datetime
 from decimal import Decimal
-from qifparse.parser import QifParser
+from qifparse import cache, files, lazy, parallel, push, snapshot, stats
+from qifparse.parser import QifParser, QifParserException
+from qifparse.qif import Account, Category, MemorizedTransaction, Tag
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
 
 filename = os.path.join(os.path.dirname(__file__), 'win2008.qif')
 date_format = '%m/%d/%y'
@@ -315,6 +329,714 @@ class TestQIFParsing(unittest.TestCase):
         self.assertEqual(memorized[5].cleared, None)
 
 
+class TestQIFIterParsing(unittest.TestCase):
+
+    def testIterparseMatchesParseFile(self):
+        qif = QifParser.parseFile(filename, date_format)
+        # A tiny block size makes most records straddle two blocks
+        records = list(QifParser.iterparse(open(filename), date_format,
+                                           block_size=7))
+
+        tags = [r for r in records if isinstance(r[0], Tag)]
+        categories = [r for r in records if isinstance(r[0], Category)]
+        accounts = [r for r in records if isinstance(r[0], Account)]
+        memorized = [r for r in records
+                     if isinstance(r[0], MemorizedTransaction)]
+        self.assertEqual(len(tags), 1)
+        self.assertEqual(tags[0][1], '!Type:Tag')
+        self.assertEqual(len(categories), len(qif.get_categories()))
+        self.assertEqual(len(memorized), 6)
+        self.assertTrue(all(r[1] == '!Type:Memorized' and r[2] is None
+                            for r in memorized))
+        # auto-switch accounts are not merged while streaming
+        self.assertEqual([r[0].name for r in accounts],
+                         ['My Bank', 'Credit Card', 'Fancy Car',
+                          'My Bank', 'Credit Card', 'Fancy Car'])
+
+        bank = [r for r in records if r[1] == '!Type:Bank']
+        self.assertEqual(len(bank), 3)
+        self.assertTrue(all(r[2] is accounts[3][0] for r in bank))
+        expected = get_account(qif, 'My Bank')._transactions['!Type:Bank']
+        self.assertEqual([str(r[0]) for r in bank],
+                         [str(tr) for tr in expected])
+
+    def testIterparseEmptyFile(self):
+        records = QifParser.iterparse(six.StringIO())
+        self.assertRaises(QifParserException, list, records)
+
+    def testTokenize(self):
+        tokens = QifParser.tokenize('!Type:Bank\nD3/31/99\n\nT-45.00\n')
+        self.assertEqual(tokens, [('!', 'Type:Bank'), ('D', '3/31/99'),
+                                  ('T', '-45.00')])
+        # the lines are the ones of splitlines
+        chunk = u'PA\r\nMB\rMC\x0cT1\x1dT2 T3\n\n'
+        self.assertEqual(QifParser.tokenize(chunk),
+                         [(line[0], line[1:])
+                          for line in chunk.splitlines() if line])
+
+
+def dump_qif(qif_obj):
+    """Describe a Qif object with plain values, to compare two of them."""
+    res = []
+    for acc in qif_obj.get_accounts():
+        res.append((acc.name, acc.account_type, acc.description,
+                    acc.credit_limit, acc.balance_amount, acc.balance_date,
+                    acc.is_auto_switch))
+        for header, transactions in acc._transactions.items():
+            res.append((header, [str(tr) for tr in transactions]))
+    for header, transactions in qif_obj._transactions.items():
+        res.append((header, [str(tr) for tr in transactions]))
+    for entry in (qif_obj.get_categories() + qif_obj.get_classes() +
+                  qif_obj.get_tags()):
+        res.append(str(entry))
+    return res
+
+
+def describe_entries(entries):
+    """Describe the tuples yielded by iterparse, to compare them."""
+    return [(item.name if isinstance(item, Account) else str(item), header,
+             account.name if account is not None else None)
+            for (item, header, account) in entries]
+
+
+class StreamLines(object):
+    """An asynchronous iterable of the lines of an asyncio.StreamReader."""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __aiter__(self):
+        return self.reader.__aiter__()
+
+
+class TestQIFPushParsing(unittest.TestCase):
+
+    def setUp(self):
+        with open(filename, 'rb') as file_handle:
+            self.data = file_handle.read()
+        with open(filename) as file_handle:
+            self.expected = describe_entries(
+                QifParser.iterparse(file_handle, date_format))
+
+    def testFeed(self):
+        for size in (1, 3, 64, len(self.data)):
+            parser = push.PushParser(date_format)
+            entries = []
+            for start in range(0, len(self.data), size):
+                entries.extend(parser.feed(self.data[start:start + size]))
+            # the file ends with a separator: no record waits for close
+            self.assertEqual(len(entries), len(self.expected))
+            entries.extend(parser.close())
+            self.assertEqual(describe_entries(entries), self.expected)
+            self.assertEqual(parser.close(), [])
+            self.assertRaises(RuntimeError, parser.feed, b'D1/2/03')
+
+        # a character split across two pieces
+        parser = push.PushParser(date_format, encoding='utf-8')
+        data = u'!Type:Cat\nNcaf\xe9\nE\n^\n'.encode('utf-8')
+        self.assertEqual(parser.feed(data[:14]), [])
+        entries = parser.feed(data[14:]) + parser.close()
+        self.assertEqual([item.name for (item, _, _) in entries],
+                         [u'caf\xe9'])
+
+    def testDetectedDates(self):
+        # the records wait for the layout of the dates to be detected,
+        # which the first date whose day is above 12 tells
+        path = os.path.join(os.path.dirname(__file__), 'file.qif')
+        with open(path) as file_handle:
+            expected = describe_entries(QifParser.iterparse(file_handle))
+        with open(path, 'rb') as file_handle:
+            data = file_handle.read()
+        parser = push.PushParser()
+        self.assertEqual(parser.feed(data[:100]), [])
+        entries = parser.feed(data[100:200])
+        self.assertEqual(len(entries), 6)
+        for start in range(200, len(data), 100):
+            entries.extend(parser.feed(data[start:start + 100]))
+        entries.extend(parser.close())
+        self.assertEqual(describe_entries(entries), expected)
+        self.assertEqual(parser.parser.date_parser.detection.date_format,
+                         '%d/%m/%Y')
+
+        # ambiguous dates wait for hold_dates of them
+        parser = push.PushParser(hold_dates=2)
+        self.assertEqual(parser.feed(b'!Type:Bank\nD1/2/03\nT1\n^\n'), [])
+        entries = parser.feed(b'D1/3/03\nT2\n^\nD1/4/03')
+        self.assertEqual([item.date for (item, _, _) in entries],
+                         [datetime(1903, 2, 1), datetime(1903, 3, 1)])
+        self.assertEqual(len(parser.close()), 1)
+
+    def testEmptyData(self):
+        parser = push.PushParser()
+        self.assertEqual(parser.feed(b''), [])
+        self.assertRaises(QifParserException, parser.close)
+
+    @unittest.skipIf(sys.version_info < (3, 6),
+                     "asynchronous generators are not available")
+    def testAsyncIterparse(self):
+        import asyncio
+        from qifparse import aio
+        loop = asyncio.new_event_loop()
+        try:
+            for source in ('reader', 'lines'):
+                reader = asyncio.StreamReader(loop=loop)
+                reader.feed_data(self.data)
+                reader.feed_eof()
+                if source == 'lines':
+                    reader = StreamLines(reader)
+                records = aio.iterparse(reader, date_format, block_size=10)
+                entries = []
+                while True:
+                    try:
+                        entries.append(
+                            loop.run_until_complete(records.__anext__()))
+                    except StopAsyncIteration:
+                        break
+                self.assertEqual(describe_entries(entries), self.expected)
+        finally:
+            loop.close()
+
+
+
+class TempFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def writeFile(self, data):
+        path = os.path.join(self.tmpdir, 'data.qif')
+        with open(path, 'wb') as file_handle:
+            file_handle.write(data)
+        return path
+
+
+class TestQIFParseStats(unittest.TestCase):
+
+    def testCounts(self):
+        parse_stats = stats.ParseStats()
+        qif = QifParser.parseFile(filename, date_format, stats=parse_stats)
+        self.assertEqual(parse_stats.records['category'],
+                         len(qif.get_categories()))
+        self.assertEqual(parse_stats.records['transaction'],
+                         sum(len(transactions) for acc in qif.get_accounts()
+                             for transactions in acc._transactions.values()))
+        self.assertEqual(parse_stats.fields[('transaction', 'D')],
+                         parse_stats.records['transaction'])
+        self.assertEqual(parse_stats.bytes, os.path.getsize(filename))
+        self.assertEqual(sorted(parse_stats.phases), sorted(stats.PHASES))
+        self.assertTrue(all(seconds >= 0
+                            for seconds in parse_stats.phases.values()))
+        self.assertTrue(parse_stats.phases['dates'] > 0)
+        self.assertFalse(parse_stats.unknown_lines)
+        # a parse without stats does not keep the previous ones
+        QifParser.parseFile(filename, date_format)
+        self.assertEqual(QifParser.stats, None)
+
+    def testHooks(self):
+        data = ('!Type:Bank\nD1/2/03\nT1.00\nWwhat\n^\n'
+                'D1/3/03\nT2.00\nWwhat\n^\n')
+        unknown = []
+        slow = []
+        parse_stats = stats.ParseStats(
+            on_unknown_line=lambda kind, line: unknown.append((kind, line)),
+            on_slow_record=lambda kind, chunk, seconds: slow.append(kind),
+            slow_record_threshold=0)
+        stdout = six.StringIO()
+        saved = sys.stdout
+        sys.stdout = stdout
+        try:
+            QifParser.parseData(data, date_format, stats=parse_stats)
+            QifParser.parseData(data, date_format)
+        finally:
+            sys.stdout = saved
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertEqual(unknown, [('transaction', 'Wwhat')] * 2)
+        self.assertEqual(parse_stats.unknown_lines,
+                         {('transaction', 'Wwhat'): 2})
+        self.assertEqual(slow, ['transaction'] * 2)
+        self.assertEqual(parse_stats.as_dict()['records'],
+                         {'transaction': 2})
+
+
+class TestQIFFileReading(TempFileTestCase):
+
+    def testNewlines(self):
+        with open(filename, 'rb') as file_handle:
+            data = file_handle.read().replace(b'\r\n', b'\n')
+        expected = dump_qif(QifParser.parseData(data.decode('ascii'),
+                                                date_format))
+        for newline in (b'\n', b'\r\n', b'\r'):
+            path = self.writeFile(data.replace(b'\n', newline))
+            qif = QifParser.parseFile(path, date_format)
+            self.assertEqual(dump_qif(qif), expected)
+            text = data.replace(b'\n', newline).decode('ascii')
+            qif = QifParser.parseData(text, date_format)
+            self.assertEqual(dump_qif(qif), expected)
+
+    def testIterRecords(self):
+        # whatever the blocks, the records are the ones of the whole text,
+        # even when a separator or a Windows newline straddles two blocks
+        text = 'Nfood\r\nE\r\n^\r\nNcar\rE\r^\r\n^\nNhome\r\n^\r\n'
+        expected = files.split_records(text)
+        self.assertEqual(expected, ['Nfood\r\nE', 'Ncar\rE', '^\nNhome', ''])
+        for cut in range(len(text) + 1):
+            for other in range(cut, len(text) + 1):
+                blocks = [text[:cut], text[cut:other], text[other:]]
+                self.assertEqual(list(QifParser.iterRecords(blocks)),
+                                 expected)
+
+    def testEncoding(self):
+        data = six.u('!Type:Bank\nD01/02/2003\nT-1.00\nPCaf\xe9 \u20ac\n^\n')
+        path = self.writeFile(data.encode('cp1252'))
+        qif = QifParser.parseFile(path, '%m/%d/%Y')
+        self.assertEqual(qif.get_transactions()[0][0].payee,
+                         six.u('Caf\xe9 \u20ac'))
+        path = self.writeFile(data.encode('utf-8'))
+        qif = QifParser.parseFile(path, '%m/%d/%Y', encoding='utf-8')
+        self.assertEqual(qif.get_transactions()[0][0].payee,
+                         six.u('Caf\xe9 \u20ac'))
+        # characters straddling two blocks are decoded whole
+        blocks = list(files.map_blocks(data.encode('utf-8'), 'utf-8', 3))
+        self.assertEqual(''.join(blocks), data)
+
+    def testEmptyFile(self):
+        path = self.writeFile(b'')
+        self.assertRaises(QifParserException, QifParser.parseFile, path)
+
+
+class TestQIFLazyParsing(TempFileTestCase):
+
+    def testLazyMatchesParseFile(self):
+        tests_dir = os.path.dirname(__file__)
+        for (name, fmt) in (('win2008.qif', date_format),
+                            ('file.qif', None),
+                            ('transactions_only.qif', None)):
+            path = os.path.join(tests_dir, name)
+            expected = dump_qif(QifParser.parseFile(path, fmt))
+            with QifParser.parseFileLazy(path, fmt, max_records=2) as qif:
+                self.assertEqual(dump_qif(qif), expected)
+                self.assertTrue(qif.cache_info().currsize <= 2)
+
+    def testParseOnDemand(self):
+        qif = QifParser.parseFileLazy(filename, date_format)
+        self.assertEqual(qif.cache_info().misses, 0)
+        bank = get_account(qif, 'My Bank')
+        transactions = bank._transactions['!Type:Bank']
+        self.assertEqual(len(transactions), 3)
+        self.assertEqual(qif.cache_info().misses, 0)
+        self.assertEqual(transactions[-1].amount, Decimal('-45.00'))
+        self.assertTrue(transactions[-1] is transactions[2])
+        self.assertEqual(qif.cache_info()[:2], (2, 1))
+        qif.close()
+
+    def testIterTransactions(self):
+        expected = QifParser.parseFile(filename, date_format)
+        start = datetime(1999, 3, 31)
+        end = datetime(1999, 12, 31)
+        rows = [(name, header, str(tr)) for acc in expected.get_accounts()
+                for (name, header, tr) in acc._rows()
+                if start <= tr.date <= end]
+        self.assertTrue(rows)
+        qif = QifParser.parseFileLazy(filename, date_format)
+        result = [(name, header, str(tr)) for (name, header, tr) in
+                  qif.iter_transactions(start, end)]
+        self.assertEqual(result, rows)
+        # only the transactions in the range are parsed
+        qif.cache_clear()
+        result = list(qif.iter_transactions(start, end, name='My Bank'))
+        self.assertEqual([row[0] for row in result],
+                         ['My Bank'] * len(result))
+        self.assertEqual(qif.cache_info().misses, len(result))
+        self.assertTrue(len(result) <
+                        len(get_account(qif, 'My Bank')._rows()))
+        qif.close()
+
+    def testSavedIndex(self):
+        with open(filename, 'rb') as file_handle:
+            path = self.writeFile(file_handle.read())
+        qif = QifParser.parseFileLazy(path, date_format, save_index=True)
+        self.assertTrue(os.path.exists(path + lazy.INDEX_SUFFIX))
+        index = lazy.load_index(path, date_format)
+        self.assertEqual(list(index.starts), list(qif.index.starts))
+        self.assertEqual(list(index.dates), list(qif.index.dates))
+        self.assertEqual(index.header_names, qif.index.header_names)
+        qif.close()
+        # the index depends on the date format, and on the file
+        self.assertEqual(lazy.load_index(path, '%d/%m/%y'), None)
+        with open(path, 'ab') as file_handle:
+            file_handle.write(b'!Type:Cat\r\nNfood\r\n^\r\n')
+        self.assertEqual(lazy.load_index(path, date_format), None)
+        qif = QifParser.parseFileLazy(path, date_format)
+        self.assertEqual(len(qif.get_categories('food')), 1)
+        qif.close()
+
+    def testLazyEmptyFile(self):
+        path = self.writeFile(b'')
+        self.assertRaises(QifParserException, QifParser.parseFileLazy, path)
+
+
+class TestQIFIncrementalParsing(TempFileTestCase):
+
+    def testGrowingFile(self):
+        with open(filename, 'rb') as file_handle:
+            data = file_handle.read()
+        expected = dump_qif(QifParser.parseFile(filename, date_format))
+        # cut anywhere, even inside a record or a Windows newline
+        for step in (1, 7, 100, 500):
+            path = self.writeFile(b'')
+            checkpoint = QifParser.parseFileIncremental(path, date_format)
+            qif = checkpoint.qif
+            for cut in list(range(step, len(data), step)) + [len(data)]:
+                self.writeFile(data[:cut])
+                checkpoint = QifParser.parseFileIncremental(
+                    path, date_format, checkpoint=checkpoint)
+                self.assertTrue(checkpoint.qif is qif)
+                self.assertTrue(checkpoint.offset <= cut)
+            self.assertEqual(checkpoint.offset, len(data))
+            self.assertEqual(dump_qif(qif), expected)
+
+    def testIncompleteRecord(self):
+        path = self.writeFile(b'!Type:Cat\r\nNfood\r\n^\r\nNcars\r\n^\r')
+        checkpoint = QifParser.parseFileIncremental(path)
+        self.assertEqual([cat.name for cat in checkpoint.qif.get_categories()],
+                         ['food'])
+        self.assertEqual(checkpoint.offset, 21)
+        self.assertEqual(checkpoint.last_type, 'category')
+        with open(path, 'ab') as file_handle:
+            file_handle.write(b'\n')
+        checkpoint = QifParser.parseFileIncremental(path,
+                                                    checkpoint=checkpoint)
+        self.assertEqual([cat.name for cat in checkpoint.qif.get_categories()],
+                         ['food', 'cars'])
+        self.assertEqual(checkpoint.offset, 31)
+
+    def testRewrittenFile(self):
+        path = self.writeFile(b'!Type:Cat\nNfood\n^\nNcars\n^\n')
+        checkpoint = QifParser.parseFileIncremental(path)
+        qif = checkpoint.qif
+        # truncated
+        self.writeFile(b'!Type:Cat\nNfood\n^\n')
+        checkpoint = QifParser.parseFileIncremental(path,
+                                                    checkpoint=checkpoint)
+        self.assertFalse(checkpoint.qif is qif)
+        self.assertEqual(len(checkpoint.qif.get_categories()), 1)
+        # rewritten, and longer
+        qif = checkpoint.qif
+        self.writeFile(b'!Type:Cat\nNhome\n^\nNcars\n^\n')
+        checkpoint = QifParser.parseFileIncremental(path,
+                                                    checkpoint=checkpoint)
+        self.assertFalse(checkpoint.qif is qif)
+        self.assertEqual([cat.name for cat in checkpoint.qif.get_categories()],
+                         ['home', 'cars'])
+        # other options
+        qif = checkpoint.qif
+        checkpoint = QifParser.parseFileIncremental(path, fixed_point=True,
+                                                    checkpoint=checkpoint)
+        self.assertFalse(checkpoint.qif is qif)
+        self.assertEqual(len(checkpoint.qif.get_categories()), 2)
+
+    def testResumeChecks(self):
+        names = [b'cat%d' % index for index in range(30000)]
+        data = b'!Type:Cat\n' + b''.join(b'N' + name + b'\n^\n'
+                                         for name in names)
+        path = self.writeFile(data)
+        checkpoint = QifParser.parseFileIncremental(path)
+        # the hasher is not pickled: the whole digest is checked instead
+        checkpoint = pickle.loads(pickle.dumps(checkpoint))
+        self.assertEqual(checkpoint.hasher, None)
+        qif = checkpoint.qif
+        with open(path, 'ab') as file_handle:
+            file_handle.write(b'Nfood\n^\n')
+        checkpoint = QifParser.parseFileIncremental(path,
+                                                    checkpoint=checkpoint)
+        self.assertTrue(checkpoint.qif is qif)
+        self.assertEqual(len(qif.get_categories()), len(names) + 1)
+        # so it is for another file, whose ends are the same
+        middle = data.index(b'Ncat15000\n')
+        other = os.path.join(self.tmpdir, 'other.qif')
+        with open(other, 'wb') as file_handle:
+            file_handle.write(data[:middle] + b'Nhome0000' +
+                              data[middle + 9:] + b'Nfood\n^\n')
+        os.rename(other, path)
+        checkpoint = QifParser.parseFileIncremental(path,
+                                                    checkpoint=checkpoint)
+        self.assertFalse(checkpoint.qif is qif)
+        self.assertEqual(len(checkpoint.qif.get_categories('home0000')), 1)
+
+
+class TestQIFParseCache(TempFileTestCase):
+
+    def testSnapshot(self):
+        tests_dir = os.path.dirname(__file__)
+        for (name, fmt, fixed_point) in (('win2008.qif', date_format, None),
+                                         ('file.qif', None, None),
+                                         ('file.qif', None, True),
+                                         ('usw.qif', '%m/%d/%Y', None),
+                                         ('transactions_only.qif', None,
+                                          None)):
+            path = os.path.join(tests_dir, name)
+            expected = QifParser.parseFile(path, fmt, fixed_point)
+            qif = snapshot.loads(snapshot.dumps(expected))
+            self.assertEqual(dump_qif(qif), dump_qif(expected))
+            self.assertEqual(
+                [acc.name for acc in qif.get_accounts(atype='Bank')],
+                [acc.name for acc in expected.get_accounts(atype='Bank')])
+        qif = snapshot.loads(snapshot.dumps(
+            QifParser.parseFile(os.path.join(tests_dir, 'file.qif'))))
+        self.assertEqual(len(qif.get_categories('food')), 1)
+        splits = qif.get_accounts('My Cash')[0]._transactions[
+            '!Type:Cash'][2].splits
+        self.assertEqual(len(splits), 2)
+
+    def testCacheHit(self):
+        with open(filename, 'rb') as file_handle:
+            path = self.writeFile(file_handle.read())
+        parse_cache = cache.ParseCache(os.path.join(self.tmpdir, 'cache'))
+        expected = dump_qif(QifParser.parseFile(path, date_format))
+        qif = QifParser.parseFile(path, date_format, cache=parse_cache)
+        self.assertEqual(dump_qif(qif), expected)
+        self.assertEqual((parse_cache.hits, parse_cache.misses,
+                          parse_cache.stores), (0, 1, 1))
+        qif = QifParser.parseFile(path, date_format, cache=parse_cache)
+        self.assertTrue(QifParser.qif_obj is qif)
+        self.assertEqual(dump_qif(qif), expected)
+        self.assertEqual(parse_cache.cache_info()[:2], (1, 1))
+        self.assertTrue(parse_cache.cache_info().currsize > 0)
+        # other options are other entries
+        QifParser.parseFile(path, date_format, fixed_point=True,
+                            cache=parse_cache)
+        self.assertEqual(parse_cache.cache_info()[:2], (1, 2))
+        parse_cache.cache_clear()
+        self.assertEqual(parse_cache.cache_info()[:],
+                         (0, 0, cache.DEFAULT_MAX_SIZE, 0))
+
+    def testCacheInvalidation(self):
+        path = self.writeFile(b'!Type:Cat\nNfood\n^\n')
+        parse_cache = cache.ParseCache(os.path.join(self.tmpdir, 'cache'))
+        QifParser.parseFile(path, cache=parse_cache)
+        stat = os.stat(path)
+        # same size and modification time, other content
+        self.writeFile(b'!Type:Cat\nNcars\n^\n')
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+        qif = QifParser.parseFile(path, cache=parse_cache)
+        self.assertEqual(qif.get_categories()[0].name, 'cars')
+        self.assertEqual(parse_cache.misses, 2)
+        self.writeFile(b'!Type:Cat\nNfood\n^\n')
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+        unchecked = cache.ParseCache(parse_cache.directory,
+                                     check_content=False)
+        qif = QifParser.parseFile(path, cache=unchecked)
+        self.assertEqual(qif.get_categories()[0].name, 'cars')
+        self.assertEqual(unchecked.hits, 1)
+        # snapshots of other versions are not used
+        version = cache.CACHE_VERSION
+        cache.CACHE_VERSION = version + 1
+        try:
+            qif = QifParser.parseFile(path, cache=parse_cache)
+        finally:
+            cache.CACHE_VERSION = version
+        self.assertEqual(qif.get_categories()[0].name, 'food')
+        self.assertEqual(parse_cache.hits, 0)
+
+    def testCacheEviction(self):
+        parse_cache = cache.ParseCache(os.path.join(self.tmpdir, 'cache'))
+        paths = []
+        for name in ('food', 'cars', 'home'):
+            path = os.path.join(self.tmpdir, name + '.qif')
+            with open(path, 'wb') as file_handle:
+                file_handle.write(b'!Type:Cat\nN' + name.encode('ascii') +
+                                  b'\n^\n')
+            paths.append(path)
+        QifParser.parseFile(paths[0], cache=parse_cache)
+        size = parse_cache.cache_info().currsize
+        parse_cache.max_size = 2 * size + size // 2
+        QifParser.parseFile(paths[1], cache=parse_cache)
+        # the first snapshot is used, so the second one goes first
+        os.utime(parse_cache.entry_path(paths[1], cache.parse_options(
+            encoding=files.DEFAULT_ENCODING)), (0, 0))
+        QifParser.parseFile(paths[0], cache=parse_cache)
+        QifParser.parseFile(paths[2], cache=parse_cache)
+        self.assertEqual(parse_cache.evictions, 1)
+        self.assertEqual(parse_cache.cache_info().currsize, 2 * size)
+        QifParser.parseFile(paths[0], cache=parse_cache)
+        QifParser.parseFile(paths[1], cache=parse_cache)
+        self.assertEqual((parse_cache.hits, parse_cache.misses), (2, 4))
+
+
+class TestQIFParallelParsing(TempFileTestCase):
+
+    def testParallelMatchesParseFile(self):
+        tests_dir = os.path.dirname(__file__)
+        for (name, fmt) in (('win2008.qif', date_format),
+                            ('file.qif', None),
+                            ('transactions_only.qif', None)):
+            path = os.path.join(tests_dir, name)
+            expected = dump_qif(QifParser.parseFile(path, fmt))
+            auto_switches = QifParser.auto_switches
+            for workers in (2, 3):
+                qif = QifParser.parseFile(path, fmt, workers=workers)
+                self.assertEqual(dump_qif(qif), expected)
+                self.assertEqual(QifParser.auto_switches, auto_switches)
+
+    def testScanRanges(self):
+        # Windows and old Mac newlines, and a caret alone on a line right
+        # after a separator, which starts a record instead of ending one
+        data = (b'!Type:Cat\r\nNfood\r\nE\r\n^\r\nNcar\rE\r^\r'
+                b'!Option:AutoSwitch\n!Account\nNMy Bank\nTBank\n^\n'
+                b'!Type:Bank\nD01/02/03\nT-1.00\n^\n^\nD01/03/03\nT-3\n^\n'
+                b'D01/04/03\nT-2.00\n^\n')
+        QifParser.configure()
+        ranges = parallel.scan_ranges(QifParser, data, len(data))
+        self.assertEqual(QifParser.auto_switches, 1)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(data))
+        chunks = []
+        for (start, end, context) in ranges:
+            self.assertTrue(start < end)
+            chunks.extend(chunk for chunk in
+                          files.split_records(data[start:end].decode('ascii'))
+                          if chunk)
+        text = data.decode('ascii')
+        self.assertEqual(chunks, [chunk for chunk in
+                                  files.split_records(text) if chunk])
+        contexts = [context for (start, end, context) in ranges]
+        self.assertEqual(contexts[0], (None, None, 0))
+        self.assertEqual(contexts[-1], ('transaction', '!Type:Bank', 1))
+
+        path = self.writeFile(data)
+        expected = dump_qif(QifParser.parseData(text, '%m/%d/%y'))
+        qif = QifParser.parseFile(path, '%m/%d/%y', workers=2)
+        self.assertEqual(dump_qif(qif), expected)
+
+    def testParallelErrors(self):
+        path = self.writeFile(b'')
+        self.assertRaises(QifParserException, QifParser.parseFile, path,
+                          workers=2)
+        path = self.writeFile(b'!Type:Bank\nD01/02/03\nT-1.00\n^\n'
+                              b'!Type:Unknown\nD01/02/03\n^\n')
+        self.assertRaises(QifParserException, QifParser.parseFile, path,
+                          workers=2)
+
+    def testParseMany(self):
+        path = os.path.join(self.tmpdir, 'empty.qif')
+        open(path, 'w').close()
+        paths = [filename, path, filename]
+        results = list(QifParser.parse_many(paths, workers=2,
+                                            date_format=date_format))
+        self.assertEqual([result.path for result in results], paths)
+        self.assertEqual(dump_qif(results[0].qif),
+                         dump_qif(QifParser.parseFile(filename, date_format)))
+        self.assertEqual(results[1].qif, None)
+        self.assertTrue(isinstance(results[1].error, QifParserException))
+        self.assertEqual(results[2].error, None)
+
+        results = QifParser.parse_many(paths, workers=2, ordered=False,
+                                       date_format=date_format)
+        self.assertEqual(sorted(result.path for result in results),
+                         sorted(paths))
+
+    def testParseManyMerge(self):
+        paths = []
+        for (name, data) in (
+                ('switch.qif', '!Option:AutoSwitch\n!Account\nNMy Bank\n'
+                               'TBank\nDChecking\n^\n!Clear:AutoSwitch\n'
+                               '!Account\nNSavings\nTBank\n^\n'),
+                ('bank.qif', '!Account\nNMy Bank\nTBank\n^\n'
+                             '!Type:Bank\nD01/02/03\nT-1.00\n^\n'),
+                ('again.qif', '!Account\nNSavings\nTBank\n^\n'
+                              '!Type:Cat\nNfood\nE\n^\n')):
+            paths.append(os.path.join(self.tmpdir, name))
+            with open(paths[-1], 'w') as file_handle:
+                file_handle.write(data)
+        (qif, failures) = QifParser.parse_many(paths, workers=2, merge=True,
+                                               date_format=date_format)
+        self.assertEqual(len(qif.get_accounts()), 2)
+        bank = qif.get_accounts('My Bank')[0]
+        self.assertEqual(bank.description, 'Checking')
+        self.assertEqual(len(bank._transactions['!Type:Bank']), 1)
+        # the last file can't be merged, and nothing of it is
+        self.assertEqual([failure.path for failure in failures], paths[2:])
+        self.assertTrue(isinstance(failures[0].error, RuntimeError))
+        self.assertFalse(qif.get_categories())
+
+
+class TestQIFParserInstances(unittest.TestCase):
+
+    def testInstanceOptions(self):
+        expected = dump_qif(QifParser.parseFile(filename, date_format))
+        parser = QifParser(date_format, fixed_point=True)
+        qif = parser.parseFile(filename)
+        self.assertEqual(parser.date_format, date_format)
+        self.assertEqual(parser.qif_obj, qif)
+        self.assertEqual(dump_qif(QifParser(date_format).parseFile(filename)),
+                         expected)
+        # the options given to a parse win over the ones of the instance
+        qif = parser.parseFile(filename, fixed_point=False)
+        self.assertEqual(dump_qif(qif), expected)
+        # and the parses of an instance leave the class alone
+        QifParser.parseFile(filename, date_format, fixed_point=True)
+        parser = QifParser(date_format)
+        with open(filename) as file_handle:
+            parser.parseFileHandle(file_handle)
+        self.assertEqual(QifParser.fixed_point, True)
+        self.assertEqual(parser.fixed_point, None)
+
+    def testOverriddenMethods(self):
+        payees = []
+
+        class PayeeParser(QifParser):
+            def buildTransaction(self, tokens):
+                transaction = super(PayeeParser, self).buildTransaction(
+                    tokens)
+                payees.append(transaction.payee)
+                return transaction
+
+        parser = PayeeParser(date_format)
+        parser.parseFile(filename)
+        parser.parseFile(filename)
+        self.assertEqual(len(payees), 8)
+
+    def testNoCycles(self):
+        # parsers are freed without waiting for the garbage collector
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            parser = QifParser(date_format)
+            qif = weakref.ref(parser.parseFile(filename))
+            parser = weakref.ref(parser)
+            self.assertEqual((parser(), qif()), (None, None))
+        finally:
+            if enabled:
+                gc.enable()
+
+    @unittest.skipIf(ThreadPoolExecutor is None,
+                     "concurrent.futures is not available")
+    def testConcurrentInstances(self):
+        tests_dir = os.path.dirname(__file__)
+        tasks = []
+        for (name, fmt, fixed_point) in (('win2008.qif', date_format, None),
+                                         ('usw.qif', '%m/%d/%Y', True),
+                                         ('file.qif', None, None),
+                                         ('transactions_only.qif', None,
+                                          True)):
+            path = os.path.join(tests_dir, name)
+            expected = dump_qif(QifParser(fmt, fixed_point).parseFile(path))
+            tasks.extend([(path, fmt, fixed_point, expected)] * 8)
+
+        def parse(task):
+            (path, fmt, fixed_point, expected) = task
+            parser = QifParser(fmt, fixed_point)
+            return dump_qif(parser.parseFile(path)) == expected
+
+        executor = ThreadPoolExecutor(max_workers=4)
+        try:
+            self.assertTrue(all(executor.map(parse, tasks)))
+        finally:
+            executor.shutdown()
+
 if __name__ == "__main__":
     import unittest
     unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import os
+import unittest
+from datetime import date, datetime
+from decimal import Decimal
+from qifparse import qif
+from qifparse.columns import numpy
+from qifparse.parser import QifParser
+
+filename = os.path.join(os.path.dirname(__file__), 'file.qif')
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestRollups(unittest.TestCase):
+
+    def setUp(self):
+        self.qif = QifParser.parseFile(filename, '%d/%m/%Y',
+                                       fixed_point=True)
+
+    def testRollup(self):
+        rollup = self.qif.rollup()
+        self.assertEqual(rollup.keys, ('account', 'category', 'period'))
+        # the splits of the third transaction of My Cash go to the
+        # transfer (no category) and to food:lunch, counted in food too
+        self.assertEqual(rollup.rows()[:3], [
+            ('My Cash', None, date(2013, 10, 1), 0, 2),
+            ('My Cash', 'food', date(2013, 10, 1), -2350, 2),
+            ('My Cash', 'food:lunch', date(2013, 10, 1), -2350, 2)])
+        self.assertEqual(rollup.get(account='My Cc',
+                                    period=date(1993, 8, 1)), (10000, 1))
+        self.assertEqual(len(rollup), 5)
+
+        rollup = self.qif.rollup(keys=('category',), subcategories=False)
+        # the memorized transactions are left out
+        self.assertEqual(rollup.rows(), [(None, 110000, 4),
+                                         ('food:lunch', -2350, 2)])
+        rollup = self.qif.rollup('week', keys=('period',))
+        self.assertEqual(rollup['period'][-2:], [date(2013, 10, 7),
+                                                  date(2013, 10, 21)])
+        self.assertEqual(list(rollup['total'][-2:]), [-1700, -650])
+        self.assertEqual(self.qif.rollup('year', ())['total'][0], 107650)
+        self.assertRaises(ValueError, self.qif.rollup, 'quarter')
+
+    def testMemorizedLeftOut(self):
+        qif_obj = QifParser.parseFile(
+            os.path.join(os.path.dirname(__file__), 'win2008.qif'),
+            '%m/%d/%y')
+        rollup = qif_obj.rollup(keys=('category',))
+        tree = qif_obj.category_tree()
+        for name in ('Auto', 'Auto:Gas'):
+            self.assertEqual(rollup.get(category=name)[0],
+                             tree.total(name))
+        self.assertEqual(rollup.get(category='Auto'), (-20045, 2))
+
+    def testRollupCache(self):
+        rollup = self.qif.rollup('year', keys=('account',), cents=True)
+        self.assertTrue(self.qif.rollup('year', keys=('account',),
+                                        cents=True) is rollup)
+        acc = self.qif.get_accounts('My Cc')[0]
+        acc.add_transaction(qif.Transaction(date=datetime(2013, 1, 1),
+                                            amount=Decimal('-1.50')))
+        totals = self.qif.rollup('year', keys=('account',), cents=True)
+        self.assertFalse(totals is rollup)
+        self.assertEqual(totals.get(account='My Cc'), (109850, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
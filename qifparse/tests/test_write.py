@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import unittest
+import io
 import os
+import six
 from qifparse.parser import QifParser
 
 filename = os.path.join(os.path.dirname(__file__), 'file.qif')
@@ -29,12 +31,12 @@ class TestQIFParsing(unittest.TestCase):
     # defined above, to create a version of the input that has no superfluous
     # whitespace at the end of lines.  (The alternative would be to make the
     # qif class retain the whitespace, which would be silly.)  Also, by virtue
-    # of the 'U' flag given to open, we are able to ignore newlines, and
-    # effectively create a version of the file with Unix-style newlines (by
-    # rejoining the individual lines with '\n'), which is what we compare with
-    # our output.
+    # of the universal newlines mode of io.open, we are able to ignore
+    # newlines, and effectively create a version of the file with Unix-style
+    # newlines (by rejoining the individual lines with '\n'), which is what we
+    # compare with our output.
     def testWriteFile(self):
-        data = open(filename, 'U').read()
+        data = io.open(filename).read()
         qif = QifParser.parseFile(filename, '%d/%m/%Y')
         stripped = stripAllLines(data)
 # If the strings are not equal, it could be useful to use the "diff" tool from
@@ -47,17 +49,29 @@ class TestQIFParsing(unittest.TestCase):
         self.assertEquals(stripped, str(qif))
 
     def testWriteWindowsUsaFile(self):
-        data = open(filename3, 'U').read()
+        data = io.open(filename3).read()
         qif = QifParser.parseFile(filename3, '%m/%d/%Y')
         stripped = stripAllLines(data)
         self.assertEquals(stripped, str(qif))
 
     def testWriteTransactionsFile(self):
-        data = open(filename2, 'U').read()
+        data = io.open(filename2).read()
         qif = QifParser.parseFile(filename2, '%d/%m/%Y')
         stripped = stripAllLines(data)
         self.assertEquals(stripped, str(qif))
 
+    def testStreamingWrite(self):
+        for (name, date_format) in ((filename, '%d/%m/%Y'),
+                                    (filename2, '%d/%m/%Y'),
+                                    (filename3, '%m/%d/%Y')):
+            qif = QifParser.parseFile(name, date_format)
+            out = six.StringIO()
+            qif.write(out, batch_size=3)
+            self.assertEqual(out.getvalue(), str(qif))
+            self.assertEqual(''.join(qif.iter_lines()), str(qif))
+            self.assertTrue(all(line.endswith('\n')
+                                for line in qif.iter_lines()))
+
 if __name__ == "__main__":
     import unittest
     unittest.main()
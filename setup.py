@@ -39,6 +39,9 @@ setup(name='qifparse',
           'setuptools',
           'six',
       ],
+      extras_require={
+          'columns': ['numpy'],
+      },
       entry_points="""
       """,
       )